@@ -0,0 +1,24 @@
+"""
+Quem pode usar as rotas de administração (/api/admin/*, /metrics)
+
+Os dois apps usam a mesma regra: a variável de ambiente ADMINS lista os
+administradores separados por vírgula (e-mails no main.py, nomes de usuário
+no scanner_api.py). Sem ADMINS ninguém é administrador: as rotas ficam
+fechadas até alguém ser configurado.
+
+    ADMINS=gerente@empresa.com,admin python main.py
+"""
+
+import os
+
+
+def ler_admins(texto=None):
+    """Conjunto de administradores (de ADMINS no ambiente quando texto é None)"""
+    if texto is None:
+        texto = os.environ.get('ADMINS', '')
+    return {nome.strip() for nome in texto.split(',') if nome.strip()}
+
+
+def eh_admin(usuario, admins):
+    """True se o usuário logado está na lista; lista vazia não libera ninguém"""
+    return bool(usuario) and usuario in admins
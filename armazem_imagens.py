@@ -0,0 +1,90 @@
+"""
+Armazém de imagens endereçado por conteúdo
+
+Cada imagem é gravada uma única vez como <sha256>.<ext> e o banco guarda só o
+nome do arquivo. Como o nome muda sempre que o conteúdo muda, as respostas
+podem ser cacheadas para sempre (Cache-Control immutable) e o ETag é o
+próprio hash.
+"""
+
+import base64
+import hashlib
+import os
+import tempfile
+
+from flask import send_from_directory
+
+from imagem_recebida import EXTENSOES, detectar_formato
+
+CACHE_MAX_AGE = 365 * 24 * 3600  # 1 ano: o conteúdo de um nome nunca muda
+
+
+def salvar_blob(pasta, dados, extensao):
+    """Grava os bytes (se ainda não existirem) e retorna o nome do arquivo"""
+    nome = f"{hashlib.sha256(dados).hexdigest()}.{extensao}"
+    caminho = os.path.join(pasta, nome)
+
+    if not os.path.exists(caminho):
+        # Grava em arquivo temporário e renomeia: leitores nunca veem arquivo pela metade
+        fd, temporario = tempfile.mkstemp(dir=pasta, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+        except Exception:
+            os.unlink(temporario)
+            raise
+
+    return nome
+
+
+def extensao_de(dados):
+    formato = detectar_formato(dados)
+    return EXTENSOES[formato] if formato else 'png'
+
+
+def servir_blob(pasta, nome):
+    """Resposta com ETag (o hash do conteúdo) e cache imutável; 304 quando o cliente já tem"""
+    etag = nome.rsplit('.', 1)[0]
+    # abspath: a pasta é relativa ao diretório de trabalho, como na gravação
+    resposta = send_from_directory(os.path.abspath(pasta), nome, max_age=CACHE_MAX_AGE, etag=etag, conditional=True)
+    resposta.cache_control.public = True
+    resposta.cache_control.immutable = True
+    return resposta
+
+
+def migrar_imagens_base64(conn, pasta, lote=100):
+    """
+    Migração única: move imagens guardadas em produtos.imagem_base64 para o
+    armazém e limpa a coluna. Processa em lotes para não carregar todas as
+    imagens na memória. Retorna quantos produtos foram migrados.
+    """
+    migrados = 0
+    ultimo_id = 0
+    while True:
+        linhas = conn.execute(
+            "SELECT id, imagem_base64 FROM produtos "
+            "WHERE id > ? AND imagem_base64 IS NOT NULL AND imagem_base64 != '' "
+            "ORDER BY id LIMIT ?",
+            (ultimo_id, lote)
+        ).fetchall()
+        if not linhas:
+            return migrados
+
+        atualizacoes = []
+        for linha in linhas:
+            ultimo_id = linha['id']
+            try:
+                dados = base64.b64decode(linha['imagem_base64'])
+                nome = salvar_blob(pasta, dados, extensao_de(dados))
+            except Exception as e:
+                print(f"❌ Erro ao migrar imagem do produto {linha['id']}: {e}")
+                continue
+            atualizacoes.append((nome, linha['id']))
+
+        conn.executemany(
+            "UPDATE produtos SET imagem_arquivo = ?, imagem_base64 = NULL WHERE id = ?",
+            atualizacoes
+        )
+        conn.commit()
+        migrados += len(atualizacoes)
@@ -0,0 +1,171 @@
+"""
+Conexões SQLite reaproveitadas entre requisições
+
+Cada requisição pega uma conexão do pool na primeira chamada a get_db() e a
+usa até o fim; o teardown_appcontext devolve a conexão ao pool (desfazendo
+transações abertas) em vez de fechá-la. As conexões já saem configuradas com
+WAL, synchronous=NORMAL, mmap e busy timeout, o que elimina o custo de abrir
+conexão a cada chamada e os erros de "database is locked" com vários
+scanners gravando ao mesmo tempo.
+"""
+
+import os
+import queue
+import sqlite3
+import time
+
+from flask import g, has_app_context
+
+TEMPO_ESPERA_BLOQUEIO = 5.0  # segundos (busy timeout)
+TAMANHO_MMAP = 256 * 1024 * 1024
+TAMANHO_POOL = 8
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA mmap_size={TAMANHO_MMAP}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+# Funções chamadas com (conexão, sql, parâmetros, duração em segundos) depois
+# de cada execute em qualquer conexão aberta por abrir_conexao (tempo por
+# etapa da requisição, testes). No executemany os parâmetros vêm como None:
+# o iterável já foi consumido.
+OUVINTES_SQL = []
+
+# Ouvintes de um arquivo de banco só (métricas e log de consultas lentas de
+# cada app): main.py e scanner_api.py importados no mesmo processo não somam
+# o SQL um do outro. Caminho absoluto -> lista, ver PoolConexoes.adicionar_ouvinte.
+_ouvintes_por_banco = {}
+
+
+def ouvintes_do_banco(caminho):
+    return _ouvintes_por_banco.setdefault(os.path.abspath(caminho), [])
+
+
+def _notificar(conn, sql, parametros, inicio):
+    duracao = time.perf_counter() - inicio
+    for ouvinte in OUVINTES_SQL:
+        ouvinte(conn, sql, parametros, duracao)
+    for ouvinte in conn.ouvintes:
+        ouvinte(conn, sql, parametros, duracao)
+
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que avisa OUVINTES_SQL da duração de cada comando"""
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            _notificar(self.connection, sql, parametros, inicio)
+
+    def executemany(self, sql, parametros):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            _notificar(self.connection, sql, None, inicio)
+
+
+class ConexaoMedida(sqlite3.Connection):
+    """
+    Conexão cujos cursores são CursorMedido. O execute da conexão não passa
+    pelo cursor() em Python, por isso é sobrescrito também; o commit conta
+    como um comando (é onde o WAL vai para o disco).
+    """
+
+    ouvintes = ()  # os do arquivo de banco, definidos em abrir_conexao
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def commit(self):
+        inicio = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _notificar(self, "COMMIT", None, inicio)
+
+
+def abrir_conexao(caminho):
+    """Abre uma conexão nova já configurada"""
+    # timeout = busy timeout do SQLite; check_same_thread=False porque a
+    # conexão passa de uma thread para outra entre requisições (nunca em paralelo)
+    conn = sqlite3.connect(caminho, timeout=TEMPO_ESPERA_BLOQUEIO, check_same_thread=False,
+                           factory=ConexaoMedida)
+    conn.row_factory = sqlite3.Row
+    conn.ouvintes = ouvintes_do_banco(caminho)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class PoolConexoes:
+    """Pool de conexões livres para um arquivo de banco"""
+
+    def __init__(self, caminho, tamanho=TAMANHO_POOL):
+        self.caminho = caminho
+        self._livres = queue.LifoQueue(maxsize=tamanho)
+
+    def adicionar_ouvinte(self, ouvinte):
+        """
+        Ouvinte (como os de OUVINTES_SQL) só das conexões deste banco: as do
+        pool e as avulsas abertas com abrir_conexao(caminho) pelas threads
+        de segundo plano
+        """
+        ouvintes = ouvintes_do_banco(self.caminho)
+        if ouvinte not in ouvintes:
+            ouvintes.append(ouvinte)
+
+    def obter(self):
+        try:
+            return self._livres.get_nowait()
+        except queue.Empty:
+            return abrir_conexao(self.caminho)
+
+    def devolver(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._livres.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+    def fechar_todas(self):
+        while True:
+            try:
+                self._livres.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def conexao_da_requisicao(pool):
+    """
+    Conexão da requisição atual, reaproveitada em todas as chamadas.
+    Fora de uma requisição (inicialização, scripts) devolve uma conexão
+    avulsa, que quem chamou deve fechar.
+    """
+    if not has_app_context():
+        return abrir_conexao(pool.caminho)
+
+    if 'db' not in g:
+        g.db = pool.obter()
+    return g.db
+
+
+def registrar_pool(app, pool):
+    """Devolve a conexão da requisição ao pool no fim do app context"""
+    @app.teardown_appcontext
+    def devolver_conexao(exc):
+        conn = g.pop('db', None)
+        if conn is not None:
+            pool.devolver(conn)
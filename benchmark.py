@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+Benchmark reproduzível das rotas do scanner e do estoque
+
+Sobe um dos apps (main.py ou, com --app scanner_api, scanner_api.py) numa
+pasta temporária, cadastra N produtos e M imagens sintéticas (tudo gerado a
+partir de uma semente fixa) e mede vazão e latência (p50/p95/p99) de cada
+cenário em dois modos:
+
+  client  Flask test client no mesmo processo: custo da rota, sem rede
+  http    servidor local (werkzeug com threads) e clientes concorrentes
+
+Cenários:
+  scan_codigo        main: POST /api/scan com o código (QR Code lido no celular)
+                     scanner_api: POST /api/scan com a foto do QR Code (lido no servidor)
+  scan_imagem        POST /api/scan com a foto (leitura de QR + comparação de imagem)
+  listar_produtos    GET /api/produtos (primeira página, 100 itens)
+  estoque            GET /estoque (página com todos os produtos; só no main)
+  cadastrar_scanner  POST /api/cadastrar_scanner (main) ou /api/cadastrar (scanner_api),
+                     produto novo com foto
+
+O resultado vai para um JSON (ambiente, parâmetros com o app e números por
+modo e cenário). Com --comparar, cada cenário é comparado com um JSON
+anterior do mesmo app e o programa termina com código 1 se algum p95 piorar
+mais que a tolerância.
+
+    python benchmark.py --produtos 5000 --saida resultado.json
+    python benchmark.py --modos client --comparar resultado.json
+    python benchmark.py --app scanner_api --saida scanner.json
+    python benchmark.py --app scanner_api --comparar scanner.json
+"""
+
+import argparse
+import base64
+import contextlib
+import importlib
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.client import HTTPConnection
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+PASTA_PROJETO = os.path.dirname(os.path.abspath(__file__))
+VERSAO_FORMATO = 1
+
+MODOS = ('client', 'http')
+APPS = ('main', 'scanner_api')
+CENARIOS = ('scan_codigo', 'scan_imagem', 'listar_produtos', 'estoque', 'cadastrar_scanner')
+CENARIOS_APP = {
+    'main': CENARIOS,
+    'scanner_api': ('scan_codigo', 'scan_imagem', 'listar_produtos', 'cadastrar_scanner'),
+}
+STATUS_ESPERADO = {'cadastrar_scanner': 201}  # os demais: 200
+FOTOS_QRCODE = 50  # QR Codes diferentes enviados no scan_codigo do scanner_api
+
+USUARIO = 'benchmark@local'  # main: e-mail; scanner_api: username
+SENHA = 'benchmark'
+CATEGORIAS = ('Ferramentas', 'Elétrica', 'Hidráulica', 'Pintura', 'Fixação')
+
+
+# -----------------------------------------------------------
+# DADOS SINTÉTICOS
+# -----------------------------------------------------------
+
+def imagem_sintetica(rnd, largura=320, altura=240):
+    """JPEG com fundo e formas aleatórias (dHash diferente para cada semente)"""
+    img = Image.new('RGB', (largura, altura), tuple(rnd.randrange(256) for _ in range(3)))
+    desenho = ImageDraw.Draw(img)
+    for _ in range(6):
+        x0, y0 = rnd.randrange(largura), rnd.randrange(altura)
+        x1, y1 = x0 + rnd.randrange(20, largura // 2), y0 + rnd.randrange(20, altura // 2)
+        cor = tuple(rnd.randrange(256) for _ in range(3))
+        if rnd.random() < 0.5:
+            desenho.rectangle((x0, y0, x1, y1), fill=cor)
+        else:
+            desenho.ellipse((x0, y0, x1, y1), fill=cor)
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def em_base64(dados, mimetype='image/jpeg'):
+    return f"data:{mimetype};base64," + base64.b64encode(dados).decode('ascii')
+
+
+def preparar_sistema(pasta, nome_app, produtos, imagens, semente):
+    """
+    Importa o app (main ou scanner_api) dentro de `pasta` (banco e imagens
+    ficam lá), cadastra o usuário, os produtos e as imagens. Retorna
+    (módulo do app, dados dos cenários).
+    """
+    os.chdir(pasta)
+    sys.path.insert(0, PASTA_PROJETO)
+    with silenciar():
+        modulo = importlib.import_module(nome_app)
+        modulo.preparar_banco()  # o cadastro abaixo vem antes de qualquer requisição
+
+    # Os templates ficam na raiz do projeto quando não há pasta templates/
+    if not os.path.isdir(os.path.join(modulo.app.root_path, modulo.app.template_folder)):
+        from jinja2 import FileSystemLoader
+        modulo.app.jinja_loader = FileSystemLoader(PASTA_PROJETO)
+
+    if nome_app == 'main':
+        pasta_imagens = modulo.app.config['SCANNER_FOLDER']
+    else:
+        pasta_imagens = modulo.UPLOAD_FOLDER
+
+    rnd = random.Random(semente)
+    # Reservados antes de abrir a transação do cadastro (a reserva usa outra conexão)
+    codigos = modulo.alocador_codigos.reservar(produtos)
+    fotos = []
+    agora = datetime.now()
+    linhas = []
+    for i, codigo in enumerate(codigos):
+        imagem_path = dhash = None
+        if i < imagens:
+            dados = imagem_sintetica(rnd)
+            imagem_path = f"benchmark_{i}.jpg"
+            with open(os.path.join(pasta_imagens, imagem_path), 'wb') as f:
+                f.write(dados)
+            dhash = modulo.hash_para_texto(modulo.ImagemRecebida.de_bytes(dados, modulo.MAX_IMAGE_SIZE).dhash)
+            fotos.append(em_base64(dados))
+        nome = f"Produto {i} {rnd.choice(CATEGORIAS)}"
+        linhas.append((nome, rnd.randrange(500), round(rnd.uniform(1, 500), 2),
+                       f"Corredor {i % 40} Prateleira {i % 7}", codigo, rnd.choice(CATEGORIAS),
+                       imagem_path, dhash, agora, agora))
+
+    conn = modulo.pool_conexoes.obter()
+    if nome_app == 'main':
+        conn.execute("INSERT OR IGNORE INTO users (email, password) VALUES (?, ?)", (USUARIO, SENHA))
+        conn.executemany("""
+            INSERT INTO produtos (nome, nome_normalizado, quantidade, preco, localizacao, codigo, categoria,
+                                  imagem_path, imagem_dhash, criado_em, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(linha[0], modulo.normalizar_nome(linha[0])) + linha[1:] for linha in linhas])
+    else:
+        conn.execute("INSERT OR IGNORE INTO usuarios (username, password) VALUES (?, ?)", (USUARIO, SENHA))
+        conn.executemany("""
+            INSERT INTO produtos (nome, quantidade, preco, localizacao, codigo, categoria,
+                                  imagem_path, imagem_dhash, criado_em, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, linhas)
+    conn.commit()
+    modulo.pool_conexoes.devolver(conn)
+
+    dados = {
+        "codigos": codigos,
+        "fotos": fotos,
+        # Fotos novas para os cadastros (não batem com as já cadastradas)
+        "fotos_cadastro": [em_base64(imagem_sintetica(rnd)) for _ in range(20)],
+    }
+    if nome_app == 'scanner_api':
+        # O scanner_api só recebe o frame da câmera: o código chega dentro do QR Code
+        from qrcodes import renderizar
+        dados["qrcodes"] = [em_base64(renderizar(codigo, 'png'), 'image/png')
+                            for codigo in rnd.sample(codigos, min(FOTOS_QRCODE, len(codigos)))]
+    return modulo, dados
+
+
+def montar_cenarios(nome_app, dados):
+    """Cenário -> função que sorteia a próxima requisição: (método, caminho, corpo JSON)"""
+    cadastros = itertools.count()
+
+    def cadastro(rnd):
+        return {
+            "nome": f"Cadastro benchmark {next(cadastros)}",
+            "localizacao": "Recebimento",
+            "quantidade": rnd.randrange(1, 50),
+            "preco": 9.9,
+            "imagem_base64": rnd.choice(dados['fotos_cadastro']),
+        }
+
+    if nome_app == 'scanner_api':
+        return {
+            'scan_codigo': lambda rnd: ('POST', '/api/scan', {"imagem": rnd.choice(dados['qrcodes'])}),
+            'scan_imagem': lambda rnd: ('POST', '/api/scan', {"imagem": rnd.choice(dados['fotos'])}),
+            'listar_produtos': lambda rnd: ('GET', '/api/produtos?limit=100', None),
+            'cadastrar_scanner': lambda rnd: ('POST', '/api/cadastrar', cadastro(rnd)),
+        }
+    return {
+        'scan_codigo': lambda rnd: ('POST', '/api/scan', {"codigo": rnd.choice(dados['codigos'])}),
+        'scan_imagem': lambda rnd: ('POST', '/api/scan', {"imagem": rnd.choice(dados['fotos'])}),
+        'listar_produtos': lambda rnd: ('GET', '/api/produtos?limit=100', None),
+        'estoque': lambda rnd: ('GET', '/estoque', None),
+        'cadastrar_scanner': lambda rnd: ('POST', '/api/cadastrar_scanner', cadastro(rnd)),
+    }
+
+
+# -----------------------------------------------------------
+# CLIENTES
+# -----------------------------------------------------------
+
+@contextlib.contextmanager
+def silenciar():
+    """Descarta os prints das rotas durante a medição"""
+    with open(os.devnull, 'w', encoding='utf-8') as nulo, contextlib.redirect_stdout(nulo):
+        yield
+
+
+class ClienteTeste:
+    """Flask test client já autenticado"""
+
+    def __init__(self, app, nome_app):
+        self.cliente = app.test_client()
+        with self.cliente.session_transaction() as sessao:
+            if nome_app == 'main':
+                sessao['user'] = USUARIO
+            else:
+                sessao['user_id'] = 1
+                sessao['username'] = USUARIO
+
+    def __call__(self, metodo, caminho, corpo):
+        resposta = self.cliente.open(caminho, method=metodo, json=corpo)
+        resposta.get_data()
+        return resposta.status_code
+
+
+class ServidorLocal:
+    """Servidor werkzeug com threads numa porta livre de 127.0.0.1"""
+
+    def __init__(self, app):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class Manipulador(WSGIRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive entre requisições do mesmo cliente
+
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.servidor = make_server('127.0.0.1', 0, app, threaded=True, request_handler=Manipulador)
+        self.porta = self.servidor.server_port
+        self.thread = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.servidor.shutdown()
+        self.thread.join()
+
+
+class ClienteHTTP:
+    """Conexão HTTP/1.1 própria, autenticada pelo /login (main) ou /api/login (scanner_api)"""
+
+    def __init__(self, porta, nome_app):
+        self.conexao = HTTPConnection('127.0.0.1', porta, timeout=60)
+        if nome_app == 'main':
+            self.conexao.request('POST', '/login', body=f"email={USUARIO}&password={SENHA}",
+                                 headers={'Content-Type': 'application/x-www-form-urlencoded'})
+            sucesso = 302
+        else:
+            self.conexao.request('POST', '/api/login', body=json.dumps({"username": USUARIO, "password": SENHA}),
+                                 headers={'Content-Type': 'application/json'})
+            sucesso = 200
+        resposta = self.conexao.getresponse()
+        resposta.read()
+        cookie = resposta.getheader('Set-Cookie')
+        if resposta.status != sucesso or not cookie:
+            raise RuntimeError(f"Login do benchmark falhou (HTTP {resposta.status})")
+        self.cookie = cookie.split(';', 1)[0]
+
+    def __call__(self, metodo, caminho, corpo):
+        cabecalhos = {'Cookie': self.cookie}
+        dados = None
+        if corpo is not None:
+            dados = json.dumps(corpo).encode('utf-8')
+            cabecalhos['Content-Type'] = 'application/json'
+        self.conexao.request(metodo, caminho, body=dados, headers=cabecalhos)
+        resposta = self.conexao.getresponse()
+        resposta.read()
+        return resposta.status
+
+    def fechar(self):
+        self.conexao.close()
+
+
+# -----------------------------------------------------------
+# MEDIÇÃO
+# -----------------------------------------------------------
+
+def percentil(ordenadas, p):
+    """Percentil pelo método nearest-rank"""
+    if not ordenadas:
+        return None
+    return ordenadas[max(0, math.ceil(p / 100 * len(ordenadas)) - 1)]
+
+
+def resumir(latencias, erros, duracao):
+    ordenadas = sorted(latencias)
+    ms = lambda valor: round(valor * 1000, 3) if valor is not None else None
+    return {
+        "requisicoes": len(latencias),
+        "erros": erros,
+        "duracao_s": round(duracao, 3),
+        "vazao_rps": round(len(latencias) / duracao, 1) if duracao else None,
+        "latencia_ms": {
+            "media": ms(sum(ordenadas) / len(ordenadas)) if ordenadas else None,
+            "p50": ms(percentil(ordenadas, 50)),
+            "p95": ms(percentil(ordenadas, 95)),
+            "p99": ms(percentil(ordenadas, 99)),
+            "max": ms(ordenadas[-1] if ordenadas else None),
+        },
+    }
+
+
+def medir(clientes, gerar, esperado, requisicoes, aquecimento, semente):
+    """
+    Dispara `requisicoes` requisições divididas entre os clientes (uma thread
+    por cliente) depois de `aquecimento` requisições não medidas.
+    """
+    aquecer = random.Random(f"{semente}-aquecimento")
+    for _ in range(aquecimento):
+        clientes[0](*gerar(aquecer))
+
+    restantes = itertools.count()
+    latencias = []
+    erros = [0]
+    lock = threading.Lock()
+
+    def trabalhar(numero, cliente):
+        rnd = random.Random(f"{semente}-{numero}")
+        minhas = []
+        falhas = 0
+        while next(restantes) < requisicoes:
+            metodo, caminho, corpo = gerar(rnd)
+            inicio = time.perf_counter()
+            try:
+                status = cliente(metodo, caminho, corpo)
+            except Exception:
+                status = None
+            minhas.append(time.perf_counter() - inicio)
+            falhas += status != esperado
+        with lock:
+            latencias.extend(minhas)
+            erros[0] += falhas
+
+    threads = [threading.Thread(target=trabalhar, args=(n, c)) for n, c in enumerate(clientes)]
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resumir(latencias, erros[0], time.perf_counter() - inicio)
+
+
+def aguardar_segundo_plano(modulo):
+    """Espera normalização de imagens e QR Codes dos cadastros (não contam no cenário seguinte)"""
+    for nome in ('fila_imagens', 'cache_qrcodes'):  # o scanner_api não tem trabalho em segundo plano
+        if hasattr(modulo, nome):
+            getattr(modulo, nome).aguardar()
+
+
+def executar(args):
+    pasta = tempfile.mkdtemp(prefix='benchmark_')
+    origem = os.getcwd()
+    try:
+        print(f"📦 Preparando {args.app}: {args.produtos} produtos ({args.imagens} com imagem) em {pasta}")
+        modulo, dados = preparar_sistema(pasta, args.app, args.produtos, args.imagens, args.semente)
+        geradores = montar_cenarios(args.app, dados)
+
+        resultados = {}
+        for modo in args.modos:
+            resultados[modo] = {}
+            servidor = ServidorLocal(modulo.app) if modo == 'http' else contextlib.nullcontext()
+            with servidor:
+                if modo == 'http':
+                    clientes = [ClienteHTTP(servidor.porta, args.app) for _ in range(args.concorrencia)]
+                else:
+                    # No mesmo processo, threads só disputariam o GIL
+                    clientes = [ClienteTeste(modulo.app, args.app)]
+
+                for cenario in args.cenarios:
+                    with silenciar():
+                        resumo = medir(clientes, geradores[cenario], STATUS_ESPERADO.get(cenario, 200),
+                                       args.requisicoes, args.aquecimento, args.semente)
+                        aguardar_segundo_plano(modulo)
+                    resultados[modo][cenario] = resumo
+                    latencia = resumo['latencia_ms']
+                    print(f"  {modo:6} {cenario:18} {resumo['vazao_rps']:8.1f} req/s  "
+                          f"p50 {latencia['p50']:8.2f}ms  p95 {latencia['p95']:8.2f}ms  "
+                          f"p99 {latencia['p99']:8.2f}ms  erros {resumo['erros']}")
+
+                for cliente in clientes:
+                    if hasattr(cliente, 'fechar'):
+                        cliente.fechar()
+        return resultados
+    finally:
+        os.chdir(origem)
+        if args.manter_pasta:
+            print(f"📁 Pasta mantida: {pasta}")
+        else:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+
+def ambiente():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PASTA_PROJETO,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    try:
+        from importlib.metadata import version
+        flask = version('flask')
+    except Exception:
+        flask = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "flask": flask,
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+# -----------------------------------------------------------
+# COMPARAÇÃO
+# -----------------------------------------------------------
+
+def comparar(anterior, atual, tolerancia, piora_minima_ms=1.0):
+    """
+    Compara o p95 de cada modo/cenário presente nos dois resultados.
+    Retorna as regressões: p95 maior que o anterior * (1 + tolerância) e
+    pelo menos piora_minima_ms mais lento (ruído em rotas muito rápidas).
+    """
+    regressoes = []
+    for modo, cenarios in atual['resultados'].items():
+        for cenario, resumo in cenarios.items():
+            antes = anterior.get('resultados', {}).get(modo, {}).get(cenario)
+            if not antes:
+                continue
+            p95_antes = antes['latencia_ms']['p95']
+            p95_agora = resumo['latencia_ms']['p95']
+            if p95_antes is None or p95_agora is None:
+                continue
+            variacao = (p95_agora - p95_antes) / p95_antes if p95_antes else 0.0
+            regrediu = variacao > tolerancia and p95_agora - p95_antes >= piora_minima_ms
+            marca = '❌' if regrediu else '✅'
+            print(f"  {marca} {modo:6} {cenario:18} p95 {p95_antes:8.2f}ms → {p95_agora:8.2f}ms ({variacao:+.0%})")
+            if regrediu:
+                regressoes.append((modo, cenario, p95_antes, p95_agora))
+    return regressoes
+
+
+# -----------------------------------------------------------
+# LINHA DE COMANDO
+# -----------------------------------------------------------
+
+def lista(opcoes):
+    def converter(texto):
+        itens = [item.strip() for item in texto.split(',') if item.strip()]
+        invalidos = [item for item in itens if item not in opcoes]
+        if invalidos or not itens:
+            raise argparse.ArgumentTypeError(f"use um ou mais de: {', '.join(opcoes)}")
+        return itens
+    return converter
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das rotas do scanner e do estoque")
+    parser.add_argument('--app', choices=APPS, default='main', help="serviço medido (padrão: main)")
+    parser.add_argument('--produtos', type=int, default=2000, help="produtos cadastrados antes da medição")
+    parser.add_argument('--imagens', type=int, default=200, help="quantos desses produtos têm foto")
+    parser.add_argument('--requisicoes', type=int, default=200, help="requisições medidas por cenário")
+    parser.add_argument('--aquecimento', type=int, default=20, help="requisições não medidas antes de cada cenário")
+    parser.add_argument('--concorrencia', type=int, default=4, help="clientes simultâneos no modo http")
+    parser.add_argument('--modos', type=lista(MODOS), default=list(MODOS))
+    parser.add_argument('--cenarios', type=lista(CENARIOS), help="padrão: todos os do app")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', default='benchmark.json')
+    parser.add_argument('--comparar', help="JSON de uma execução anterior")
+    parser.add_argument('--tolerancia', type=float, default=0.2, help="piora aceita no p95 (0.2 = 20%%)")
+    parser.add_argument('--manter-pasta', action='store_true', help="não apaga a pasta temporária com o banco")
+    args = parser.parse_args(argv)
+    if args.cenarios is None:
+        args.cenarios = list(CENARIOS_APP[args.app])
+    sem_rota = [cenario for cenario in args.cenarios if cenario not in CENARIOS_APP[args.app]]
+    if sem_rota:
+        parser.error(f"cenário(s) sem rota no {args.app}: {', '.join(sem_rota)}")
+    if args.imagens > args.produtos:
+        parser.error("--imagens não pode ser maior que --produtos")
+    if 'scan_imagem' in args.cenarios and not args.imagens:
+        parser.error("o cenário scan_imagem precisa de --imagens maior que 0")
+
+    # Lido antes de mudar de pasta (o caminho pode ser relativo)
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            anterior = json.load(f)
+        # Resultados sem "app" são de antes do --app: sempre do main
+        app_anterior = anterior.get('parametros', {}).get('app', 'main')
+        if app_anterior != args.app:
+            parser.error(f"{args.comparar} mediu o {app_anterior}; rode com --app {app_anterior} "
+                         f"ou compare com um resultado do {args.app}")
+    saida = os.path.abspath(args.saida)
+
+    resultado = {
+        "versao_formato": VERSAO_FORMATO,
+        "data": datetime.now().isoformat(timespec='seconds'),
+        "ambiente": ambiente(),
+        "parametros": {
+            "app": args.app,
+            "produtos": args.produtos,
+            "imagens": args.imagens,
+            "requisicoes": args.requisicoes,
+            "aquecimento": args.aquecimento,
+            "concorrencia": args.concorrencia,
+            "semente": args.semente,
+        },
+        "resultados": executar(args),
+    }
+
+    with open(saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"✅ Resultado em {saida}")
+
+    if anterior is not None:
+        print(f"📊 Comparação com {args.comparar} (tolerância {args.tolerancia:.0%} no p95):")
+        if anterior.get('parametros') != resultado['parametros']:
+            print(f"⚠️ Parâmetros diferentes da execução anterior: {anterior.get('parametros')}")
+        regressoes = comparar(anterior, resultado, args.tolerancia)
+        if regressoes:
+            print(f"❌ {len(regressoes)} cenário(s) mais lento(s)")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
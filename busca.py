@@ -0,0 +1,165 @@
+"""
+Busca por texto nos produtos (índice FTS5 do SQLite)
+
+A tabela virtual produtos_fts indexa nome, categoria, codigo e localizacao
+sem duplicar o conteúdo (content='produtos'); gatilhos mantêm o índice em dia
+a cada INSERT, DELETE e UPDATE dessas colunas, então nenhuma rota precisa se
+lembrar dele. O tokenizador ignora maiúsculas e acentos, e o índice de
+prefixos (2 e 3 letras) deixa rápida a busca enquanto o usuário digita.
+
+Todas as palavras da busca precisam aparecer; a última vale como prefixo,
+porque é a que o usuário ainda está digitando ("chave ing" encontra "Chave
+Inglesa"). Um prefixo casa com muitos termos, e o FTS5 junta as listas de
+todos eles antes de responder, então só a última palavra paga esse custo.
+
+Relevância em duas etapas. O FTS5 ordena os resultados pelo bm25 com os
+mesmos PESOS por coluna e entrega só os CANDIDATOS_MAX melhores; a ordem
+final é feita aqui, entre eles, pela coluna onde cada palavra aparece (o
+nome pesa mais) e com bônus quando o nome começa pelo que foi digitado.
+Ordenar pelo bm25 antes do corte é o que garante que o melhor resultado de
+um prefixo comum esteja entre os candidatos (cortando na ordem do rowid,
+ficariam só os produtos mais antigos). O custo é percorrer a lista inteira
+de cada termo em vez de parar no CANDIDATOS_MAX-ésimo resultado.
+"""
+
+import re
+
+from nomes import normalizar_nome
+
+LIMITE_PADRAO = 10
+LIMITE_MAX = 50
+MAX_PALAVRAS = 8
+# Quantos resultados do índice, os melhores pelo bm25, são pontuados aqui
+CANDIDATOS_MAX = 200
+
+# Peso de cada coluna na relevância: nome, categoria, codigo, localizacao
+PESOS = (10.0, 2.0, 5.0, 1.0)
+
+_PALAVRA = re.compile(r'\w+')
+
+TABELA = """
+    CREATE VIRTUAL TABLE produtos_fts USING fts5(
+        nome, categoria, codigo, localizacao,
+        content='produtos', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+"""
+
+GATILHOS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_insert AFTER INSERT ON produtos BEGIN
+        INSERT INTO produtos_fts (rowid, nome, categoria, codigo, localizacao)
+        VALUES (new.id, new.nome, new.categoria, new.codigo, new.localizacao);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_delete AFTER DELETE ON produtos BEGIN
+        INSERT INTO produtos_fts (produtos_fts, rowid, nome, categoria, codigo, localizacao)
+        VALUES ('delete', old.id, old.nome, old.categoria, old.codigo, old.localizacao);
+    END
+    """,
+    # Só quando muda uma coluna indexada (mudar a quantidade não mexe no índice)
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_update
+    AFTER UPDATE OF nome, categoria, codigo, localizacao ON produtos BEGIN
+        INSERT INTO produtos_fts (produtos_fts, rowid, nome, categoria, codigo, localizacao)
+        VALUES ('delete', old.id, old.nome, old.categoria, old.codigo, old.localizacao);
+        INSERT INTO produtos_fts (rowid, nome, categoria, codigo, localizacao)
+        VALUES (new.id, new.nome, new.categoria, new.codigo, new.localizacao);
+    END
+    """,
+)
+
+
+class BuscaInvalida(ValueError):
+    """Termo de busca vazio ou limite inválido"""
+
+
+def indice_busca_existe(conn):
+    """True se a tabela FTS já foi criada (consulta só o sqlite_master)"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'produtos_fts'"
+    ).fetchone() is not None
+
+
+def criar_indice_busca(cursor):
+    """
+    Cria a tabela FTS e os gatilhos. Na primeira vez, indexa os produtos já
+    cadastrados. Retorna False se o SQLite não tiver FTS5.
+    """
+    if not indice_busca_existe(cursor):
+        try:
+            cursor.execute(TABELA)
+        except Exception as e:
+            if 'fts5' not in str(e):
+                raise
+            return False
+        cursor.execute("INSERT INTO produtos_fts (produtos_fts) VALUES ('rebuild')")
+    for sql in GATILHOS:
+        cursor.execute(sql)
+    return True
+
+
+def separar_palavras(termo):
+    """Palavras da busca, já sem acentos e em minúsculas"""
+    palavras = _PALAVRA.findall(normalizar_nome(termo))[:MAX_PALAVRAS]
+    if not palavras:
+        raise BuscaInvalida("Informe o termo de busca em 'q'")
+    return palavras
+
+
+def montar_consulta_fts(palavras):
+    """
+    Expressão MATCH do FTS5: palavras entre aspas (operadores digitados pelo
+    usuário não chegam ao FTS5), a última como prefixo
+    """
+    return ' '.join(f'"{palavra}"' for palavra in palavras) + '*'
+
+
+def pontuar(linha, palavras):
+    """Relevância de um candidato: peso da coluna de cada palavra, mais o bônus de início do nome"""
+    nome = linha['nome_normalizado'] or ''
+    colunas = (nome, linha['categoria'], linha['codigo'], linha['localizacao'])
+    ultima = len(palavras) - 1
+    pontos = 0.0
+    for peso, texto in zip(PESOS, colunas):
+        tokens = _PALAVRA.findall(normalizar_nome(texto or ''))
+        for posicao, palavra in enumerate(palavras):
+            if palavra in tokens:
+                pontos += peso
+            elif posicao == ultima and any(token.startswith(palavra) for token in tokens):
+                pontos += peso / 2
+    if nome.startswith(' '.join(palavras)):
+        pontos += PESOS[0]
+    return pontos
+
+
+def ler_limite(valor):
+    if valor is None or valor == '':
+        return LIMITE_PADRAO
+    try:
+        limite = int(valor)
+    except ValueError:
+        raise BuscaInvalida("'limit' deve ser um número inteiro")
+    if limite < 1 or limite > LIMITE_MAX:
+        raise BuscaInvalida(f"'limit' deve estar entre 1 e {LIMITE_MAX}")
+    return limite
+
+
+def buscar_produtos(conn, termo, limite=LIMITE_PADRAO):
+    """Linhas (id, nome, codigo, categoria, localizacao, quantidade, miniatura_arquivo) por relevância"""
+    palavras = separar_palavras(termo)
+    # O corte fica com os mais relevantes pelo bm25 (mesmos pesos), não os primeiros pelo rowid
+    candidatos = conn.execute(f"""
+        SELECT p.id, p.nome, p.nome_normalizado, p.codigo, p.categoria, p.localizacao,
+               p.quantidade, p.miniatura_arquivo
+        FROM (
+            SELECT rowid AS id FROM produtos_fts WHERE produtos_fts MATCH ?
+            ORDER BY bm25(produtos_fts, {', '.join(map(str, PESOS))}) LIMIT ?
+        ) AS candidatos
+        JOIN produtos p ON p.id = candidatos.id
+    """, (montar_consulta_fts(palavras), CANDIDATOS_MAX)).fetchall()
+
+    candidatos.sort(key=lambda linha: (-pontuar(linha, palavras), len(linha['nome']), linha['nome']))
+    return candidatos[:limite]
@@ -0,0 +1,143 @@
+"""
+Cache em memória dos produtos consultados por id e por código
+
+Poucas centenas de produtos respondem pela maioria dos escaneamentos, e cada
+escaneamento (e cada consulta de /api/produto/<id>) ia ao SQLite. O cache
+guarda as linhas mais usadas (LRU, até MAX_ITENS) com a ETag de cada uma,
+calculada uma vez quando a linha entra: um cliente que consulta o mesmo
+produto de tempos em tempos recebe 304 sem consulta ao banco e sem montar
+o JSON.
+
+Toda rota que grava num produto chama invalidar(id) depois do commit. O
+cache é de cada processo: gravações feitas por outro processo (outro worker
+do servidor, a importação pela linha de comando) só aparecem quando a linha
+expira (TTL), que é a rede de segurança para o que não passa pelo
+invalidar.
+
+Uma leitura que começou antes de uma gravação não devolve ao cache a linha
+antiga: guardar() recebe a versão do cache lida antes da consulta e
+descarta a linha se alguma invalidação aconteceu no meio.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ITENS = 2000
+TTL = 10.0  # segundos
+
+
+def etag_produto(produto):
+    """ETag da linha inteira: muda com qualquer coluna"""
+    conteudo = repr(tuple(produto.items())).encode('utf-8')
+    return hashlib.blake2b(conteudo, digest_size=12).hexdigest()
+
+
+class CacheProdutos:
+    """LRU de produtos por id, com índice por código; seguro entre threads"""
+
+    def __init__(self, max_itens=MAX_ITENS, ttl=TTL):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()  # id -> (produto, etag, expira)
+        self._codigos = {}  # codigo -> id
+        self._versao = 0
+
+    def versao(self):
+        return self._versao
+
+    def _obter(self, produto_id):
+        # Chamado com o lock
+        item = self._itens.get(produto_id)
+        if item is None:
+            return None
+        if item[2] < time.monotonic():
+            self._remover(produto_id)
+            return None
+        self._itens.move_to_end(produto_id)
+        return item[0], item[1]
+
+    def _remover(self, produto_id):
+        # Chamado com o lock
+        item = self._itens.pop(produto_id, None)
+        if item is not None and self._codigos.get(item[0]['codigo']) == produto_id:
+            del self._codigos[item[0]['codigo']]
+
+    def por_id(self, produto_id):
+        """(produto, etag) ou None"""
+        with self._lock:
+            return self._obter(produto_id)
+
+    def por_codigo(self, codigo):
+        """(produto, etag) ou None"""
+        with self._lock:
+            produto_id = self._codigos.get(codigo)
+            return self._obter(produto_id) if produto_id is not None else None
+
+    def guardar(self, linha, versao):
+        """
+        Guarda a linha lida do banco e retorna (produto, etag). Se houve
+        invalidação depois de `versao`, a linha pode estar velha: volta para
+        quem consultou, mas não entra no cache.
+        """
+        produto = dict(linha)
+        etag = etag_produto(produto)
+        with self._lock:
+            if versao == self._versao:
+                self._remover(produto['id'])
+                self._itens[produto['id']] = (produto, etag, time.monotonic() + self.ttl)
+                if produto.get('codigo'):
+                    self._codigos[produto['codigo']] = produto['id']
+                while len(self._itens) > self.max_itens:
+                    self._remover(next(iter(self._itens)))
+        return produto, etag
+
+    def invalidar(self, *produto_ids):
+        with self._lock:
+            self._versao += 1
+            for produto_id in produto_ids:
+                self._remover(produto_id)
+
+    def limpar(self):
+        with self._lock:
+            self._versao += 1
+            self._itens.clear()
+            self._codigos.clear()
+
+    def buscar_por_id(self, conn, produto_id):
+        """(produto, etag) do cache ou do banco; (None, None) se não existe"""
+        item = self.por_id(produto_id)
+        if item is not None:
+            return item
+        versao = self.versao()
+        linha = conn.execute("SELECT * FROM produtos WHERE id = ?", (produto_id,)).fetchone()
+        return self.guardar(linha, versao) if linha else (None, None)
+
+    def buscar_por_codigo(self, conn, codigo):
+        """(produto, etag) do cache ou do banco; (None, None) se não existe"""
+        item = self.por_codigo(codigo)
+        if item is not None:
+            return item
+        versao = self.versao()
+        linha = conn.execute("SELECT * FROM produtos WHERE codigo = ?", (codigo,)).fetchone()
+        return self.guardar(linha, versao) if linha else (None, None)
+
+    def buscar_por_codigos(self, conn, codigos):
+        """{codigo: produto} dos que existem; só os que faltam no cache vão ao banco"""
+        encontrados = {}
+        faltando = []
+        for codigo in codigos:
+            item = self.por_codigo(codigo)
+            if item is not None:
+                encontrados[codigo] = item[0]
+            else:
+                faltando.append(codigo)
+        if faltando:
+            versao = self.versao()
+            marcadores = ", ".join("?" * len(faltando))
+            for linha in conn.execute(f"SELECT * FROM produtos WHERE codigo IN ({marcadores})", faltando):
+                produto, _ = self.guardar(linha, versao)
+                encontrados[produto['codigo']] = produto
+        return encontrados
@@ -0,0 +1,143 @@
+"""
+Alocação dos códigos de 6 dígitos dos produtos
+
+Os códigos saem de uma permutação fixa de 000000..999999: a posição n da
+sequência vira o código (n * MULTIPLICADOR + DESLOCAMENTO) mod 10^6. Como o
+multiplicador é primo com 10^6, cada posição dá um código diferente, e
+códigos vizinhos não saem em sequência. A próxima posição livre fica na
+tabela sequencia_codigos, então alocar é O(1), sem sortear e consultar até
+achar um código livre (o que fica cada vez mais caro conforme a faixa enche).
+
+Reservar um bloco é uma transação BEGIN IMMEDIATE que avança o contador:
+processos diferentes (vários workers do servidor, a importação pela linha de
+comando) recebem faixas disjuntas. Posições cujo código já existe no banco
+(códigos antigos, sorteados, ou informados na importação) são puladas na
+reserva. O índice único em produtos(codigo) é a garantia final.
+
+Códigos de produtos apagados não voltam para a sequência.
+"""
+
+import os
+import threading
+
+from banco_dados import abrir_conexao
+
+TOTAL_CODIGOS = 10 ** 6
+MULTIPLICADOR = 618_033  # ímpar e não múltiplo de 5: primo com 10^6
+DESLOCAMENTO = 271_828
+TAMANHO_BLOCO = 32  # códigos reservados por vez por processo
+LOTE_CONSULTA = 500  # códigos por consulta IN (...)
+
+
+class CodigosEsgotados(RuntimeError):
+    """Todas as posições da sequência já foram usadas"""
+
+
+def criar_tabela(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sequencia_codigos (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            proximo INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO sequencia_codigos (id, proximo) VALUES (1, 0)")
+
+
+def codigo_da_posicao(posicao):
+    return f"{(posicao * MULTIPLICADOR + DESLOCAMENTO) % TOTAL_CODIGOS:06d}"
+
+
+def codigos_existentes(conn, codigos):
+    """Quais dos códigos já estão no banco (consultas IN em blocos)"""
+    codigos = list(codigos)
+    existentes = set()
+    for inicio in range(0, len(codigos), LOTE_CONSULTA):
+        bloco = codigos[inicio:inicio + LOTE_CONSULTA]
+        marcadores = ", ".join("?" * len(bloco))
+        existentes.update(
+            linha[0] for linha in conn.execute(
+                f"SELECT codigo FROM produtos WHERE codigo IN ({marcadores})", bloco
+            )
+        )
+    return existentes
+
+
+def reservar_codigos(conn, quantidade, reservados=()):
+    """
+    Reserva `quantidade` códigos livres numa transação própria e os retorna
+    na ordem da sequência.
+
+    conn não pode ter transação aberta (a reserva é confirmada na hora, para
+    que outro processo nunca receba os mesmos códigos).
+    reservados: códigos que o chamador vai usar e que ainda não estão no banco
+    """
+    if conn.in_transaction:
+        raise RuntimeError("reservar_codigos precisa de uma conexão sem transação aberta")
+
+    reservados = set(reservados)
+    codigos = []
+    # IMMEDIATE pega o lock de escrita já na leitura do contador
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        criar_tabela(conn)
+        proximo = conn.execute("SELECT proximo FROM sequencia_codigos WHERE id = 1").fetchone()[0]
+        while len(codigos) < quantidade:
+            if proximo >= TOTAL_CODIGOS:
+                raise CodigosEsgotados("Todos os códigos de 6 dígitos já foram usados")
+            fim = min(proximo + quantidade - len(codigos), TOTAL_CODIGOS)
+            candidatos = [codigo_da_posicao(posicao) for posicao in range(proximo, fim)]
+            ocupados = codigos_existentes(conn, candidatos) | reservados
+            codigos += [codigo for codigo in candidatos if codigo not in ocupados]
+            proximo = fim
+        conn.execute("UPDATE sequencia_codigos SET proximo = ? WHERE id = 1", (proximo,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return codigos
+
+
+class AlocadorCodigos:
+    """
+    Entrega códigos um a um a partir de blocos reservados no banco, para que
+    a maioria dos cadastros nem toque na tabela da sequência. Usa conexão
+    própria, fora da transação da requisição.
+
+    Os códigos já ocupados são pulados na reserva do bloco (uma consulta
+    IN para o bloco todo); entregar um código não consulta o banco. Um
+    código informado à mão depois da reserva (importação) que caia no bloco
+    esbarra no índice único de produtos(codigo) ao ser gravado.
+
+    Depois de um fork (workers que herdam o objeto) o bloco herdado é
+    descartado, senão dois processos entregariam os mesmos códigos. Os
+    códigos de um bloco não usado até o fim do processo se perdem.
+    """
+
+    def __init__(self, caminho_banco, bloco=TAMANHO_BLOCO):
+        self.caminho_banco = caminho_banco
+        self.bloco = bloco
+        self._lock = threading.Lock()
+        self._pid = None
+        self._conn = None
+        self._livres = []
+
+    def _conexao(self):
+        if self._pid != os.getpid():
+            # Processo novo: nada do pai (conexão, bloco) pode ser reaproveitado
+            self._pid = os.getpid()
+            self._conn = abrir_conexao(self.caminho_banco)
+            self._livres = []
+        return self._conn
+
+    def proximo(self):
+        """Um código livre (chame só quando o cadastro já foi validado: código entregue não volta)"""
+        with self._lock:
+            conn = self._conexao()  # descarta o bloco herdado num processo novo
+            if not self._livres:
+                self._livres = reservar_codigos(conn, self.bloco)[::-1]
+            return self._livres.pop()
+
+    def reservar(self, quantidade, reservados=()):
+        """Bloco de `quantidade` códigos livres para trabalhos em lote"""
+        with self._lock:
+            return reservar_codigos(self._conexao(), quantidade, reservados)
@@ -0,0 +1,81 @@
+"""
+Fixtures comuns dos testes: os dois apps com banco numa pasta temporária
+
+main.py e scanner_api.py criam banco e pastas relativos ao diretório atual
+e guardam estado no módulo (pool de conexões, caches, filas), então cada
+app é importado uma vez por sessão, dentro da mesma pasta temporária, com
+TOTAL_PRODUTOS produtos cadastrados. Testes que cadastram produtos usam
+nomes e códigos próprios para não mudar os que os outros consultam.
+"""
+
+import os
+
+import pytest
+from jinja2 import FileSystemLoader
+
+PASTA_PROJETO = os.path.dirname(os.path.abspath(__file__))
+TOTAL_PRODUTOS = 2000
+
+
+@pytest.fixture(scope='session')
+def pasta(tmp_path_factory):
+    """Os dois apps criam banco e pastas relativos ao diretório atual"""
+    anterior = os.getcwd()
+    pasta = tmp_path_factory.mktemp('apps')
+    os.chdir(pasta)
+    # Absoluta: as métricas também são gravadas no atexit, depois de voltar ao diretório anterior
+    os.environ['METRICAS_DIR'] = str(pasta / 'metricas')
+    yield
+    os.chdir(anterior)
+
+
+@pytest.fixture(scope='session')
+def main(pasta):
+    import main
+    from nomes import normalizar_nome
+
+    main.app.jinja_loader = FileSystemLoader(PASTA_PROJETO)
+    main.preparar_banco()
+    conn = main.pool_conexoes.obter()
+    conn.executemany(
+        "INSERT INTO produtos (nome, nome_normalizado, quantidade, preco, localizacao, codigo, categoria) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(f"Produto {i}", normalizar_nome(f"Produto {i}"), i % 50, 9.9, f"A{i % 20}", f"{i:06d}", f"Cat{i % 7}")
+         for i in range(1, TOTAL_PRODUTOS + 1)]
+    )
+    conn.commit()
+    main.pool_conexoes.devolver(conn)
+    return main
+
+
+@pytest.fixture(scope='session')
+def scanner_api(pasta):
+    import scanner_api
+
+    scanner_api.preparar_banco()
+    conn = scanner_api.pool_conexoes.obter()
+    conn.executemany(
+        "INSERT INTO produtos (codigo, nome, localizacao, quantidade, preco, categoria) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"{i:06d}", f"Produto {i}", f"A{i % 20}", i % 50, 9.9, f"Cat{i % 7}")
+         for i in range(1, TOTAL_PRODUTOS + 1)]
+    )
+    conn.commit()
+    scanner_api.pool_conexoes.devolver(conn)
+    return scanner_api
+
+
+@pytest.fixture
+def cliente_main(main):
+    cliente = main.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['user'] = 'teste@local'
+    return cliente
+
+
+@pytest.fixture
+def cliente_scanner(scanner_api):
+    cliente = scanner_api.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['user_id'] = 1
+        sessao['username'] = 'admin'
+    return cliente
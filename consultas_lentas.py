@@ -0,0 +1,205 @@
+"""
+Log de consultas lentas e estatísticas por SQL normalizado
+
+Ouve todos os comandos das conexões de um banco (ver
+PoolConexoes.adicionar_ouvinte) e mantém, por texto SQL normalizado (literais e listas de
+IN viram ?), execuções, tempo total e máximo, quantas passaram do limite e o
+plano da consulta (EXPLAIN QUERY PLAN), capturado na primeira execução e de
+novo quando ela fica lenta. Assim uma consulta que percorre a tabela inteira
+(`SCAN produtos`) aparece antes de o banco crescer.
+
+Comandos acima de `limite_ms` viram uma linha JSON no log:
+
+    {"data": "...", "duracao_ms": 73.1, "sql": "SELECT ... WHERE quantidade <= ?",
+     "parametros": ["int"], "plano": ["SCAN produtos"], "varredura_completa": true,
+     "rota": "/estoque", "pid": 4242}
+
+Os parâmetros aparecem só pelo formato (tipo e tamanho), nunca pelo valor.
+As estatísticas são do processo (cada worker tem as suas).
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import has_request_context, request
+
+
+LIMITE_MS = 50
+LOG_CONSULTAS_LENTAS = 'consultas_lentas.jsonl'
+MAX_CONSULTAS = 500  # textos normalizados acompanhados (o resto vai para "descartadas")
+VALIDADE_PLANO = 60.0  # segundos até uma consulta lenta ter o plano capturado de novo
+
+COMANDOS_COM_PLANO = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+ORDENS = ('total', 'media', 'max', 'execucoes', 'lentas')
+
+_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_ESPACOS = re.compile(r"\s+")
+
+
+def normalizar_sql(sql):
+    """Texto do comando sem literais, com listas de ? colapsadas e espaços únicos"""
+    sql = _TEXTO.sub('?', sql)
+    sql = _NUMERO.sub('?', sql)
+    sql = _LISTA.sub('(?, ...)', sql)
+    return _ESPACOS.sub(' ', sql).strip()
+
+
+def _forma(valor):
+    if valor is None:
+        return 'null'
+    if isinstance(valor, (str, bytes)):
+        return f"{type(valor).__name__}({len(valor)})"
+    return type(valor).__name__
+
+
+def formas_parametros(parametros):
+    """Tipo (e tamanho) de cada parâmetro, sem os valores"""
+    if parametros is None:
+        return None
+    if isinstance(parametros, dict):
+        return {nome: _forma(valor) for nome, valor in parametros.items()}
+    return [_forma(valor) for valor in parametros]
+
+
+def plano_consulta(conn, sql, parametros=()):
+    """
+    Linhas do EXPLAIN QUERY PLAN (ex.: "SEARCH produtos USING INDEX
+    idx_produto_codigo (codigo=?)"). Usa o execute do sqlite3 direto, que não
+    passa pelos ouvintes de SQL.
+    """
+    linhas = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parametros).fetchall()
+    return [linha[3] for linha in linhas]
+
+
+def varredura_completa(plano, tabelas=None):
+    """
+    True se alguma tabela é lida inteira, sem índice. Com `tabelas`, só
+    conta a varredura dessas (nomes ou apelidos usados no SQL).
+    """
+    for passo in plano:
+        if not passo.startswith('SCAN ') or ' USING ' in passo or 'VIRTUAL TABLE' in passo:
+            continue
+        tabela = passo.split()[1]
+        if tabela == 'CONSTANT':
+            continue
+        if tabelas is None or tabela in tabelas:
+            return True
+    return False
+
+
+class RegistroConsultas:
+    """
+    Ouvinte das conexões de um banco: estatísticas por SQL normalizado e log
+    das consultas lentas. instalar(pool) começa a ouvir.
+    """
+
+    def __init__(self, limite_ms=LIMITE_MS, caminho_log=LOG_CONSULTAS_LENTAS, max_consultas=MAX_CONSULTAS):
+        self.limite_ms = limite_ms
+        self.caminho_log = caminho_log
+        self.max_consultas = max_consultas
+        self._lock = threading.Lock()
+        self._normalizados = {}  # sql -> normalizado (evita as regex a cada execução)
+        self._consultas = {}  # normalizado -> estatísticas
+        self.descartadas = 0
+
+    def instalar(self, pool):
+        pool.adicionar_ouvinte(self)
+
+    def _normalizado(self, sql):
+        normalizado = self._normalizados.get(sql)
+        if normalizado is None:
+            if len(self._normalizados) >= self.max_consultas * 4:
+                self._normalizados.clear()
+            normalizado = self._normalizados[sql] = normalizar_sql(sql)
+        return normalizado
+
+    def __call__(self, conn, sql, parametros, duracao):
+        normalizado = self._normalizado(sql)
+        lenta = duracao * 1000 >= self.limite_ms
+        with self._lock:
+            consulta = self._consultas.get(normalizado)
+            if consulta is None:
+                if len(self._consultas) >= self.max_consultas:
+                    self.descartadas += 1
+                    return
+                consulta = self._consultas[normalizado] = {
+                    'execucoes': 0, 'total': 0.0, 'max': 0.0, 'lentas': 0,
+                    'plano': None, 'plano_em': None,
+                }
+            consulta['execucoes'] += 1
+            consulta['total'] += duracao
+            consulta['max'] = max(consulta['max'], duracao)
+            if lenta:
+                consulta['lentas'] += 1
+            capturar = consulta['plano_em'] is None or (
+                lenta and time.monotonic() - consulta['plano_em'] > VALIDADE_PLANO)
+            if capturar:
+                consulta['plano_em'] = time.monotonic()
+
+        if capturar:
+            plano = self._capturar_plano(conn, sql, parametros)
+            with self._lock:
+                consulta['plano'] = plano
+        if lenta and self.caminho_log:
+            self._registrar_lenta(sql, normalizado, parametros, duracao, consulta['plano'])
+
+    def _capturar_plano(self, conn, sql, parametros):
+        if not sql.lstrip()[:7].upper().startswith(COMANDOS_COM_PLANO):
+            return None
+        if parametros is None:
+            if '?' in sql or ':' in sql:
+                return None  # executemany: sem os parâmetros não dá para preparar
+            parametros = ()
+        try:
+            return plano_consulta(conn, sql, parametros)
+        except sqlite3.Error as e:
+            return [f"erro: {e}"]
+
+    def _registrar_lenta(self, sql, normalizado, parametros, duracao, plano):
+        linha = json.dumps({
+            "data": datetime.now().isoformat(timespec='milliseconds'),
+            "duracao_ms": round(duracao * 1000, 2),
+            "sql": normalizado,
+            "parametros": formas_parametros(parametros),
+            "plano": plano,
+            "varredura_completa": varredura_completa(plano or []),
+            "rota": request.path if has_request_context() else None,
+            "pid": os.getpid(),
+        }, ensure_ascii=False)
+        try:
+            with self._lock, open(self.caminho_log, 'a', encoding='utf-8') as arquivo:
+                arquivo.write(linha + '\n')
+        except OSError as e:
+            print(f"❌ Erro ao gravar log de consultas lentas: {e}")
+
+    def estatisticas(self, ordem='total', limite=50):
+        """Consultas ordenadas por `ordem` (uma de ORDENS), da maior para a menor"""
+        with self._lock:
+            consultas = [
+                {
+                    "sql": sql,
+                    "execucoes": c['execucoes'],
+                    "total_ms": round(c['total'] * 1000, 3),
+                    "media_ms": round(c['total'] * 1000 / c['execucoes'], 3),
+                    "max_ms": round(c['max'] * 1000, 3),
+                    "lentas": c['lentas'],
+                    "plano": c['plano'],
+                    "varredura_completa": varredura_completa(c['plano'] or []),
+                }
+                for sql, c in self._consultas.items()
+            ]
+        chave = {'total': 'total_ms', 'media': 'media_ms', 'max': 'max_ms'}.get(ordem, ordem)
+        consultas.sort(key=lambda c: c[chave], reverse=True)
+        return consultas[:limite]
+
+    def limpar(self):
+        with self._lock:
+            self._consultas.clear()
+            self.descartadas = 0
@@ -0,0 +1,249 @@
+"""
+Escrita agrupada (write-behind) para gravações frequentes e pequenas
+
+No recebimento, cada leitura do coletor vira um movimento de estoque, e cada
+movimento gravado direto é uma transação própria: lock de escrita, páginas
+do WAL e commit para poucos bytes. No modo agrupado as operações entram numa
+fila em memória e uma única thread escritora as grava em grupo, numa
+transação só, a cada INTERVALO segundos ou a cada MAX_LOTE operações (o que
+vier primeiro).
+
+Cada operação roda num SAVEPOINT dentro do grupo: se uma falha (produto
+inexistente, estoque insuficiente), só ela é desfeita e as outras do grupo
+são confirmadas. O resultado (ou a exceção) chega no Future devolvido por
+enviar(), depois do commit.
+
+- Memória limitada: a fila aceita até MAX_PENDENTES operações.
+- Contrapressão: com a fila cheia, enviar() espera até ESPERA_MAX segundos
+  (segurando quem produz) e então levanta FilaCheia.
+- Ler o que escreveu: aguardar_sessao() espera as operações pendentes de uma
+  sessão, para que a leitura seguinte já as veja no banco.
+- Desligamento: fechar() grava tudo o que está na fila antes de parar (é
+  registrado no atexit por quem cria a fila).
+- Thread parada: se a thread escritora terminar (erro inesperado, ou
+  operações enviadas depois do fechar()), os Futures que ficaram sem
+  resposta recebem EscritaInterrompida em vez de esperar para sempre, e o
+  próximo enviar() começa outra thread.
+
+Operações ainda na fila se perdem se o processo morrer sem passar pelo
+fechar() (kill -9, queda de energia); quem precisa da confirmação espera o
+Future.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from banco_dados import abrir_conexao
+
+INTERVALO = 0.05  # segundos entre grupos
+MAX_LOTE = 500  # operações por grupo
+MAX_PENDENTES = 10_000  # operações na fila
+ESPERA_MAX = 2.0  # segundos esperando vaga na fila
+
+_PARAR = object()
+
+
+class FilaCheia(RuntimeError):
+    """A fila de escrita não esvaziou a tempo (banco não acompanha a entrada)"""
+
+
+class EscritaInterrompida(RuntimeError):
+    """A thread escritora parou antes de gravar a operação"""
+
+
+def _nada(conn):
+    return None
+
+
+class EscritaAgrupada:
+    """
+    Fila de operações gravadas em grupo por uma thread escritora com conexão
+    própria. Uma operação é uma função que recebe a conexão (com a transação
+    do grupo já aberta) e devolve o resultado; ela não deve dar commit.
+
+    Depois de um fork a fila do processo pai não serve: a thread não existe
+    no filho. O filho começa com fila e thread próprias.
+    """
+
+    def __init__(self, caminho_banco, intervalo=INTERVALO, max_lote=MAX_LOTE,
+                 max_pendentes=MAX_PENDENTES, espera_max=ESPERA_MAX):
+        self.caminho_banco = caminho_banco
+        self.intervalo = intervalo
+        self.max_lote = max_lote
+        self.max_pendentes = max_pendentes
+        self.espera_max = espera_max
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fila = None
+        self._thread = None
+        self._ultimas = {}  # sessão -> Future da última operação enviada por ela
+
+    def _preparar(self):
+        if self._pid != os.getpid() or self._thread is None:
+            self._pid = os.getpid()
+            self._fila = queue.Queue(maxsize=self.max_pendentes)
+            self._ultimas = {}
+            # daemon: o desligamento passa pelo fechar() (atexit), que esvazia a fila
+            self._thread = threading.Thread(target=self._trabalhar, name='escrita-agrupada', daemon=True)
+            self._thread.start()
+        return self._fila
+
+    def enviar(self, operacao, sessao=None, ao_confirmar=None):
+        """
+        Coloca a operação na fila e devolve o Future do seu resultado.
+        ao_confirmar(resultado) roda na thread escritora logo depois do commit
+        e antes de o Future ser resolvido (ex.: invalidar caches, para que
+        quem espera o Future já leia o valor novo).
+        """
+        futuro = Future()
+        with self._lock:
+            fila = self._preparar()
+        try:
+            fila.put((operacao, futuro, ao_confirmar), timeout=self.espera_max)
+        except queue.Full:
+            raise FilaCheia(f"Fila de escrita cheia ({self.max_pendentes} operações pendentes)")
+        if sessao is not None:
+            with self._lock:
+                self._ultimas[sessao] = futuro
+            futuro.add_done_callback(lambda f: self._esquecer(sessao, f))
+        return futuro
+
+    def _esquecer(self, sessao, futuro):
+        with self._lock:
+            if self._ultimas.get(sessao) is futuro:
+                del self._ultimas[sessao]
+
+    def aguardar_sessao(self, sessao, timeout=None):
+        """
+        Espera as operações pendentes da sessão chegarem ao banco. A fila é
+        FIFO, então basta esperar a última enviada.
+        """
+        with self._lock:
+            futuro = self._ultimas.get(sessao) if self._pid == os.getpid() else None
+        if futuro is not None:
+            try:
+                futuro.exception(timeout=timeout)
+            except TimeoutError:
+                pass
+
+    def pendentes(self):
+        return self._fila.qsize() if self._fila is not None and self._pid == os.getpid() else 0
+
+    def esvaziar(self, timeout=None):
+        """Espera gravar tudo o que já estava na fila"""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            fila = self._fila
+        marcador = Future()
+        fila.put((_nada, marcador, None))
+        marcador.exception(timeout=timeout)
+
+    def fechar(self):
+        """Grava o que está na fila e para a thread escritora"""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            fila, thread = self._fila, self._thread
+            self._thread = None
+        fila.put(_PARAR)
+        thread.join()
+
+    def _trabalhar(self):
+        fila = self._fila
+        gravando = []  # grupo sendo gravado (falha junto se a thread parar no meio)
+        try:
+            self._consumir(fila, gravando)
+        except Exception as e:
+            print(f"❌ Thread de escrita agrupada parou: {e}")
+        finally:
+            self._encerrar(fila, gravando)
+
+    def _encerrar(self, fila, gravando):
+        """Falha o que ficou sem resposta; o próximo enviar() começa outra thread"""
+        with self._lock:
+            if self._fila is fila:
+                self._thread = None
+        erro = EscritaInterrompida("A escrita agrupada parou antes de gravar a operação")
+        pendentes = [futuro for _, futuro, _ in gravando]
+        while True:
+            try:
+                item = fila.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _PARAR:
+                pendentes.append(item[1])
+        for futuro in pendentes:
+            if not futuro.done():
+                futuro.set_exception(erro)
+
+    def _consumir(self, fila, gravando):
+        conn = abrir_conexao(self.caminho_banco)
+        try:
+            while True:
+                item = fila.get()
+                parar = item is _PARAR
+                lote = [] if parar else [item]
+                prazo = time.monotonic() + self.intervalo
+                while not parar and len(lote) < self.max_lote:
+                    restante = prazo - time.monotonic()
+                    if restante <= 0:
+                        break
+                    try:
+                        item = fila.get(timeout=restante)
+                    except queue.Empty:
+                        break
+                    if item is _PARAR:
+                        parar = True
+                    else:
+                        lote.append(item)
+                # Ao parar, o que ainda estiver na fila entra no último grupo
+                while parar:
+                    try:
+                        item = fila.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _PARAR:
+                        lote.append(item)
+                if lote:
+                    gravando[:] = lote
+                    self._gravar(conn, lote)
+                    gravando.clear()
+                if parar:
+                    return
+        finally:
+            conn.close()
+
+    def _gravar(self, conn, lote):
+        resultados = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for operacao, futuro, ao_confirmar in lote:
+                conn.execute("SAVEPOINT operacao")
+                try:
+                    resultados.append((futuro, ao_confirmar, operacao(conn), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO operacao")
+                    resultados.append((futuro, None, None, e))
+                conn.execute("RELEASE operacao")
+            conn.commit()
+        except Exception as e:
+            # Falha do grupo (lock, disco): nenhuma operação foi gravada
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"❌ Erro ao gravar grupo de {len(lote)} operações: {e}")
+            resultados = [(futuro, None, None, e) for _, futuro, _ in lote]
+
+        for futuro, ao_confirmar, resultado, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+                continue
+            if ao_confirmar is not None:
+                try:
+                    ao_confirmar(resultado)
+                except Exception as e:
+                    print(f"❌ Erro depois de gravar operação: {e}")
+            futuro.set_result(resultado)
@@ -0,0 +1,153 @@
+"""
+Tempo por etapa das rotas de escaneamento e cadastro
+
+Uma rota decorada com @medir_etapas mede quanto tempo passou em cada etapa
+marcada com `with etapa('nome'):` (no código da rota ou em qualquer função
+que ela chame) e devolve a divisão no cabeçalho Server-Timing, que aparece
+na aba Rede do navegador:
+
+    Server-Timing: corpo;dur=0.41, decodificacao;dur=1.20, sql;dur=0.08;desc="1 consultas", ...
+
+O tempo do SQL é somado sozinho (pelo OUVINTES_SQL de banco_dados), e cada
+etapa conta só o próprio tempo: o SQL feito dentro de outra etapa sai dela.
+O que não está em nenhuma etapa aparece como `outros`, e `total` é o tempo
+da rota inteira (sem os before_request).
+
+Requisições com total acima de app.config['REQUISICOES_LENTAS_MS'] viram
+uma linha JSON em app.config['LOG_REQUISICOES_LENTAS'] (None desliga):
+
+    {"data": "...", "metodo": "POST", "rota": "/api/scan", "status": 200,
+     "total_ms": 812.4, "etapas": {"qrcode": 640.1, ...}, "consultas_sql": 2, "pid": 4242}
+
+Etapas usadas: corpo (leitura e parse do corpo), decodificacao (base64),
+validacao (formato e dimensões), qrcode (leitura no servidor), disco
+(imagens lidas ou gravadas), hash (hash perceptual), comparacao (busca no
+índice de hashes), sql (inclui o commit), fila (trabalho entregue às
+threads/processos de segundo plano) e serializacao (JSON da resposta).
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+
+from banco_dados import OUVINTES_SQL
+
+REQUISICOES_LENTAS_MS = 500
+LOG_REQUISICOES_LENTAS = 'requisicoes_lentas.jsonl'
+
+_lock_log = threading.Lock()
+
+
+class Medicao:
+    """Tempos (em segundos) das etapas de uma requisição"""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.tempos = {}
+        self.consultas_sql = 0
+        self._pilha = []  # [nome, início, tempo das etapas internas]
+
+    def iniciar(self, nome):
+        self._pilha.append([nome, time.perf_counter(), 0.0])
+
+    def terminar(self):
+        nome, inicio, internas = self._pilha.pop()
+        duracao = time.perf_counter() - inicio
+        self.tempos[nome] = self.tempos.get(nome, 0.0) + duracao - internas
+        if self._pilha:
+            self._pilha[-1][2] += duracao
+
+    def somar(self, nome, duracao):
+        """Soma `duracao` à etapa `nome`, descontando da etapa aberta"""
+        self.tempos[nome] = self.tempos.get(nome, 0.0) + duracao
+        if self._pilha:
+            self._pilha[-1][2] += duracao
+
+    def finalizar(self):
+        """(total, {etapa: segundos}) com `outros` = o que ficou fora das etapas"""
+        total = time.perf_counter() - self.inicio
+        tempos = dict(self.tempos)
+        tempos['outros'] = max(total - sum(tempos.values()), 0.0)
+        return total, tempos
+
+
+@contextlib.contextmanager
+def etapa(nome):
+    """Marca um trecho da requisição; fora de uma rota medida não faz nada"""
+    medicao = g.get('medicao') if has_request_context() else None
+    if medicao is None:
+        yield
+        return
+    medicao.iniciar(nome)
+    try:
+        yield
+    finally:
+        medicao.terminar()
+
+
+def _ao_executar_sql(conn, sql, parametros, duracao):
+    medicao = g.get('medicao') if has_request_context() else None
+    if medicao is not None:
+        medicao.somar('sql', duracao)
+        medicao.consultas_sql += 1
+
+
+OUVINTES_SQL.append(_ao_executar_sql)
+
+
+def server_timing(total, tempos, consultas_sql):
+    """Valor do cabeçalho Server-Timing (milissegundos)"""
+    partes = []
+    for nome, duracao in tempos.items():
+        parte = f"{nome};dur={duracao * 1000:.2f}"
+        if nome == 'sql':
+            parte += f';desc="{consultas_sql} consultas"'
+        partes.append(parte)
+    partes.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(partes)
+
+
+def registrar_lenta(caminho, resposta, total, tempos, consultas_sql):
+    """Acrescenta a requisição ao log JSON-lines (uma linha por requisição)"""
+    linha = json.dumps({
+        "data": datetime.now().isoformat(timespec='milliseconds'),
+        "metodo": request.method,
+        "rota": request.url_rule.rule if request.url_rule is not None else request.path,
+        "status": resposta.status_code,
+        "total_ms": round(total * 1000, 2),
+        "etapas": {nome: round(duracao * 1000, 2) for nome, duracao in tempos.items()},
+        "consultas_sql": consultas_sql,
+        "pid": os.getpid(),
+    }, ensure_ascii=False)
+    # Uma escrita por linha em modo append: linhas de workers diferentes não se misturam
+    with _lock_log, open(caminho, 'a', encoding='utf-8') as arquivo:
+        arquivo.write(linha + '\n')
+
+
+def medir_etapas(view):
+    """Decorador da rota: Server-Timing na resposta e log das lentas"""
+    @wraps(view)
+    def rota_medida(*args, **kwargs):
+        medicao = g.medicao = Medicao()
+        try:
+            resposta = current_app.make_response(view(*args, **kwargs))
+        finally:
+            g.pop('medicao', None)
+        total, tempos = medicao.finalizar()
+        resposta.headers['Server-Timing'] = server_timing(total, tempos, medicao.consultas_sql)
+
+        caminho = current_app.config.get('LOG_REQUISICOES_LENTAS', LOG_REQUISICOES_LENTAS)
+        limite = current_app.config.get('REQUISICOES_LENTAS_MS', REQUISICOES_LENTAS_MS)
+        if caminho and total * 1000 >= limite:
+            try:
+                registrar_lenta(caminho, resposta, total, tempos, medicao.consultas_sql)
+            except OSError as e:
+                print(f"❌ Erro ao gravar log de requisições lentas: {e}")
+        return resposta
+    return rota_medida
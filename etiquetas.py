@@ -0,0 +1,517 @@
+"""
+Folhas de etiquetas A4 com QR Code, nome e localização dos produtos
+
+Cada página (3 x 8 etiquetas de 70 x 37 mm) é desenhada por um processo do
+pool; o processo principal só recebe a página pronta (comprimida) e a grava
+no arquivo de saída na ordem, então a memória não cresce com o tamanho do
+trabalho. Os processos do pool só leem os QR Codes da pasta do cache da
+rota /qrcode; o que falta é renderizado na memória e volta junto com a
+página, para o processo principal guardar pelo CacheQRCodes (que cuida de
+gravar e despejar os arquivos).
+
+Pela API a geração roda em segundo plano (ver gerar_em_segundo_plano): o
+progresso fica na tabela etiquetas_trabalhos, visível a todos os workers, e
+o arquivo pronto numa pasta compartilhada.
+
+Saída em PDF (todas as páginas num arquivo) ou PNG (uma página: o PNG; mais
+de uma: um zip com um PNG por página).
+
+Pela linha de comando:
+    python etiquetas.py --categoria Ferramentas --saida etiquetas.pdf
+"""
+
+import argparse
+import io
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from concurrent.futures.process import BrokenProcessPool
+
+from processos import novo_pool
+from qrcodes import CacheQRCodes, nome_arquivo, renderizar
+
+# Página A4 a 200 DPI: QR Codes nítidos e páginas de ~100KB comprimidas
+DPI = 200
+MM = DPI / 25.4
+LARGURA_PAGINA = round(210 * MM)
+ALTURA_PAGINA = round(297 * MM)
+COLUNAS = 3
+LINHAS = 8
+LARGURA_ETIQUETA = round(70 * MM)
+ALTURA_ETIQUETA = round(37 * MM)
+MARGEM_ETIQUETA = round(3 * MM)
+ETIQUETAS_POR_PAGINA = COLUNAS * LINHAS
+MARGEM_TOPO = (ALTURA_PAGINA - LINHAS * ALTURA_ETIQUETA) // 2
+
+PONTOS_A4 = (595.28, 841.89)  # tamanho da página em pontos (1/72 pol.) no PDF
+FORMATOS = ('pdf', 'png')
+MAX_ETIQUETAS = 10000
+TRABALHADORES = os.cpu_count() or 1
+PAGINAS_POR_AVISO = 10  # progresso gravado no banco a cada tantas páginas
+EXTENSOES = {'application/pdf': 'pdf', 'image/png': 'png', 'application/zip': 'zip'}
+
+
+class FiltroInvalido(ValueError):
+    """Filtro de produtos ou formato inválido"""
+
+
+# -----------------------------------------------------------
+# SELEÇÃO DOS PRODUTOS
+# -----------------------------------------------------------
+
+def selecionar_produtos(conn, categoria=None, coluna=None, ids=None):
+    """(codigo, nome, localizacao) dos produtos com código, na ordem da estante"""
+    where = ["codigo IS NOT NULL"]
+    valores = []
+    if categoria:
+        where.append("categoria = ?")
+        valores.append(categoria)
+    if coluna is not None:
+        where.append("coluna_armazenada = ?")
+        valores.append(coluna)
+    if ids:
+        where.append(f"id IN ({', '.join('?' * len(ids))})")
+        valores += ids
+
+    produtos = conn.execute(f"""
+        SELECT codigo, nome, localizacao FROM produtos
+        WHERE {' AND '.join(where)}
+        ORDER BY coluna_armazenada, nivel_armazenado, localizacao, nome
+        LIMIT ?
+    """, valores + [MAX_ETIQUETAS + 1]).fetchall()
+
+    if len(produtos) > MAX_ETIQUETAS:
+        raise FiltroInvalido(f"Mais de {MAX_ETIQUETAS} etiquetas: refine o filtro")
+    return [tuple(produto) for produto in produtos]
+
+
+def ler_filtro(args):
+    """categoria, coluna e ids (separados por vírgula) da query string ou da linha de comando"""
+    coluna = args.get('coluna')
+    ids = args.get('ids')
+    try:
+        coluna = int(coluna) if coluna not in (None, '') else None
+        ids = [int(i) for i in ids.split(',') if i.strip()] if ids else None
+    except ValueError:
+        raise FiltroInvalido("'coluna' e 'ids' devem ser números inteiros")
+    return {"categoria": args.get('categoria') or None, "coluna": coluna, "ids": ids}
+
+
+# -----------------------------------------------------------
+# DESENHO DAS PÁGINAS (nos processos do pool)
+# -----------------------------------------------------------
+
+_fontes = {}
+
+
+def _fonte(tamanho):
+    fonte = _fontes.get(tamanho)
+    if fonte is None:
+        from PIL import ImageFont
+
+        try:
+            fonte = ImageFont.load_default(size=tamanho)
+        except TypeError:  # Pillow antigo: fonte bitmap de tamanho fixo
+            fonte = ImageFont.load_default()
+        _fontes[tamanho] = fonte
+    return fonte
+
+
+def _abrir_qrcode(pasta_qrcodes, codigo):
+    """
+    (imagem, None) com o PNG da pasta do cache (só leitura); se não está lá,
+    (imagem, bytes do PNG) renderizado na memória, para o cache guardar
+    """
+    from PIL import Image
+
+    try:
+        return Image.open(os.path.join(pasta_qrcodes, nome_arquivo(codigo, 'png'))), None
+    except FileNotFoundError:
+        png = renderizar(codigo, 'png')
+        return Image.open(io.BytesIO(png)), png
+
+
+def _cortar(desenho, texto, fonte, largura):
+    """Corta o texto com reticências para caber na largura"""
+    if desenho.textlength(texto, font=fonte) <= largura:
+        return texto
+    while texto and desenho.textlength(texto + '…', font=fonte) > largura:
+        texto = texto[:-1]
+    return texto + '…'
+
+
+def desenhar_pagina(etiquetas, pasta_qrcodes):
+    """
+    Imagem (tons de cinza) de uma página com até ETIQUETAS_POR_PAGINA
+    etiquetas e {código: PNG} dos QR Codes que não estavam no cache
+    """
+    from PIL import Image, ImageDraw  # carregado no processo do pool, não ao importar o app
+
+    pagina = Image.new('L', (LARGURA_PAGINA, ALTURA_PAGINA), 255)
+    desenho = ImageDraw.Draw(pagina)
+    lado_qr = ALTURA_ETIQUETA - 2 * MARGEM_ETIQUETA
+    fonte_nome, fonte_texto = _fonte(round(4 * MM)), _fonte(round(3 * MM))
+    renderizados = {}
+
+    for posicao, (codigo, nome, localizacao) in enumerate(etiquetas):
+        x = (posicao % COLUNAS) * LARGURA_ETIQUETA
+        y = MARGEM_TOPO + (posicao // COLUNAS) * ALTURA_ETIQUETA
+
+        qr, png = _abrir_qrcode(pasta_qrcodes, codigo)
+        if png is not None:
+            renderizados[codigo] = png
+        with qr:
+            # NEAREST mantém os módulos do QR Code nítidos
+            qr = qr.convert('L').resize((lado_qr, lado_qr), Image.NEAREST)
+        pagina.paste(qr, (x + MARGEM_ETIQUETA, y + MARGEM_ETIQUETA))
+
+        texto_x = x + lado_qr + 2 * MARGEM_ETIQUETA
+        largura_texto = LARGURA_ETIQUETA - lado_qr - 3 * MARGEM_ETIQUETA
+        linhas = (
+            (_cortar(desenho, nome or '', fonte_nome, largura_texto), fonte_nome),
+            (_cortar(desenho, localizacao or '', fonte_texto, largura_texto), fonte_texto),
+            (codigo, fonte_texto),
+        )
+        texto_y = y + MARGEM_ETIQUETA
+        for texto, fonte in linhas:
+            desenho.text((texto_x, texto_y), texto, fill=0, font=fonte)
+            texto_y += round(fonte.size * 1.5) if hasattr(fonte, 'size') else 14
+
+    return pagina, renderizados
+
+
+def renderizar_pagina(tarefa):
+    """
+    Executado no pool: (página pronta para gravar, QR Codes renderizados).
+    A página é o PNG ou os pixels comprimidos para o PDF.
+    """
+    etiquetas, pasta_qrcodes, formato = tarefa
+    pagina, renderizados = desenhar_pagina(etiquetas, pasta_qrcodes)
+    if formato == 'png':
+        buffer = io.BytesIO()
+        pagina.save(buffer, format='PNG', dpi=(DPI, DPI))
+        return buffer.getvalue(), renderizados
+    return zlib.compress(pagina.tobytes(), 6), renderizados
+
+
+# -----------------------------------------------------------
+# SAÍDA
+# -----------------------------------------------------------
+
+class EscritorPDF:
+    """
+    PDF mínimo com uma imagem em tons de cinza por página, gravado à medida
+    que as páginas chegam (só os offsets ficam na memória)
+    """
+
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        self.offsets = {}
+        self.paginas = []
+        self.proximo_objeto = 3  # 1 = catálogo, 2 = árvore de páginas (gravada no fim)
+        self.arquivo.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _objeto(self, numero, conteudo, stream=None):
+        self.offsets[numero] = self.arquivo.tell()
+        self.arquivo.write(f"{numero} 0 obj\n".encode('ascii') + conteudo)
+        if stream is not None:
+            self.arquivo.write(b"\nstream\n" + stream + b"\nendstream")
+        self.arquivo.write(b"\nendobj\n")
+
+    def adicionar_pagina(self, pixels_comprimidos, largura, altura):
+        imagem, conteudo, pagina = range(self.proximo_objeto, self.proximo_objeto + 3)
+        self.proximo_objeto += 3
+        pontos_x, pontos_y = PONTOS_A4
+
+        self._objeto(imagem, (
+            f"<< /Type /XObject /Subtype /Image /Width {largura} /Height {altura} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode "
+            f"/Length {len(pixels_comprimidos)} >>"
+        ).encode('ascii'), pixels_comprimidos)
+
+        desenho = f"q {pontos_x} 0 0 {pontos_y} 0 0 cm /Im0 Do Q".encode('ascii')
+        self._objeto(conteudo, f"<< /Length {len(desenho)} >>".encode('ascii'), desenho)
+
+        self._objeto(pagina, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {pontos_x} {pontos_y}] "
+            f"/Resources << /XObject << /Im0 {imagem} 0 R >> >> /Contents {conteudo} 0 R >>"
+        ).encode('ascii'))
+        self.paginas.append(pagina)
+
+    def fechar(self):
+        self._objeto(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        filhos = ' '.join(f"{pagina} 0 R" for pagina in self.paginas)
+        self._objeto(2, f"<< /Type /Pages /Kids [{filhos}] /Count {len(self.paginas)} >>".encode('ascii'))
+
+        inicio_xref = self.arquivo.tell()
+        total = self.proximo_objeto
+        self.arquivo.write(f"xref\n0 {total}\n0000000000 65535 f \n".encode('ascii'))
+        for numero in range(1, total):
+            self.arquivo.write(f"{self.offsets[numero]:010d} 00000 n \n".encode('ascii'))
+        self.arquivo.write(
+            f"trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode('ascii')
+        )
+
+
+def _paginas(produtos):
+    for inicio in range(0, len(produtos), ETIQUETAS_POR_PAGINA):
+        yield produtos[inicio:inicio + ETIQUETAS_POR_PAGINA]
+
+
+def gerar_etiquetas(produtos, formato, cache_qrcodes, saida, pool=None, ao_progredir=None):
+    """
+    Grava as folhas de etiquetas em `saida` (arquivo binário aberto).
+    Os QR Codes vêm da pasta do `cache_qrcodes` (CacheQRCodes), e os que
+    faltavam voltam para ele. `ao_progredir(paginas_gravadas)` é chamado a
+    cada página gravada. Retorna o mimetype do conteúdo gravado.
+    """
+    if formato not in FORMATOS:
+        raise FiltroInvalido("Formato deve ser 'pdf' ou 'png'")
+    avisar = ao_progredir or (lambda _: None)
+
+    tarefas = [(pagina, cache_qrcodes.pasta, formato) for pagina in _paginas(produtos)]
+    if pool is not None and len(tarefas) > 1:
+        resultados = pool.map(renderizar_pagina, tarefas)
+    else:
+        resultados = map(renderizar_pagina, tarefas)
+
+    def guardar_qrcodes():
+        for pagina, renderizados in resultados:
+            for codigo, png in renderizados.items():
+                try:
+                    cache_qrcodes.guardar(codigo, 'png', png)
+                except OSError as e:
+                    print(f"⚠️ Erro ao guardar o QR Code {codigo}: {e}")
+            yield pagina
+
+    paginas = guardar_qrcodes()
+
+    if formato == 'pdf':
+        escritor = EscritorPDF(saida)
+        for numero, pixels in enumerate(paginas, start=1):
+            escritor.adicionar_pagina(pixels, LARGURA_PAGINA, ALTURA_PAGINA)
+            avisar(numero)
+        escritor.fechar()
+        return 'application/pdf'
+
+    if len(tarefas) == 1:
+        saida.write(next(iter(paginas)))
+        avisar(1)
+        return 'image/png'
+
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_STORED) as arquivo_zip:
+        for numero, png in enumerate(paginas, start=1):
+            arquivo_zip.writestr(f"etiquetas_{numero:04d}.png", png)
+            avisar(numero)
+    return 'application/zip'
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool_compartilhado():
+    """Pool de processos do servidor web, criado no primeiro uso"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = novo_pool(TRABALHADORES)
+        return _pool
+
+
+def descartar_pool(pool):
+    """
+    Tira do uso um pool quebrado (processo morto: BrokenProcessPool); a
+    próxima geração cria outro
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# -----------------------------------------------------------
+# GERAÇÃO EM SEGUNDO PLANO (API)
+# -----------------------------------------------------------
+
+def criar_tabela(cursor):
+    """Progresso das gerações de etiquetas pedidas pela API"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS etiquetas_trabalhos (
+            id TEXT PRIMARY KEY,
+            estado TEXT NOT NULL,
+            formato TEXT NOT NULL,
+            etiquetas INTEGER NOT NULL,
+            paginas INTEGER NOT NULL,
+            paginas_prontas INTEGER NOT NULL DEFAULT 0,
+            mimetype TEXT,
+            arquivo TEXT,
+            mensagem TEXT,
+            iniciado_em REAL NOT NULL,
+            concluido_em REAL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_etiquetas_trabalho_inicio ON etiquetas_trabalhos(iniciado_em)")
+
+
+class TrabalhoEtiquetas:
+    """Estado de uma geração de etiquetas em segundo plano"""
+
+    def __init__(self, formato, etiquetas):
+        self.id = uuid.uuid4().hex
+        self.estado = 'gerando'  # gerando → concluido | falhou
+        self.formato = formato
+        self.etiquetas = etiquetas
+        self.paginas = -(-etiquetas // ETIQUETAS_POR_PAGINA)
+        self.paginas_prontas = 0
+        self.mimetype = None
+        self.arquivo = None
+        self.mensagem = None
+        self.iniciado_em = time.time()
+        self.concluido_em = None
+
+    def gravar(self, conn):
+        """Grava o estado atual na tabela etiquetas_trabalhos (e confirma)"""
+        conn.execute("""
+            INSERT OR REPLACE INTO etiquetas_trabalhos (id, estado, formato, etiquetas, paginas, paginas_prontas,
+                                                        mimetype, arquivo, mensagem, iniciado_em, concluido_em)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (self.id, self.estado, self.formato, self.etiquetas, self.paginas, self.paginas_prontas,
+              self.mimetype, self.arquivo, self.mensagem, self.iniciado_em, self.concluido_em))
+        conn.commit()
+
+
+def trabalho_gravado(conn, trabalho_id):
+    """Estado de uma geração (de qualquer worker), com o caminho do arquivo; None se não existe"""
+    linha = conn.execute("SELECT * FROM etiquetas_trabalhos WHERE id = ?", (trabalho_id,)).fetchone()
+    if linha is None:
+        return None
+    fim = linha['concluido_em'] or time.time()
+    return {
+        "trabalho_id": linha['id'],
+        "estado": linha['estado'],
+        "formato": linha['formato'],
+        "etiquetas": linha['etiquetas'],
+        "paginas": linha['paginas'],
+        "paginas_prontas": linha['paginas_prontas'],
+        "mensagem": linha['mensagem'],
+        "segundos": round(fim - linha['iniciado_em'], 2),
+        "mimetype": linha['mimetype'],
+        "arquivo": linha['arquivo'],
+    }
+
+
+def apagar_antigos(conn, manter):
+    """Apaga os trabalhos (e arquivos) mais antigos, menos os `manter` mais recentes"""
+    antigos = conn.execute("""
+        SELECT id, arquivo FROM etiquetas_trabalhos
+        ORDER BY iniciado_em DESC LIMIT -1 OFFSET ?
+    """, (manter,)).fetchall()
+    for trabalho_id, arquivo in antigos:
+        if arquivo:
+            try:
+                os.remove(arquivo)
+            except FileNotFoundError:
+                pass
+        conn.execute("DELETE FROM etiquetas_trabalhos WHERE id = ?", (trabalho_id,))
+    conn.commit()
+
+
+def gerar_em_segundo_plano(caminho_banco, produtos, formato, cache_qrcodes, pasta_saida, trabalho):
+    """
+    Gera as etiquetas numa thread (as páginas no pool compartilhado), gravando
+    o progresso com conexão própria. O arquivo é escrito como .tmp e só ganha
+    o nome final quando está completo.
+    """
+    from banco_dados import abrir_conexao
+
+    def rodar():
+        conn = abrir_conexao(caminho_banco)
+
+        def gravar_progresso():
+            # Progresso que não grava (banco travado) não derruba a geração
+            try:
+                trabalho.gravar(conn)
+            except sqlite3.Error as e:
+                print(f"⚠️ Erro ao gravar o progresso das etiquetas {trabalho.id}: {e}")
+
+        def avisar(paginas_prontas):
+            trabalho.paginas_prontas = paginas_prontas
+            if paginas_prontas % PAGINAS_POR_AVISO == 0:
+                gravar_progresso()
+
+        temporario = os.path.join(pasta_saida, f"{trabalho.id}.tmp")
+        pool = pool_compartilhado()
+        try:
+            with open(temporario, 'wb') as saida:
+                try:
+                    mimetype = gerar_etiquetas(produtos, formato, cache_qrcodes, saida, pool, avisar)
+                except BrokenProcessPool:
+                    descartar_pool(pool)
+                    raise
+            arquivo = os.path.join(pasta_saida, f"{trabalho.id}.{EXTENSOES[mimetype]}")
+            os.replace(temporario, arquivo)
+            trabalho.mimetype, trabalho.arquivo = mimetype, arquivo
+            trabalho.estado = 'concluido'
+        except Exception as e:
+            trabalho.estado = 'falhou'
+            trabalho.mensagem = str(e) or type(e).__name__
+            if os.path.exists(temporario):
+                os.remove(temporario)
+        finally:
+            trabalho.concluido_em = time.time()
+            gravar_progresso()
+            conn.close()
+
+    thread = threading.Thread(target=rodar, name=f"etiquetas-{trabalho.id}", daemon=True)
+    thread.start()
+    return thread
+
+
+# -----------------------------------------------------------
+# LINHA DE COMANDO
+# -----------------------------------------------------------
+
+def main(argv=None):
+    from banco_dados import abrir_conexao
+
+    parser = argparse.ArgumentParser(description="Gera folhas A4 de etiquetas com QR Code")
+    parser.add_argument('--categoria')
+    parser.add_argument('--coluna', help="coluna_armazenada")
+    parser.add_argument('--ids', help="ids separados por vírgula")
+    parser.add_argument('--formato', choices=FORMATOS, default='pdf')
+    parser.add_argument('--saida', help="padrão: etiquetas.pdf / etiquetas.png")
+    parser.add_argument('--banco', default='banco.db')
+    parser.add_argument('--pasta-qrcodes', default='static/qrcodes')
+    args = parser.parse_args(argv)
+
+    conn = abrir_conexao(args.banco)
+    try:
+        produtos = selecionar_produtos(conn, **ler_filtro(vars(args)))
+    except FiltroInvalido as e:
+        parser.error(str(e))
+    finally:
+        conn.close()
+
+    if not produtos:
+        print("⚠️ Nenhum produto com código para o filtro informado")
+        return 1
+
+    saida = args.saida or f"etiquetas.{args.formato}"
+    with novo_pool(TRABALHADORES) as pool, open(saida, 'wb') as arquivo:
+        mimetype = gerar_etiquetas(produtos, args.formato, CacheQRCodes(args.pasta_qrcodes), arquivo, pool)
+
+    if mimetype == 'application/zip' and not saida.endswith('.zip'):
+        print(f"ℹ️ Mais de uma página em PNG: {saida} é um zip")
+    print(f"✅ {len(produtos)} etiquetas em {saida}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
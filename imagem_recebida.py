@@ -0,0 +1,194 @@
+"""
+Imagem recebida numa requisição, decodificada uma única vez
+
+O base64 (ou o corpo binário) é convertido em ImagemRecebida logo na entrada
+da rota e o mesmo objeto segue para validação, gravação em disco e busca por
+imagem, sem novas decodificações.
+"""
+
+import base64
+import binascii
+import struct
+
+from etapas import etapa
+from indice_imagens import calcular_dhash
+
+MIMES_PERMITIDOS = ('image/jpeg', 'image/png', 'image/jpg', 'image/gif')
+
+EXTENSOES = {'jpeg': 'jpg', 'png': 'png', 'gif': 'gif'}
+
+
+class ImagemInvalida(ValueError):
+    """Imagem vazia, grande demais ou em formato não suportado"""
+
+
+def detectar_formato(dados):
+    """Detecta o formato pelos magic bytes"""
+    if dados[:2] == b'\xff\xd8':
+        return 'jpeg'
+    if dados[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if dados[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    return None
+
+
+def ler_dimensoes(dados, formato):
+    """Lê largura e altura do cabeçalho, sem decodificar os pixels"""
+    if formato == 'png':
+        if len(dados) < 24:
+            return None
+        return struct.unpack('>II', dados[16:24])
+
+    if formato == 'gif':
+        if len(dados) < 10:
+            return None
+        return struct.unpack('<HH', dados[6:10])
+
+    # JPEG: percorre os segmentos até o SOFn
+    pos = 2
+    while pos + 9 < len(dados):
+        if dados[pos] != 0xFF:
+            return None
+        marcador = dados[pos + 1]
+        if marcador == 0xFF:
+            pos += 1
+            continue
+        if marcador in (0xD8, 0x01) or 0xD0 <= marcador <= 0xD7:
+            pos += 2
+            continue
+        tamanho = struct.unpack('>H', dados[pos + 2:pos + 4])[0]
+        if 0xC0 <= marcador <= 0xCF and marcador not in (0xC4, 0xC8, 0xCC):
+            altura, largura = struct.unpack('>HH', dados[pos + 5:pos + 9])
+            return largura, altura
+        pos += 2 + tamanho
+    return None
+
+
+class ImagemRecebida:
+    """Bytes da imagem com formato e dimensões já conhecidos"""
+
+    __slots__ = ('dados', 'formato', 'largura', 'altura', '_dhash')
+
+    def __init__(self, dados, formato, largura, altura):
+        self.dados = dados
+        self.formato = formato
+        self.largura = largura
+        self.altura = altura
+        self._dhash = None
+
+    @property
+    def extensao(self):
+        return EXTENSOES[self.formato]
+
+    @property
+    def mime(self):
+        return f"image/{self.formato}"
+
+    @property
+    def tamanho(self):
+        return len(self.dados)
+
+    @property
+    def dhash(self):
+        """Hash perceptual, calculado na primeira vez em que é pedido"""
+        if self._dhash is None:
+            with etapa('hash'):
+                self._dhash = calcular_dhash(self.dados)
+        return self._dhash
+
+    @classmethod
+    def de_bytes(cls, dados, tamanho_max):
+        with etapa('validacao'):
+            return cls._validar(dados, tamanho_max)
+
+    @classmethod
+    def _validar(cls, dados, tamanho_max):
+        if not dados:
+            raise ImagemInvalida("Imagem vazia")
+
+        if len(dados) > tamanho_max:
+            raise ImagemInvalida(f"Imagem muito grande. Máximo: {tamanho_max / 1024 / 1024:g}MB")
+
+        formato = detectar_formato(dados)
+        if not formato:
+            raise ImagemInvalida("Formato de imagem inválido")
+
+        dimensoes = ler_dimensoes(dados, formato)
+        if not dimensoes or not all(dimensoes):
+            raise ImagemInvalida("Imagem corrompida ou incompleta")
+
+        return cls(dados, formato, *dimensoes)
+
+    @classmethod
+    def de_base64(cls, texto, tamanho_max):
+        """Aceita base64 puro ou data URL (data:image/jpeg;base64,...)"""
+        if not texto:
+            raise ImagemInvalida("Imagem vazia")
+
+        if ',' in texto:
+            header, texto = texto.split(',', 1)
+            if not any(mime in header for mime in MIMES_PERMITIDOS):
+                raise ImagemInvalida("Tipo de imagem não permitido. Use JPEG, PNG ou GIF")
+
+        # 4 caracteres de base64 para cada 3 bytes: recusa antes de decodificar
+        if len(texto) > (tamanho_max + 2) // 3 * 4 + 4:
+            raise ImagemInvalida(f"Imagem muito grande. Máximo: {tamanho_max / 1024 / 1024:g}MB")
+
+        try:
+            with etapa('decodificacao'):
+                dados = base64.b64decode(texto)
+        except (binascii.Error, ValueError):
+            raise ImagemInvalida("Base64 inválido")
+
+        return cls.de_bytes(dados, tamanho_max)
+
+
+TAMANHO_BLOCO = 64 * 1024
+
+
+def ler_corpo_limitado(stream, tamanho_max):
+    """Lê o stream em blocos, sem ultrapassar tamanho_max bytes em memória"""
+    buffer = bytearray()
+    while True:
+        bloco = stream.read(TAMANHO_BLOCO)
+        if not bloco:
+            return bytes(buffer)
+        buffer += bloco
+        if len(buffer) > tamanho_max:
+            raise ImagemInvalida(f"Imagem muito grande. Máximo: {tamanho_max / 1024 / 1024:g}MB")
+
+
+def ler_imagem_binaria(req, tamanho_max, campo='imagem'):
+    """
+    Lê a imagem de uma requisição multipart/form-data (arquivo em `campo`,
+    demais dados no formulário) ou application/octet-stream / image/* (corpo
+    é a imagem, demais dados na query string).
+
+    Retorna (ImagemRecebida ou None, dicionário com os demais campos).
+    """
+    # Multipart tem o cabeçalho do formulário além do arquivo
+    margem = 64 * 1024
+    if req.content_length is not None and req.content_length > tamanho_max + margem:
+        raise ImagemInvalida(f"Imagem muito grande. Máximo: {tamanho_max / 1024 / 1024:g}MB")
+
+    if req.mimetype == 'multipart/form-data':
+        if req.content_length is None:
+            raise ImagemInvalida("Envio multipart requer Content-Length")
+        with etapa('corpo'):
+            arquivo = req.files.get(campo)
+            campos = req.form.to_dict()
+            if not arquivo:
+                return None, campos
+            dados = ler_corpo_limitado(arquivo.stream, tamanho_max)
+        return ImagemRecebida.de_bytes(dados, tamanho_max), campos
+
+    if req.mimetype == 'application/octet-stream' or req.mimetype.startswith('image/'):
+        with etapa('corpo'):
+            dados = ler_corpo_limitado(req.stream, tamanho_max)
+        campos = req.args.to_dict()
+        if not dados:
+            return None, campos
+        return ImagemRecebida.de_bytes(dados, tamanho_max), campos
+
+    raise ImagemInvalida("Content-Type não suportado. Use multipart/form-data ou application/octet-stream")
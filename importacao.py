@@ -0,0 +1,477 @@
+"""
+Importação de produtos em lote (CSV ou JSONL, com zip de imagens opcional)
+
+Etapas de uma importação:
+  1. lê e valida as linhas; uma linha com erro é registrada e as demais seguem
+  2. reserva os códigos de todos os produtos num bloco (ver codigos.py)
+  3. num pool de processos: valida cada imagem do zip, calcula o hash
+     perceptual, grava a imagem normalizada (ver normalizacao_imagens.py)
+     com a miniatura e renderiza o QR Code; o PNG volta para o processo
+     principal e entra pelo CacheQRCodes, que conta o tamanho no limite
+  4. insere tudo com executemany numa única transação; se ela falhar, as
+     imagens gravadas no passo 3 que nenhum produto usa são apagadas
+
+O progresso das importações feitas pela rota fica na tabela importacoes
+(gravado a cada bloco), então qualquer worker responde GET /api/importar/<id>,
+não só o que recebeu o arquivo.
+
+Colunas: nome, localizacao, quantidade (obrigatórias), preco, categoria,
+codigo (gerado quando vazio) e imagem (nome do arquivo dentro do zip).
+
+Pela linha de comando (aplica antes as migrações do main.py que faltarem
+no banco, como a primeira requisição do app faria):
+    python importacao.py produtos.csv --imagens fotos.zip
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime
+
+from banco_dados import abrir_conexao
+from armazem_imagens import salvar_blob
+from codigos import codigos_existentes, reservar_codigos
+from imagem_recebida import ImagemRecebida
+from indice_imagens import hash_para_texto
+from migracoes import migrar
+from nomes import normalizar_nome
+from normalizacao_imagens import extensao as extensao_normalizada, normalizar
+from processos import novo_pool
+from qrcodes import CacheQRCodes, renderizar
+
+TAMANHO_MAX_IMAGEM = 5 * 1024 * 1024  # mesmo limite do cadastro pela câmera
+TRABALHADORES = max(1, (os.cpu_count() or 2) - 1)
+LOTE_POOL = 64  # tarefas enviadas de uma vez a cada processo
+MIN_ITENS_POOL = 32  # abaixo disso o pool custa mais do que economiza
+MAX_ERROS_RESUMO = 100
+
+
+def criar_tabela(cursor):
+    """Progresso das importações (uma linha por importação, atualizada enquanto ela roda)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS importacoes (
+            id TEXT PRIMARY KEY,
+            estado TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            processados INTEGER NOT NULL DEFAULT 0,
+            importados INTEGER NOT NULL DEFAULT 0,
+            com_erro INTEGER NOT NULL DEFAULT 0,
+            erros TEXT,
+            mensagem TEXT,
+            iniciada_em REAL NOT NULL,
+            concluida_em REAL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_importacao_inicio ON importacoes(iniciada_em)")
+
+
+def _resumo(importacao_id, estado, total, processados, importados, com_erro, erros, mensagem,
+            iniciada_em, concluida_em):
+    fim = concluida_em or time.time()
+    return {
+        "importacao_id": importacao_id,
+        "estado": estado,
+        "total": total,
+        "processados": processados,
+        "importados": importados,
+        "com_erro": com_erro,
+        "erros": erros[:MAX_ERROS_RESUMO],
+        "mensagem": mensagem,
+        "segundos": round(fim - iniciada_em, 2)
+    }
+
+
+def resumo_gravado(conn, importacao_id):
+    """Resumo de uma importação gravada na tabela (de qualquer worker); None se não existe"""
+    linha = conn.execute("SELECT * FROM importacoes WHERE id = ?", (importacao_id,)).fetchone()
+    if linha is None:
+        return None
+    return _resumo(linha['id'], linha['estado'], linha['total'], linha['processados'], linha['importados'],
+                   linha['com_erro'], json.loads(linha['erros'] or '[]'), linha['mensagem'],
+                   linha['iniciada_em'], linha['concluida_em'])
+
+
+def apagar_antigas(conn, manter):
+    """Apaga o progresso guardado, menos o das `manter` importações mais recentes"""
+    conn.execute("""
+        DELETE FROM importacoes WHERE id NOT IN (
+            SELECT id FROM importacoes ORDER BY iniciada_em DESC LIMIT ?
+        )
+    """, (manter,))
+    conn.commit()
+
+
+class Importacao:
+    """Estado e progresso de uma importação (consultado enquanto ela roda)"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.estado = 'lendo'  # lendo → processando → gravando → concluida | falhou
+        self.total = 0
+        self.processados = 0
+        self.importados = 0
+        self.erros = []
+        self.mensagem = None
+        self.iniciada_em = time.time()
+        self.concluida_em = None
+
+    def registrar_erro(self, linha, erro):
+        self.erros.append({"linha": linha, "erro": erro})
+
+    def resumo(self):
+        return _resumo(self.id, self.estado, self.total, self.processados, self.importados, len(self.erros),
+                       self.erros, self.mensagem, self.iniciada_em, self.concluida_em)
+
+    def gravar(self, conn):
+        """Grava o progresso atual na tabela importacoes (e confirma)"""
+        conn.execute("""
+            INSERT OR REPLACE INTO importacoes (id, estado, total, processados, importados, com_erro,
+                                                erros, mensagem, iniciada_em, concluida_em)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (self.id, self.estado, self.total, self.processados, self.importados, len(self.erros),
+              json.dumps(self.erros[:MAX_ERROS_RESUMO], ensure_ascii=False), self.mensagem,
+              self.iniciada_em, self.concluida_em))
+        conn.commit()
+
+
+# -----------------------------------------------------------
+# LEITURA E VALIDAÇÃO DAS LINHAS
+# -----------------------------------------------------------
+
+def detectar_formato(nome_arquivo):
+    """'csv' ou 'jsonl' pela extensão; None se não suportado"""
+    extensao = os.path.splitext(nome_arquivo.lower())[1]
+    if extensao == '.csv':
+        return 'csv'
+    if extensao in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    return None
+
+
+def ler_linhas(caminho, formato):
+    """Gera (número da linha no arquivo, dados, erro) para cada produto"""
+    with open(caminho, encoding='utf-8-sig', newline='') as f:
+        if formato == 'csv':
+            leitor = csv.DictReader(f)
+            for dados in leitor:
+                yield leitor.line_num, dados, None
+            return
+
+        for numero, texto in enumerate(f, start=1):
+            if not texto.strip():
+                continue
+            try:
+                dados = json.loads(texto)
+            except ValueError:
+                yield numero, None, "JSON inválido"
+                continue
+            if not isinstance(dados, dict):
+                yield numero, None, "Cada linha deve ser um objeto JSON"
+                continue
+            yield numero, dados, None
+
+
+def _texto(dados, campo):
+    valor = dados.get(campo)
+    return str(valor).strip() if valor is not None else ''
+
+
+def validar_linha(dados):
+    """Normaliza os campos de um produto; ValueError com a mensagem se inválido"""
+    produto = {
+        "nome": _texto(dados, 'nome'),
+        "localizacao": _texto(dados, 'localizacao'),
+        "categoria": _texto(dados, 'categoria') or 'Geral',
+        "codigo": _texto(dados, 'codigo') or None,
+        "imagem": _texto(dados, 'imagem') or None,
+    }
+
+    if not produto['nome'] or not produto['localizacao']:
+        raise ValueError("Nome e localização são obrigatórios")
+
+    try:
+        produto['quantidade'] = int(_texto(dados, 'quantidade'))
+    except ValueError:
+        raise ValueError("Quantidade deve ser um número inteiro")
+    try:
+        produto['preco'] = float(_texto(dados, 'preco') or 0)
+    except ValueError:
+        raise ValueError("Preço inválido")
+
+    if produto['quantidade'] < 0:
+        raise ValueError("Quantidade não pode ser negativa")
+    if produto['preco'] < 0:
+        raise ValueError("Preço não pode ser negativo")
+
+    return produto
+
+
+# -----------------------------------------------------------
+# TRABALHO NO POOL DE PROCESSOS
+# -----------------------------------------------------------
+
+# Zip aberto uma vez por processo do pool (ler o índice do zip a cada
+# imagem custaria caro com milhares de arquivos)
+_zips_abertos = {}
+
+
+def _abrir_zip(caminho):
+    arquivo = _zips_abertos.get(caminho)
+    if arquivo is None:
+        arquivo = _zips_abertos[caminho] = zipfile.ZipFile(caminho)
+    return arquivo
+
+
+def processar_item(tarefa):
+    """
+    Executado no pool: imagem (validação, hash, normalização, gravação) e QR
+    Code de um produto. Retorna (imagem_path, miniatura_path, imagem_dhash,
+    png do QR Code, erro).
+    """
+    codigo, zip_caminho, nome_imagem, pasta_imagens = tarefa
+    imagem_path = miniatura_path = dhash = None
+    try:
+        # QR Code antes da imagem: um erro nele não deixa imagem gravada sem produto
+        png = renderizar(codigo, 'png')
+        if nome_imagem:
+            if not zip_caminho:
+                return None, None, None, None, f"Imagem '{nome_imagem}' informada, mas nenhum zip foi enviado"
+            arquivo = _abrir_zip(zip_caminho)
+            try:
+                info = arquivo.getinfo(nome_imagem)
+            except KeyError:
+                return None, None, None, None, f"Imagem '{nome_imagem}' não está no zip"
+            if info.file_size > TAMANHO_MAX_IMAGEM:
+                return None, None, None, None, f"Imagem '{nome_imagem}' muito grande"
+
+            imagem = ImagemRecebida.de_bytes(arquivo.read(info), TAMANHO_MAX_IMAGEM)
+            dhash = hash_para_texto(imagem.dhash)
+
+            # Já estamos num processo do pool: a imagem entra normalizada, sem passar pela fila
+            normalizada, miniatura = normalizar(imagem.dados)
+            imagem_path = salvar_blob(pasta_imagens, normalizada, extensao_normalizada())
+            miniatura_path = salvar_blob(pasta_imagens, miniatura, extensao_normalizada())
+    except Exception as e:
+        return None, None, None, None, f"Erro ao processar imagem/QR Code: {e}"
+
+    return imagem_path, miniatura_path, dhash, png, None
+
+
+def _mapear(tarefas):
+    """processar_item em todas as tarefas, em ordem; no pool se valer a pena"""
+    if len(tarefas) < MIN_ITENS_POOL:
+        yield from map(processar_item, tarefas)
+        return
+    # spawn: roda na thread da importação, dentro de um worker web com outras threads (ver processos.py)
+    with novo_pool(TRABALHADORES) as pool:
+        yield from pool.map(processar_item, tarefas, chunksize=LOTE_POOL)
+
+
+# -----------------------------------------------------------
+# IMPORTAÇÃO
+# -----------------------------------------------------------
+
+def apagar_imagens_orfas(conn, pasta, nomes):
+    """
+    Apaga da pasta as imagens que nenhum produto usa (gravadas por uma
+    importação que não entrou no banco). O armazém é endereçado por conteúdo:
+    a mesma imagem pode já ser de um produto cadastrado antes, e essa fica.
+    """
+    for nome in nomes:
+        em_uso = conn.execute(
+            "SELECT 1 FROM produtos WHERE imagem_path = ? OR miniatura_path = ? LIMIT 1", (nome, nome)
+        ).fetchone()
+        if em_uso:
+            continue
+        try:
+            os.remove(os.path.join(pasta, nome))
+        except FileNotFoundError:
+            pass
+
+
+def executar(conn, caminho, formato, zip_caminho, pasta_imagens, cache_qrcodes,
+             importacao=None, ao_progredir=None):
+    """
+    Importa o arquivo no banco da conexão. `ao_progredir(importacao)` é
+    chamado a cada bloco processado. Retorna a Importacao com o resultado.
+    """
+    importacao = importacao or Importacao()
+    avisar = ao_progredir or (lambda _: None)
+    imagens_gravadas = set()
+
+    try:
+        validos = []
+        codigos_vistos = set()
+        for numero, dados, erro in ler_linhas(caminho, formato):
+            importacao.total += 1
+            if erro is None:
+                try:
+                    produto = validar_linha(dados)
+                    if produto['codigo'] in codigos_vistos:
+                        raise ValueError(f"Código '{produto['codigo']}' repetido no arquivo")
+                    if produto['codigo']:
+                        codigos_vistos.add(produto['codigo'])
+                    validos.append((numero, produto))
+                    continue
+                except ValueError as e:
+                    erro = str(e)
+            importacao.registrar_erro(numero, erro)
+            importacao.processados += 1
+
+        # Códigos informados que já existem no banco
+        existentes = codigos_existentes(conn, codigos_vistos)
+        if existentes:
+            for numero, produto in validos:
+                if produto['codigo'] in existentes:
+                    importacao.registrar_erro(numero, f"Código '{produto['codigo']}' já cadastrado")
+                    importacao.processados += 1
+            validos = [(n, p) for n, p in validos if p['codigo'] not in existentes]
+
+        # Todos os códigos que faltam, reservados num bloco só
+        sem_codigo = [produto for _, produto in validos if not produto['codigo']]
+        if sem_codigo:
+            for produto, codigo in zip(sem_codigo, reservar_codigos(conn, len(sem_codigo), codigos_vistos)):
+                produto['codigo'] = codigo
+
+        importacao.estado = 'processando'
+        avisar(importacao)
+
+        tarefas = [
+            (produto['codigo'], zip_caminho, produto['imagem'], pasta_imagens)
+            for _, produto in validos
+        ]
+        agora = datetime.now()
+        linhas = []
+        for (numero, produto), (imagem_path, miniatura_path, dhash, png, erro) in zip(validos, _mapear(tarefas)):
+            importacao.processados += 1
+            imagens_gravadas.update(nome for nome in (imagem_path, miniatura_path) if nome)
+            if erro:
+                importacao.registrar_erro(numero, erro)
+            else:
+                cache_qrcodes.guardar(produto['codigo'], 'png', png)
+                linhas.append((
+                    produto['nome'], normalizar_nome(produto['nome']), produto['quantidade'], produto['preco'], produto['localizacao'],
+                    produto['codigo'], produto['categoria'], imagem_path, miniatura_path, dhash, agora, agora
+                ))
+            if importacao.processados % LOTE_POOL == 0:
+                avisar(importacao)
+
+        importacao.estado = 'gravando'
+        avisar(importacao)
+
+        # Uma transação só: ou entram todas as linhas válidas, ou nenhuma
+        with conn:
+            conn.executemany("""
+                INSERT INTO produtos (nome, nome_normalizado, quantidade, preco, localizacao, codigo, categoria,
+                                      imagem_path, miniatura_path, imagem_dhash, criado_em, atualizado_em)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, linhas)
+
+        importacao.importados = len(linhas)
+        importacao.estado = 'concluida'
+
+    except Exception as e:
+        importacao.estado = 'falhou'
+        importacao.mensagem = str(e)
+        try:
+            apagar_imagens_orfas(conn, pasta_imagens, imagens_gravadas)
+        except Exception as e:
+            print(f"⚠️ Erro ao apagar as imagens da importação que falhou: {e}")
+
+    importacao.concluida_em = time.time()
+    avisar(importacao)
+    return importacao
+
+
+def importar_em_segundo_plano(caminho_banco, pasta_temporaria, caminho, formato, zip_caminho,
+                              pasta_imagens, cache_qrcodes, importacao):
+    """
+    Roda a importação numa thread com conexão própria, gravando o progresso
+    na tabela importacoes, e apaga a pasta temporária dos arquivos enviados
+    ao terminar.
+    """
+    def rodar():
+        conn = abrir_conexao(caminho_banco)
+
+        def gravar_progresso(importacao):
+            # Progresso que não grava (banco travado) não derruba a importação
+            try:
+                importacao.gravar(conn)
+            except sqlite3.Error as e:
+                print(f"⚠️ Erro ao gravar o progresso da importação {importacao.id}: {e}")
+
+        try:
+            executar(conn, caminho, formato, zip_caminho, pasta_imagens, cache_qrcodes, importacao,
+                     ao_progredir=gravar_progresso)
+        finally:
+            conn.close()
+            shutil.rmtree(pasta_temporaria, ignore_errors=True)
+
+    thread = threading.Thread(target=rodar, name=f"importacao-{importacao.id}", daemon=True)
+    thread.start()
+    return thread
+
+
+# -----------------------------------------------------------
+# LINHA DE COMANDO
+# -----------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa produtos em lote de um CSV ou JSONL")
+    parser.add_argument('arquivo', help="produtos.csv ou produtos.jsonl")
+    parser.add_argument('--imagens', help="zip com as imagens citadas na coluna 'imagem'")
+    parser.add_argument('--formato', choices=('csv', 'jsonl'), help="padrão: pela extensão do arquivo")
+    parser.add_argument('--banco', default='banco.db')
+    parser.add_argument('--pasta-imagens', default='static/produtos_imagens')
+    parser.add_argument('--pasta-qrcodes', default='static/qrcodes')
+    args = parser.parse_args(argv)
+
+    formato = args.formato or detectar_formato(args.arquivo)
+    if not formato:
+        parser.error("Formato não reconhecido: use .csv, .jsonl ou --formato")
+
+    os.makedirs(args.pasta_imagens, exist_ok=True)
+
+    def mostrar(importacao):
+        print(f"\r⏳ {importacao.estado}: {importacao.processados}/{importacao.total} linhas, "
+              f"{len(importacao.erros)} com erro", end='', flush=True)
+
+    # O app migra o banco só na primeira requisição: um banco que ele ainda não
+    # abriu pode estar num esquema antigo (sem nome_normalizado, gatilhos, FTS)
+    from main import MIGRACOES
+
+    conn = abrir_conexao(args.banco)
+    try:
+        aplicadas = migrar(conn, MIGRACOES)
+        if aplicadas:
+            print(f"✅ {args.banco} migrado para a versão {aplicadas[-1]}")
+        importacao = executar(conn, args.arquivo, formato, args.imagens,
+                              args.pasta_imagens, CacheQRCodes(args.pasta_qrcodes), ao_progredir=mostrar)
+    finally:
+        conn.close()
+    print()
+
+    for erro in importacao.erros[:20]:
+        print(f"❌ Linha {erro['linha']}: {erro['erro']}")
+    if len(importacao.erros) > 20:
+        print(f"   ... e mais {len(importacao.erros) - 20} erros")
+
+    if importacao.estado != 'concluida':
+        print(f"❌ Importação falhou: {importacao.mensagem}")
+        return 1
+
+    resumo = importacao.resumo()
+    print(f"✅ {resumo['importados']} produtos importados em {resumo['segundos']}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Índice de imagens de produtos por hash perceptual (dHash)
+
+Cada imagem cadastrada vira uma impressão digital de 64 bits, calculada uma
+única vez e gravada na coluna produtos.imagem_dhash. As impressões ficam em
+memória numa árvore BK, de modo que o escaneamento por imagem é uma busca do
+vizinho mais próximo por distância de Hamming, sem reler os arquivos do disco.
+
+Cada processo tem o seu índice e acompanha as mudanças feitas pelos outros
+pela coluna produtos.imagem_versao: um contador crescente que os triggers
+gravam sempre que um produto entra com imagem ou muda imagem_path ou
+imagem_dhash (cadastro novo, troca de imagem, imagem removida).
+"""
+
+import os
+import threading
+from io import BytesIO
+
+from etapas import etapa
+
+TAMANHO_HASH = 8  # 8x8 = 64 bits
+
+
+TRIGGERS_VERSAO = [
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_imagem_versao_insert
+    AFTER INSERT ON produtos WHEN new.imagem_path IS NOT NULL BEGIN
+        UPDATE produtos SET imagem_versao = (SELECT COALESCE(MAX(imagem_versao), 0) + 1 FROM produtos)
+        WHERE id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS produtos_imagem_versao_update
+    AFTER UPDATE OF imagem_path, imagem_dhash ON produtos BEGIN
+        UPDATE produtos SET imagem_versao = (SELECT COALESCE(MAX(imagem_versao), 0) + 1 FROM produtos)
+        WHERE id = new.id;
+    END
+    """,
+]
+
+
+def criar_versao_imagens(cursor):
+    """Coluna imagem_versao, o índice dela e os triggers que a mantêm"""
+    colunas = [row[1] for row in cursor.execute("PRAGMA table_info(produtos)").fetchall()]
+    if 'imagem_versao' not in colunas:
+        cursor.execute("ALTER TABLE produtos ADD COLUMN imagem_versao INTEGER")
+    cursor.execute("UPDATE produtos SET imagem_versao = id WHERE imagem_path IS NOT NULL AND imagem_versao IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_produto_imagem_versao ON produtos(imagem_versao)")
+    for comando in TRIGGERS_VERSAO:
+        cursor.execute(comando)
+
+
+def calcular_hashes_faltantes(conn, pasta_imagens):
+    """
+    Calcula e grava o imagem_dhash dos produtos cadastrados antes da coluna
+    (para rodar numa migração, sem commit). Retorna quantos foram gravados.
+    """
+    produtos = conn.execute(
+        "SELECT id, imagem_path FROM produtos WHERE imagem_path IS NOT NULL AND imagem_dhash IS NULL"
+    ).fetchall()
+
+    calculados = []
+    for produto_id, imagem_path in produtos:
+        try:
+            with open(os.path.join(pasta_imagens, imagem_path), 'rb') as f:
+                calculados.append((hash_para_texto(calcular_dhash(f.read())), produto_id))
+        except Exception as e:
+            print(f"❌ Erro ao calcular hash da imagem {imagem_path}: {e}")
+
+    conn.executemany("UPDATE produtos SET imagem_dhash = ? WHERE id = ?", calculados)
+    return len(calculados)
+
+
+def calcular_dhash(img_bytes, tamanho=TAMANHO_HASH):
+    """Calcula o dHash (gradiente horizontal) de uma imagem em bytes"""
+    from PIL import Image  # só aqui: importar o app não carrega o Pillow
+
+    with Image.open(BytesIO(img_bytes)) as img:
+        # Para JPEG, o draft decodifica já reduzido (bem mais rápido)
+        img.draft('L', (tamanho * 4, tamanho * 4))
+        cinza = img.convert('L').resize((tamanho + 1, tamanho), Image.LANCZOS)
+
+    pixels = list(cinza.getdata())
+    largura = tamanho + 1
+    valor = 0
+    for linha in range(tamanho):
+        inicio = linha * largura
+        for coluna in range(tamanho):
+            valor = (valor << 1) | (pixels[inicio + coluna] > pixels[inicio + coluna + 1])
+    return valor
+
+
+def hash_para_texto(valor):
+    """Formata o hash como 16 dígitos hexadecimais (para o banco)"""
+    return f"{valor:016x}"
+
+
+def texto_para_hash(texto):
+    return int(texto, 16)
+
+
+def distancia_hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class ArvoreBK:
+    """Árvore BK sobre a distância de Hamming entre hashes"""
+
+    def __init__(self):
+        # Nó: [hash, conjunto de valores, {distância: nó filho}]
+        self._raiz = None
+
+    def adicionar(self, chave, valor):
+        if self._raiz is None:
+            self._raiz = [chave, {valor}, {}]
+            return
+
+        no = self._raiz
+        while True:
+            distancia = distancia_hamming(chave, no[0])
+            if distancia == 0:
+                no[1].add(valor)
+                return
+            filho = no[2].get(distancia)
+            if filho is None:
+                no[2][distancia] = [chave, {valor}, {}]
+                return
+            no = filho
+
+    def remover(self, chave, valor):
+        """Remove o valor do nó; o nó continua na árvore para roteamento"""
+        no = self._raiz
+        while no is not None:
+            distancia = distancia_hamming(chave, no[0])
+            if distancia == 0:
+                no[1].discard(valor)
+                return
+            no = no[2].get(distancia)
+
+    def buscar(self, chave, distancia_max):
+        """Retorna [(distância, valor)] com distância <= distancia_max, do mais próximo ao mais distante"""
+        if self._raiz is None:
+            return []
+
+        resultados = []
+        pilha = [self._raiz]
+        while pilha:
+            no = pilha.pop()
+            distancia = distancia_hamming(chave, no[0])
+            if distancia <= distancia_max:
+                resultados.extend((distancia, valor) for valor in no[1])
+            for d_filho in range(max(1, distancia - distancia_max), distancia + distancia_max + 1):
+                filho = no[2].get(d_filho)
+                if filho is not None:
+                    pilha.append(filho)
+
+        resultados.sort()
+        return resultados
+
+
+class IndiceImagens:
+    """Índice em memória produto_id -> dHash, sincronizado com a tabela produtos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arvore = ArvoreBK()
+        self._hashes = {}
+        self._versao = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def adicionar(self, produto_id, dhash):
+        with self._lock:
+            anterior = self._hashes.get(produto_id)
+            if anterior is not None:
+                self._arvore.remover(anterior, produto_id)
+            self._hashes[produto_id] = dhash
+            self._arvore.adicionar(dhash, produto_id)
+
+    def remover(self, produto_id):
+        with self._lock:
+            anterior = self._hashes.pop(produto_id, None)
+            if anterior is not None:
+                self._arvore.remover(anterior, produto_id)
+
+    def buscar(self, dhash, distancia_max):
+        with etapa('comparacao'), self._lock:
+            return self._arvore.buscar(dhash, distancia_max)
+
+    def sincronizar(self, conn):
+        """
+        Aplica as mudanças de imagem desde a última sincronização (deste ou de
+        outro processo): só lê, pela imagem_versao. Produto sem imagem ou sem
+        hash sai do índice.
+        """
+        produtos = conn.execute(
+            "SELECT id, imagem_path, imagem_dhash, imagem_versao FROM produtos "
+            "WHERE imagem_versao > ? ORDER BY imagem_versao",
+            (self._versao,)
+        ).fetchall()
+
+        for produto in produtos:
+            if produto['imagem_path'] and produto['imagem_dhash']:
+                self.adicionar(produto['id'], texto_para_hash(produto['imagem_dhash']))
+            else:
+                self.remover(produto['id'])
+
+        if produtos:
+            with self._lock:
+                self._versao = max(self._versao, produtos[-1]['imagem_versao'])
@@ -0,0 +1,773 @@
+"""
+Leitura de QR Code no servidor, só com PIL (funciona offline)
+
+Quando o frontend envia apenas a foto, o servidor tenta ler o QR Code antes
+de cair na comparação de imagens. O frame é convertido para tons de cinza,
+reduzido e binarizado com alguns limiares; em cada tentativa localizamos os
+três padrões localizadores, amostramos a grade de módulos, corrigimos erros
+com Reed-Solomon e decodificamos os segmentos (numérico, alfanumérico e byte).
+
+A leitura é Python puro e gasta CPU: roda num pool limitado de processos
+(fora do GIL das threads que atendem as requisições). Se o pool estiver
+cheio ou a leitura passar do tempo limite, a rota segue como se não houvesse
+QR Code; o próprio leitor confere o prazo nos laços e desiste, então uma
+leitura abandonada não continua ocupando o processo.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from io import BytesIO
+from itertools import combinations, groupby
+
+from processos import novo_pool
+
+LADOS_MAX = (800, 1600)  # Reduções tentadas (maior lado, em pixels)
+MAX_TRABALHADORES = 2
+MAX_CANDIDATOS = 10  # localizadores candidatos combinados em trios
+TEMPO_LIMITE = 2.0  # segundos
+FOLGA_PROCESSO = 0.1  # segundos além do prazo para o resultado voltar do processo
+
+# Resultados de ler_qrcode_limitado (rótulo da métrica leituras_qrcode_total)
+LIDO = 'lido'
+SEM_QRCODE = 'sem_qrcode'
+LOTADO = 'lotado'
+TEMPO_ESGOTADO = 'tempo_esgotado'
+ERRO = 'erro'
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================
+# TABELAS DO PADRÃO QR (ISO/IEC 18004)
+# ========================================================================
+
+# Índice do nível de correção: L, M, Q, H
+NIVEIS = {1: 0, 0: 1, 3: 2, 2: 3}  # bits do formato -> índice nas tabelas
+
+ECC_POR_BLOCO = (
+    (-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    (-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+)
+
+NUM_BLOCOS = (
+    (-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    (-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    (-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+)
+
+ALFANUMERICO = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+
+MASCARAS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+
+def _formatos_validos():
+    """As 32 palavras de formato (15 bits, já com a máscara 0x5412)"""
+    formatos = {}
+    for dados in range(32):
+        resto = dados
+        for _ in range(10):
+            resto = (resto << 1) ^ ((resto >> 9) * 0x537)
+        formatos[(dados << 10 | resto) ^ 0x5412] = dados
+    return formatos
+
+
+FORMATOS = _formatos_validos()
+
+
+class QRCodeIlegivel(Exception):
+    """A grade amostrada não forma um QR Code válido"""
+
+
+class TempoEsgotado(Exception):
+    """A leitura passou do prazo"""
+
+
+def _conferir_prazo(prazo):
+    # prazo em time.time(): o relógio de parede é o mesmo no processo do pool e no que espera
+    if prazo is not None and time.time() > prazo:
+        raise TempoEsgotado()
+
+
+# ========================================================================
+# REED-SOLOMON EM GF(256)
+# ========================================================================
+
+GF_EXP = [0] * 512
+GF_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+for _i in range(255, 512):
+    GF_EXP[_i] = GF_EXP[_i - 255]
+
+
+def _gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def _gf_div(a, b):
+    if a == 0:
+        return 0
+    return GF_EXP[(GF_LOG[a] + 255 - GF_LOG[b]) % 255]
+
+
+def _gf_pow(a, n):
+    return GF_EXP[(GF_LOG[a] * n) % 255]
+
+
+def _poly_eval(poly, x):
+    y = poly[0]
+    for coef in poly[1:]:
+        y = _gf_mul(y, x) ^ coef
+    return y
+
+
+def _poly_add(p, q):
+    r = [0] * max(len(p), len(q))
+    for i, c in enumerate(p):
+        r[i + len(r) - len(p)] = c
+    for i, c in enumerate(q):
+        r[i + len(r) - len(q)] ^= c
+    return r
+
+
+def _poly_mul(p, q):
+    r = [0] * (len(p) + len(q) - 1)
+    for j, cq in enumerate(q):
+        for i, cp in enumerate(p):
+            r[i + j] ^= _gf_mul(cp, cq)
+    return r
+
+
+def _poly_scale(p, x):
+    return [_gf_mul(c, x) for c in p]
+
+
+def corrigir_bloco(bloco, n_ecc):
+    """Corrige até n_ecc/2 bytes errados no bloco (dados + ECC)"""
+    # sindromes[0] é um zero de preenchimento; S_i fica em sindromes[i + 1]
+    sindromes = [0] + [_poly_eval(bloco, GF_EXP[i]) for i in range(n_ecc)]
+    if not any(sindromes):
+        return bloco
+
+    # Berlekamp-Massey: polinômio localizador de erros
+    localizador = [1]
+    anterior = [1]
+    for i in range(n_ecc):
+        delta = sindromes[i + 1]
+        for j in range(1, len(localizador)):
+            delta ^= _gf_mul(localizador[-(j + 1)], sindromes[i + 1 - j])
+        anterior = anterior + [0]
+        if delta:
+            if len(anterior) > len(localizador):
+                novo = _poly_scale(anterior, delta)
+                anterior = _poly_scale(localizador, _gf_div(1, delta))
+                localizador = novo
+            localizador = _poly_add(localizador, _poly_scale(anterior, delta))
+    while localizador and localizador[0] == 0:
+        localizador.pop(0)
+
+    n_erros = len(localizador) - 1
+    if n_erros * 2 > n_ecc:
+        raise QRCodeIlegivel("Erros demais para corrigir")
+
+    # Chien: posições dos erros
+    invertido = localizador[::-1]
+    posicoes = [len(bloco) - 1 - i for i in range(len(bloco)) if _poly_eval(invertido, _gf_pow(2, i)) == 0]
+    if len(posicoes) != n_erros:
+        raise QRCodeIlegivel("Não foi possível localizar os erros")
+
+    # Forney: magnitudes
+    coef_pos = [len(bloco) - 1 - p for p in posicoes]
+    loc = [1]
+    for p in coef_pos:
+        loc = _poly_mul(loc, _poly_add([1], [_gf_pow(2, p), 0]))
+    produto = _poly_mul(sindromes[::-1], loc)
+    avaliador = produto[-len(loc):]  # resto da divisão por x^(len(loc))
+
+    x_erros = [_gf_pow(2, p) for p in coef_pos]
+    correcao = [0] * len(bloco)
+    for i, xi in enumerate(x_erros):
+        xi_inv = _gf_div(1, xi)
+        derivada = 1
+        for j, xj in enumerate(x_erros):
+            if j != i:
+                derivada = _gf_mul(derivada, 1 ^ _gf_mul(xi_inv, xj))
+        if derivada == 0:
+            raise QRCodeIlegivel("Não foi possível corrigir os erros")
+        y = _gf_mul(xi, _poly_eval(avaliador, xi_inv))
+        correcao[posicoes[i]] = _gf_div(y, derivada)
+
+    corrigido = [a ^ b for a, b in zip(bloco, correcao)]
+    if any(_poly_eval(corrigido, GF_EXP[i]) for i in range(n_ecc)):
+        raise QRCodeIlegivel("Correção de erros falhou")
+    return corrigido
+
+
+# ========================================================================
+# ESTRUTURA DA MATRIZ
+# ========================================================================
+
+def _posicoes_alinhamento(versao):
+    if versao == 1:
+        return []
+    quantidade = versao // 7 + 2
+    passo = (versao * 8 + quantidade * 3 + 5) // (quantidade * 4 - 4) * 2
+    tamanho = versao * 4 + 17
+    return [6] + sorted(tamanho - 7 - i * passo for i in range(quantidade - 1))
+
+
+def _modulos_de_dados(versao):
+    resultado = (16 * versao + 128) * versao + 64
+    if versao >= 2:
+        quantidade = versao // 7 + 2
+        resultado -= (25 * quantidade - 10) * quantidade - 55
+        if versao >= 7:
+            resultado -= 36
+    return resultado
+
+
+@lru_cache(maxsize=None)
+def _mapa_funcoes(versao):
+    """Matriz booleana [y][x]: True onde o módulo não carrega dados"""
+    tamanho = versao * 4 + 17
+    mapa = [[False] * tamanho for _ in range(tamanho)]
+
+    def marcar(x0, y0, x1, y1):
+        for y in range(max(0, y0), min(tamanho, y1)):
+            for x in range(max(0, x0), min(tamanho, x1)):
+                mapa[y][x] = True
+
+    # Localizadores + separadores + áreas de formato
+    marcar(0, 0, 9, 9)
+    marcar(tamanho - 8, 0, tamanho, 9)
+    marcar(0, tamanho - 8, 9, tamanho)
+    # Temporização
+    marcar(6, 0, 7, tamanho)
+    marcar(0, 6, tamanho, 7)
+    # Alinhamento
+    posicoes = _posicoes_alinhamento(versao)
+    ultimo = len(posicoes) - 1
+    for i, py in enumerate(posicoes):
+        for j, px in enumerate(posicoes):
+            if (i, j) in ((0, 0), (0, ultimo), (ultimo, 0)):
+                continue
+            marcar(px - 2, py - 2, px + 3, py + 3)
+    # Informação de versão
+    if versao >= 7:
+        marcar(tamanho - 11, 0, tamanho - 8, 6)
+        marcar(0, tamanho - 11, 6, tamanho - 8)
+    return mapa
+
+
+def _ler_formato(matriz):
+    """Retorna (índice do nível, máscara) lendo as duas cópias do formato"""
+    tamanho = len(matriz)
+    copia1 = 0
+    posicoes1 = [(8, i) for i in range(6)] + [(8, 7), (8, 8), (7, 8)] + [(14 - i, 8) for i in range(9, 15)]
+    for i, (x, y) in enumerate(posicoes1):
+        copia1 |= matriz[y][x] << i
+    copia2 = 0
+    posicoes2 = [(tamanho - 1 - i, 8) for i in range(8)] + [(8, tamanho - 15 + i) for i in range(8, 15)]
+    for i, (x, y) in enumerate(posicoes2):
+        copia2 |= matriz[y][x] << i
+
+    melhor, distancia = None, 16
+    for palavra, dados in FORMATOS.items():
+        for lido in (copia1, copia2):
+            d = bin(palavra ^ lido).count('1')
+            if d < distancia:
+                melhor, distancia = dados, d
+    if distancia > 3:
+        raise QRCodeIlegivel("Informação de formato ilegível")
+    return NIVEIS[melhor >> 3], melhor & 7
+
+
+def _ler_codewords(matriz, versao, mascara):
+    tamanho = len(matriz)
+    funcoes = _mapa_funcoes(versao)
+    total = _modulos_de_dados(versao) // 8
+    aplicar = MASCARAS[mascara]
+
+    bits = []
+    direita = tamanho - 1
+    while direita >= 1:
+        if direita == 6:
+            direita = 5
+        subindo = ((direita + 1) & 2) == 0
+        for vertical in range(tamanho):
+            y = tamanho - 1 - vertical if subindo else vertical
+            for j in range(2):
+                x = direita - j
+                if not funcoes[y][x]:
+                    bits.append(matriz[y][x] ^ aplicar(x, y))
+        direita -= 2
+
+    return [
+        int(''.join(map(str, bits[i * 8:i * 8 + 8])), 2)
+        for i in range(total)
+    ]
+
+
+def _desintercalar(codewords, versao, nivel):
+    """Separa os blocos, corrige cada um e devolve só os bytes de dados"""
+    n_blocos = NUM_BLOCOS[nivel][versao]
+    n_ecc = ECC_POR_BLOCO[nivel][versao]
+    total = len(codewords)
+    n_curtos = n_blocos - total % n_blocos
+    tam_curto = total // n_blocos
+    dados_curto = tam_curto - n_ecc
+
+    blocos = [[] for _ in range(n_blocos)]
+    it = iter(codewords)
+    for i in range(tam_curto + 1):
+        for j in range(n_blocos):
+            if i == dados_curto and j < n_curtos:
+                continue
+            blocos[j].append(next(it))
+
+    dados = []
+    for bloco in blocos:
+        corrigido = corrigir_bloco(bloco, n_ecc)
+        dados.extend(corrigido[:len(bloco) - n_ecc])
+    return dados
+
+
+def _decodificar_segmentos(dados, versao):
+    bits = ''.join(f"{b:08b}" for b in dados)
+    pos = 0
+    faixa = 0 if versao <= 9 else (1 if versao <= 26 else 2)
+    partes = []
+
+    def ler(n):
+        nonlocal pos
+        if pos + n > len(bits):
+            raise QRCodeIlegivel("Dados truncados")
+        valor = int(bits[pos:pos + n], 2)
+        pos += n
+        return valor
+
+    while pos + 4 <= len(bits):
+        modo = ler(4)
+        if modo == 0:
+            break
+        if modo == 1:  # numérico
+            n = ler((10, 12, 14)[faixa])
+            texto = []
+            while n >= 3:
+                texto.append(f"{ler(10):03d}")
+                n -= 3
+            if n == 2:
+                texto.append(f"{ler(7):02d}")
+            elif n == 1:
+                texto.append(str(ler(4)))
+            partes.append(''.join(texto))
+        elif modo == 2:  # alfanumérico
+            n = ler((9, 11, 13)[faixa])
+            texto = []
+            while n >= 2:
+                valor = ler(11)
+                texto.append(ALFANUMERICO[valor // 45] + ALFANUMERICO[valor % 45])
+                n -= 2
+            if n:
+                texto.append(ALFANUMERICO[ler(6)])
+            partes.append(''.join(texto))
+        elif modo == 4:  # byte
+            n = ler((8, 16, 16)[faixa])
+            brutos = bytes(ler(8) for _ in range(n))
+            try:
+                partes.append(brutos.decode('utf-8'))
+            except UnicodeDecodeError:
+                partes.append(brutos.decode('latin-1'))
+        elif modo == 7:  # ECI: ignorado
+            ler(8)
+        else:
+            raise QRCodeIlegivel(f"Modo de dados não suportado: {modo}")
+
+    return ''.join(partes)
+
+
+def decodificar_matriz(matriz):
+    """Decodifica a matriz de módulos (listas de 0/1, 1 = escuro)"""
+    tamanho = len(matriz)
+    versao = (tamanho - 17) // 4
+    if versao < 1 or versao > 40 or versao * 4 + 17 != tamanho:
+        raise QRCodeIlegivel("Tamanho de matriz inválido")
+    nivel, mascara = _ler_formato(matriz)
+    codewords = _ler_codewords(matriz, versao, mascara)
+    dados = _desintercalar(codewords, versao, nivel)
+    return _decodificar_segmentos(dados, versao)
+
+
+# ========================================================================
+# LOCALIZAÇÃO NA IMAGEM
+# ========================================================================
+
+def _proporcao_localizador(runs):
+    """Confere a proporção 1:1:3:1:1 de um padrão localizador"""
+    total = sum(runs)
+    if total < 7:
+        return False
+    modulo = total / 7.0
+    tolerancia = modulo / 1.5
+    return (abs(modulo - runs[0]) < tolerancia and abs(modulo - runs[1]) < tolerancia
+            and abs(3 * modulo - runs[2]) < 3 * tolerancia
+            and abs(modulo - runs[3]) < tolerancia and abs(modulo - runs[4]) < tolerancia)
+
+
+def _runs_na_direcao(pixels, largura, altura, x, y, dx, dy):
+    """
+    Mede o padrão escuro-claro-ESCURO-claro-escuro que passa por (x, y) na
+    direção (dx, dy). Retorna (runs, deslocamento do centro em passos a
+    partir de (x, y)) ou None se (x, y) não for escuro.
+    """
+    def escuro(passo):
+        xx, yy = x + passo * dx, y + passo * dy
+        if 0 <= xx < largura and 0 <= yy < altura:
+            return pixels[yy * largura + xx] == 0
+        return None  # fora da imagem
+
+    if not escuro(0):
+        return None
+    runs = [0] * 5
+    passo = 0
+    while escuro(passo):
+        runs[2] += 1
+        passo -= 1
+    for indice, cor in ((1, False), (0, True)):
+        while escuro(passo) is cor:
+            runs[indice] += 1
+            passo -= 1
+    passo = 1
+    while escuro(passo):
+        runs[2] += 1
+        passo += 1
+    for indice, cor in ((3, False), (4, True)):
+        while escuro(passo) is cor:
+            runs[indice] += 1
+            passo += 1
+    fim = passo - runs[4] - runs[3]  # primeiro passo depois do escuro central
+    return runs, fim - runs[2] / 2.0
+
+
+def _conferir_localizador(pixels, largura, altura, x, y):
+    """
+    Confere o candidato achado na linha y (centro horizontal x) na vertical,
+    de novo na horizontal pelo centro vertical e na diagonal. Dados comuns
+    formam 1:1:3:1:1 numa direção por acaso; um localizador forma nas três.
+    Retorna (centro_x, centro_y, tamanho do módulo) ou None.
+    """
+    medida = _runs_na_direcao(pixels, largura, altura, x, y, 0, 1)
+    if not medida or not _proporcao_localizador(medida[0]):
+        return None
+    vertical, deslocamento = medida
+    centro_y = y + deslocamento
+
+    medida = _runs_na_direcao(pixels, largura, altura, x, int(centro_y), 1, 0)
+    if not medida or not _proporcao_localizador(medida[0]):
+        return None
+    horizontal, deslocamento = medida
+    centro_x = x + deslocamento
+
+    altura_total, largura_total = sum(vertical), sum(horizontal)
+    if abs(altura_total - largura_total) > 0.4 * max(altura_total, largura_total):
+        return None
+
+    medida = _runs_na_direcao(pixels, largura, altura, int(centro_x), int(centro_y), 1, 1)
+    if not medida or not _proporcao_localizador(medida[0]):
+        return None
+
+    # Girado, o localizador parece mais largo na linha/coluna (até √2 a 45°) e
+    # mais estreito na diagonal: a menor das larguras é a mais próxima da real
+    ortogonal = (altura_total + largura_total) / 2.0
+    diagonal = sum(medida[0]) * 2 ** 0.5  # cada passo na diagonal anda √2 pixels
+    return centro_x, centro_y, min(ortogonal, diagonal) / 7.0
+
+
+def _encontrar_localizadores(pixels, largura, altura, prazo=None):
+    candidatos = []  # [x, y, tamanho do módulo, ocorrências]
+    passo = max(1, altura // 200)
+    for y in range(0, altura, passo):
+        _conferir_prazo(prazo)
+        linha = pixels[y * largura:(y + 1) * largura]
+        runs = []
+        inicio = 0
+        for valor, grupo in groupby(linha):
+            tamanho = sum(1 for _ in grupo)
+            runs.append((valor == 0, inicio, tamanho))
+            inicio += tamanho
+        for i in range(len(runs) - 4):
+            if not runs[i][0]:
+                continue
+            janela = [r[2] for r in runs[i:i + 5]]
+            if not _proporcao_localizador(janela):
+                continue
+            centro_x = int(runs[i + 2][1] + runs[i + 2][2] / 2.0)
+            localizador = _conferir_localizador(pixels, largura, altura, centro_x, y)
+            if not localizador:
+                continue
+            centro_x, centro_y, modulo = localizador
+            for c in candidatos:
+                if (abs(c[0] - centro_x) <= modulo * 2 and abs(c[1] - centro_y) <= modulo * 2
+                        and abs(c[2] - modulo) <= 0.5 * max(c[2], modulo)):
+                    n = c[3]
+                    c[0] = (c[0] * n + centro_x) / (n + 1)
+                    c[1] = (c[1] * n + centro_y) / (n + 1)
+                    c[2] = (c[2] * n + modulo) / (n + 1)
+                    c[3] = n + 1
+                    break
+            else:
+                candidatos.append([centro_x, centro_y, modulo, 1])
+
+    candidatos = [c for c in candidatos if c[3] >= 2]
+    candidatos.sort(key=lambda c: -c[3])
+    return candidatos[:MAX_CANDIDATOS]
+
+
+def _ordenar_localizadores(a, b, c):
+    """Retorna (superior esquerdo, superior direito, inferior esquerdo)"""
+    def dist2(p, q):
+        return (p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2
+
+    # O superior esquerdo é o vértice oposto ao maior lado
+    lados = [(dist2(b, c), a, b, c), (dist2(a, c), b, a, c), (dist2(a, b), c, a, b)]
+    _, se, p, q = max(lados, key=lambda item: item[0])
+    produto = (p[0] - se[0]) * (q[1] - se[1]) - (p[1] - se[1]) * (q[0] - se[0])
+    if produto < 0:
+        p, q = q, p
+    return se, p, q
+
+
+def _amostrador(pixels, largura, altura, se, sd, ie, tamanho):
+    """Função (coluna, linha) -> módulo (1 = escuro) da grade tamanho x tamanho, por transformação afim"""
+    escala = tamanho - 7.0
+    ux, uy = (sd[0] - se[0]) / escala, (sd[1] - se[1]) / escala
+    vx, vy = (ie[0] - se[0]) / escala, (ie[1] - se[1]) / escala
+
+    def modulo(coluna, linha):
+        u, v = coluna - 3.0, linha - 3.0
+        x = int(se[0] + u * ux + v * vx + 0.5)
+        y = int(se[1] + u * uy + v * vy + 0.5)
+        if 0 <= x < largura and 0 <= y < altura:
+            return 1 if pixels[y * largura + x] == 0 else 0
+        return 0
+    return modulo
+
+
+def _temporizacao_confere(modulo, tamanho):
+    """
+    Linha e coluna 6 entre os localizadores alternam escuro/claro. Conferir
+    isso custa O(tamanho) e descarta quase todo trio falso antes de amostrar
+    a grade inteira (O(tamanho²)).
+    """
+    posicoes = range(8, tamanho - 8)
+    if not posicoes:
+        return True
+    acertos = sum((modulo(i, 6) == (i % 2 == 0)) + (modulo(6, i) == (i % 2 == 0)) for i in posicoes)
+    return acertos >= 0.8 * 2 * len(posicoes)
+
+
+def _amostrar(modulo, tamanho):
+    """Matriz [linha][coluna] com os módulos da grade"""
+    return [[modulo(coluna, linha) for coluna in range(tamanho)] for linha in range(tamanho)]
+
+
+def _trios(candidatos):
+    """
+    Trios de candidatos que podem ser os três localizadores, do mais para o
+    menos provável: módulos parecidos e um ângulo reto no superior esquerdo
+    com os dois lados do mesmo tamanho.
+    """
+    trios = []
+    for trio in combinations(candidatos, 3):
+        modulos = [c[2] for c in trio]
+        if max(modulos) > 1.5 * min(modulos):
+            continue
+        se, sd, ie = _ordenar_localizadores(*trio)
+        topo = (sd[0] - se[0], sd[1] - se[1])
+        lado = (ie[0] - se[0], ie[1] - se[1])
+        d_topo = (topo[0] ** 2 + topo[1] ** 2) ** 0.5
+        d_lado = (lado[0] ** 2 + lado[1] ** 2) ** 0.5
+        if not d_topo or not d_lado:
+            continue
+        cosseno = abs(topo[0] * lado[0] + topo[1] * lado[1]) / (d_topo * d_lado)
+        diferenca = abs(d_topo - d_lado) / max(d_topo, d_lado)
+        if cosseno > 0.5 or diferenca > 0.5:
+            continue
+        trios.append((cosseno + diferenca, se, sd, ie, sum(modulos) / 3.0, (d_topo + d_lado) / 2.0))
+    trios.sort(key=lambda t: t[0])
+    return trios
+
+
+def _tentar_binaria(pixels, largura, altura, prazo=None):
+    candidatos = _encontrar_localizadores(pixels, largura, altura, prazo)
+    if len(candidatos) < 3:
+        return None
+
+    for _, se, sd, ie, modulo, distancia in _trios(candidatos):
+        versao = round((distancia / modulo + 7 - 17) / 4.0)
+        for v in (versao, versao - 1, versao + 1):
+            if not 1 <= v <= 40:
+                continue
+            _conferir_prazo(prazo)
+            tamanho = v * 4 + 17
+            modulo_grade = _amostrador(pixels, largura, altura, se, sd, ie, tamanho)
+            if not _temporizacao_confere(modulo_grade, tamanho):
+                continue
+            matriz = _amostrar(modulo_grade, tamanho)
+            try:
+                return decodificar_matriz(matriz)
+            except (QRCodeIlegivel, IndexError, StopIteration):
+                continue
+    return None
+
+
+def _limiar_otsu(histograma):
+    total = sum(histograma)
+    soma_total = sum(i * h for i, h in enumerate(histograma))
+    soma_fundo = peso_fundo = 0
+    melhor, limiar = 0, 128
+    for i, h in enumerate(histograma):
+        peso_fundo += h
+        if peso_fundo == 0:
+            continue
+        peso_frente = total - peso_fundo
+        if peso_frente == 0:
+            break
+        soma_fundo += i * h
+        media_fundo = soma_fundo / peso_fundo
+        media_frente = (soma_total - soma_fundo) / peso_frente
+        variancia = peso_fundo * peso_frente * (media_fundo - media_frente) ** 2
+        if variancia > melhor:
+            melhor, limiar = variancia, i
+    return limiar
+
+
+def ler_qrcode(dados, prazo=None):
+    """
+    Tenta ler um QR Code dos bytes da imagem.
+    Retorna o texto do QR Code ou None se nenhum for encontrado.
+    prazo: instante (time.time()) em que desiste com TempoEsgotado
+    """
+    _conferir_prazo(prazo)  # esperou demais na fila do pool
+    from PIL import Image  # só na primeira leitura: importar o app não carrega o Pillow
+
+    with Image.open(BytesIO(dados)) as original:
+        original.draft('L', (LADOS_MAX[-1], LADOS_MAX[-1]))
+        cinza = original.convert('L')
+
+    lados_tentados = set()
+    for lado_max in LADOS_MAX:
+        img = cinza
+        if max(img.size) > lado_max:
+            img = cinza.copy()
+            img.thumbnail((lado_max, lado_max))
+        if img.size in lados_tentados:
+            continue
+        lados_tentados.add(img.size)
+
+        largura, altura = img.size
+        limiar_otsu = _limiar_otsu(img.histogram())
+        limiares = []
+        for limiar in (limiar_otsu, 128, 96, 160):
+            if all(abs(limiar - outro) > 12 for outro in limiares):
+                limiares.append(limiar)
+
+        for limiar in limiares:
+            _conferir_prazo(prazo)
+            binaria = img.point(lambda p, t=limiar: 255 if p > t else 0)
+            texto = _tentar_binaria(binaria.tobytes(), largura, altura, prazo)
+            if texto:
+                return texto
+    return None
+
+
+# ========================================================================
+# POOL DE LEITURA
+# ========================================================================
+
+_executor = None
+_vagas = None
+_lock = threading.Lock()
+
+
+def _pool():
+    global _executor, _vagas
+    with _lock:
+        if _executor is None:
+            _executor = novo_pool(MAX_TRABALHADORES)
+            # Em execução + aguardando na fila
+            _vagas = threading.BoundedSemaphore(MAX_TRABALHADORES * 2)
+        return _executor, _vagas
+
+
+def _descartar_pool(executor):
+    """Um processo do pool morreu: o próximo pedido cria um pool novo"""
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def ler_qrcode_limitado(dados, tempo_limite=TEMPO_LIMITE):
+    """
+    Lê o QR Code no pool de processos.
+    Retorna (texto ou None, resultado), com resultado um de LIDO,
+    SEM_QRCODE, LOTADO, TEMPO_ESGOTADO ou ERRO. Sem texto, a rota segue
+    para a comparação de imagem.
+    """
+    executor, vagas = _pool()
+    if not vagas.acquire(blocking=False):
+        log.warning("Pool de leitura de QR Code lotado, pulando leitura no servidor")
+        return None, LOTADO
+
+    prazo = time.time() + tempo_limite
+    try:
+        futuro = executor.submit(ler_qrcode, dados, prazo)
+    except BrokenProcessPool:
+        vagas.release()
+        _descartar_pool(executor)
+        log.error("Pool de leitura de QR Code quebrado; será recriado")
+        return None, ERRO
+    except Exception:
+        vagas.release()
+        raise
+    futuro.add_done_callback(lambda _: vagas.release())
+
+    try:
+        texto = futuro.result(timeout=tempo_limite + FOLGA_PROCESSO)
+    except (FuturesTimeout, TempoEsgotado):
+        futuro.cancel()  # ainda na fila: nem começa (em execução, para sozinho no prazo)
+        log.warning("Tempo limite (%.1fs) na leitura de QR Code no servidor", tempo_limite)
+        return None, TEMPO_ESGOTADO
+    except BrokenProcessPool:
+        _descartar_pool(executor)
+        log.error("Pool de leitura de QR Code quebrado; será recriado")
+        return None, ERRO
+    except Exception:
+        log.exception("Erro ao ler QR Code")
+        return None, ERRO
+    return (texto, LIDO) if texto else (None, SEM_QRCODE)
@@ -0,0 +1,238 @@
+"""
+Listagem paginada de produtos
+
+Paginação por cursor (keyset) em (nome, id): cada página continua logo depois
+do último item da anterior com uma busca no índice de nome, então o custo de
+uma página não depende do tamanho da tabela nem de quantas páginas já foram
+lidas (ao contrário de OFFSET). O cliente escolhe as colunas com fields= e
+filtra por categoria e faixa de quantidade; cada filtro tem índice próprio
+(ver INDICES).
+
+Com faixa de quantidade a ordem passa a ser (quantidade, id). Em ordem de
+nome, o SQLite teria de escolher entre percorrer o índice de nome testando
+a quantidade de cada produto (a tabela inteira, se a faixa casa com
+poucos) e ler a faixa inteira pelo índice de quantidade para ordenar por
+nome numa B-tree temporária; nos dois casos o custo da página cresce com a
+tabela. Em (quantidade, id) a página é uma busca na faixa do índice
+idx_produto_quantidade (ou idx_produto_categoria_quantidade, com
+categoria), que já está nessa ordem.
+
+Parâmetros da query string:
+    limit           itens por página (padrão 100, máximo 500)
+    cursor          valor de "proximo_cursor" da página anterior
+    fields          campos separados por vírgula (ex: id,nome,quantidade)
+    categoria       categoria exata
+    quantidade_min  quantidade mínima (inclusive)
+    quantidade_max  quantidade máxima (inclusive)
+    stream=1        resposta NDJSON (também com Accept: application/x-ndjson)
+
+No modo stream a listagem inteira (a partir do cursor, com os filtros) sai
+como uma linha JSON por produto: a consulta é percorrida com fetchmany e as
+linhas são enviadas à medida que saem do banco, sem montar a lista toda na
+memória. Sem limit, o stream vai até o fim da tabela.
+"""
+
+import base64
+import binascii
+import json
+
+from flask import Response, stream_with_context
+
+LIMITE_PADRAO = 100
+LIMITE_MAX = 500
+TAMANHO_LOTE_STREAM = 500  # linhas por fetchmany (e por bloco enviado)
+MIME_NDJSON = 'application/x-ndjson'
+
+# Índices que sustentam a ordenação e os filtros da listagem
+INDICES = (
+    "CREATE INDEX IF NOT EXISTS idx_produto_nome ON produtos(nome)",
+    "CREATE INDEX IF NOT EXISTS idx_produto_categoria_nome ON produtos(categoria, nome)",
+    "CREATE INDEX IF NOT EXISTS idx_produto_quantidade ON produtos(quantidade)",
+    "CREATE INDEX IF NOT EXISTS idx_produto_categoria_quantidade ON produtos(categoria, quantidade)",
+)
+
+
+class ParametrosInvalidos(ValueError):
+    """limit, cursor, fields ou filtro inválido na query string"""
+
+
+def sem_conversao(valor):
+    return valor
+
+
+def criar_indices(cursor):
+    for sql in INDICES:
+        cursor.execute(sql)
+
+
+def ordem_da_listagem(filtros):
+    """Coluna que ordena a listagem (antes do id): quantidade se há faixa de quantidade, senão nome"""
+    if any(sql.startswith('quantidade') for sql, _ in filtros):
+        return 'quantidade'
+    return 'nome'
+
+
+def codificar_cursor(valor, produto_id):
+    """Cursor com o valor da coluna de ordem e o id do último item da página"""
+    texto = json.dumps([valor, produto_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii')
+
+
+def decodificar_cursor(cursor, ordem='nome'):
+    try:
+        valor, produto_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, ValueError, TypeError, UnicodeError):
+        raise ParametrosInvalidos("Cursor inválido")
+    # Cursor de outra ordem (ex.: tirou a faixa de quantidade no meio da paginação)
+    tipo = str if ordem == 'nome' else int
+    if not isinstance(valor, tipo) or isinstance(valor, bool) or not isinstance(produto_id, int):
+        raise ParametrosInvalidos("Cursor inválido")
+    return valor, produto_id
+
+
+def _inteiro(args, nome, padrao=None):
+    valor = args.get(nome)
+    if valor is None or valor == '':
+        return padrao
+    try:
+        return int(valor)
+    except ValueError:
+        raise ParametrosInvalidos(f"'{nome}' deve ser um número inteiro")
+
+
+def pediu_stream(req):
+    """A requisição quer a listagem em NDJSON (?stream=1 ou Accept)"""
+    if req.args.get('stream') in ('1', 'true'):
+        return True
+    return req.accept_mimetypes.best_match(['application/json', MIME_NDJSON]) == MIME_NDJSON
+
+
+def ler_parametros(args, campos, padrao, stream=False):
+    """
+    Lê os parâmetros de paginação, projeção e filtro.
+
+    campos: {nome no JSON: (coluna no banco, conversor do valor)}
+    padrao: campos devolvidos quando fields= não é informado
+    stream: no modo stream limit é opcional e não tem máximo
+    """
+    if stream:
+        limite = _inteiro(args, 'limit')
+        if limite is not None and limite < 1:
+            raise ParametrosInvalidos("'limit' deve ser maior que zero")
+    else:
+        limite = _inteiro(args, 'limit', LIMITE_PADRAO)
+        if limite < 1 or limite > LIMITE_MAX:
+            raise ParametrosInvalidos(f"'limit' deve estar entre 1 e {LIMITE_MAX}")
+
+    if args.get('fields'):
+        pedidos = [c.strip() for c in args['fields'].split(',') if c.strip()]
+        desconhecidos = [c for c in pedidos if c not in campos]
+        if desconhecidos:
+            raise ParametrosInvalidos(
+                f"Campos desconhecidos: {', '.join(desconhecidos)}. Disponíveis: {', '.join(campos)}"
+            )
+    else:
+        pedidos = list(padrao)
+
+    filtros = []
+    if args.get('categoria'):
+        filtros.append(("categoria = ?", args['categoria']))
+    quantidade_min = _inteiro(args, 'quantidade_min')
+    if quantidade_min is not None:
+        filtros.append(("quantidade >= ?", quantidade_min))
+    quantidade_max = _inteiro(args, 'quantidade_max')
+    if quantidade_max is not None:
+        filtros.append(("quantidade <= ?", quantidade_max))
+
+    ordem = ordem_da_listagem(filtros)
+    cursor = args.get('cursor')
+    cursor = decodificar_cursor(cursor, ordem) if cursor else None
+
+    return {"limite": limite, "cursor": cursor, "campos": pedidos, "filtros": filtros, "ordem": ordem}
+
+
+def montar_consulta(campos, parametros, condicoes=(), limite=None):
+    """SQL e parâmetros da listagem, em ordem de (nome, id) ou (quantidade, id)"""
+    ordem = parametros['ordem']
+    colunas = ['id', ordem]
+    for campo in parametros['campos']:
+        coluna = campos[campo][0]
+        if coluna not in colunas:
+            colunas.append(coluna)
+
+    where = list(condicoes)
+    valores = []
+    for sql, valor in parametros['filtros']:
+        where.append(sql)
+        valores.append(valor)
+
+    if parametros['cursor']:
+        valor, produto_id = parametros['cursor']
+        # {ordem} >= ? isolado permite ao SQLite buscar direto no índice
+        where.append(f"{ordem} >= ? AND ({ordem} > ? OR id > ?)")
+        valores += [valor, valor, produto_id]
+
+    sql = f"SELECT {', '.join(colunas)} FROM produtos"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {ordem}, id"
+    if limite is not None:
+        sql += " LIMIT ?"
+        valores.append(limite)
+
+    return sql, valores
+
+
+def _converter(campos, pedidos, linha):
+    return {campo: campos[campo][1](linha[campos[campo][0]]) for campo in pedidos}
+
+
+def buscar_pagina(conn, campos, parametros, condicoes=()):
+    """
+    Executa a consulta de uma página.
+
+    condicoes: filtros fixos da rota em SQL (ex: "codigo IS NOT NULL")
+    Retorna (lista de dicionários, proximo_cursor ou None na última página).
+    """
+    # Um item a mais só para saber se existe próxima página
+    sql, valores = montar_consulta(campos, parametros, condicoes, parametros['limite'] + 1)
+    linhas = conn.execute(sql, valores).fetchall()
+
+    proximo_cursor = None
+    if len(linhas) > parametros['limite']:
+        linhas = linhas[:parametros['limite']]
+        ultima = linhas[-1]
+        proximo_cursor = codificar_cursor(ultima[parametros['ordem']], ultima['id'])
+
+    itens = [_converter(campos, parametros['campos'], linha) for linha in linhas]
+
+    return itens, proximo_cursor
+
+
+def gerar_ndjson(pool, campos, parametros, condicoes=(), lote=TAMANHO_LOTE_STREAM):
+    """
+    Gera a listagem em NDJSON, um bloco de até `lote` linhas por vez.
+
+    Usa uma conexão própria do pool, e não a de g: a conexão da requisição
+    volta ao pool assim que a view retorna, antes de o corpo ser enviado.
+    """
+    sql, valores = montar_consulta(campos, parametros, condicoes, parametros['limite'])
+    conn = pool.obter()
+    try:
+        cursor = conn.execute(sql, valores)
+        while True:
+            linhas = cursor.fetchmany(lote)
+            if not linhas:
+                cursor.close()
+                return
+            yield ''.join(
+                json.dumps(_converter(campos, parametros['campos'], linha), ensure_ascii=False) + '\n'
+                for linha in linhas
+            )
+    finally:
+        pool.devolver(conn)
+
+
+def resposta_ndjson(gerador):
+    """Resposta em streaming; stream_with_context mantém url_for e request disponíveis no gerador"""
+    return Response(stream_with_context(gerador), mimetype=MIME_NDJSON)
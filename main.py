@@ -1,38 +1,112 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+import atexit
 import os
 import sqlite3
+import threading
 from werkzeug.utils import secure_filename
 import base64
 from io import BytesIO
-from PIL import Image
-import hashlib
-import random
-import string
 import re
+import shutil
+import tempfile
+import zipfile
 from datetime import datetime
-import qrcode
+from qrcodes import CacheQRCodes, FORMATOS as FORMATOS_QRCODE, etag_qrcode
+from indice_imagens import IndiceImagens, hash_para_texto, criar_versao_imagens, calcular_hashes_faltantes
+from imagem_recebida import ImagemRecebida, ImagemInvalida, ler_imagem_binaria, detectar_formato
+from leitor_qrcode import ler_qrcode_limitado
+from banco_dados import PoolConexoes, conexao_da_requisicao, registrar_pool
+from armazem_imagens import salvar_blob, servir_blob, migrar_imagens_base64, extensao_de
+from listagem import (ParametrosInvalidos, ler_parametros, buscar_pagina, criar_indices, sem_conversao,
+                      pediu_stream, gerar_ndjson, resposta_ndjson)
+from importacao import (Importacao, importar_em_segundo_plano, resumo_gravado, apagar_antigas as apagar_importacoes_antigas,
+                        criar_tabela as criar_tabela_importacoes, detectar_formato as detectar_formato_importacao)
+import etiquetas
+from codigos import AlocadorCodigos, criar_tabela as criar_tabela_codigos
+from normalizacao_imagens import FilaNormalizacao
+from nomes import normalizar_nome, buscar_por_nome, preencher_nomes_normalizados, INDICE as INDICE_NOME_NORMALIZADO
+from busca import BuscaInvalida, criar_indice_busca, indice_busca_existe, buscar_produtos, ler_limite as ler_limite_busca
+from movimentos import (MovimentoInvalido, ProdutoNaoEncontrado, EstoqueInsuficiente, ler_movimentos,
+                        aplicar_movimentos, executar_movimentos, criar_tabela as criar_tabela_movimentos)
+from escrita_agrupada import EscritaAgrupada, EscritaInterrompida, FilaCheia
+from cache_produtos import CacheProdutos
+from metricas import Metricas, registrar_metricas
+from administradores import eh_admin, ler_admins
+from etapas import etapa, medir_etapas
+from consultas_lentas import ORDENS as ORDENS_CONSULTAS, RegistroConsultas
+from migracoes import migrar
 
 app = Flask(__name__)
 app.secret_key = 'troque_esse_seguro_para_uma_chave_real'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['SCANNER_FOLDER'] = 'static/produtos_imagens'
 app.config['QRCODE_FOLDER'] = 'static/qrcodes'
+app.config['IMAGENS_FOLDER'] = 'static/imagens'
+app.config['ETIQUETAS_FOLDER'] = 'etiquetas_geradas'  # fora de static: baixadas só pela rota autenticada
+app.config['METRICAS_FOLDER'] = os.environ.get('METRICAS_DIR', 'metricas')  # um arquivo por worker
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['SCANNER_FOLDER'], exist_ok=True)
 os.makedirs(app.config['QRCODE_FOLDER'], exist_ok=True)
+os.makedirs(app.config['IMAGENS_FOLDER'], exist_ok=True)
+os.makedirs(app.config['ETIQUETAS_FOLDER'], exist_ok=True)
 
 # Configurações da API Scanner
 MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
+MAX_ITENS_LOTE = 100  # itens por chamada de /api/scan/batch
+app.config['IMAGEM_DISTANCIA_MAX'] = 10  # bits de diferença aceitos no dHash (0-64)
+
+# Tempo por etapa do escaneamento/cadastro (Server-Timing e log das requisições lentas)
+app.config['REQUISICOES_LENTAS_MS'] = 500  # escaneamentos/cadastros acima disso vão para o log
+app.config['LOG_REQUISICOES_LENTAS'] = 'requisicoes_lentas.jsonl'  # JSON-lines com o tempo por etapa
+
+# Índice de hashes perceptuais das imagens cadastradas (busca por imagem)
+indice_imagens = IndiceImagens()
+
+# QR Codes renderizados em segundo plano/sob demanda, com limite de disco (LRU da pasta, entre workers)
+app.config['QRCODE_CACHE_MAX'] = 200 * 1024 * 1024
+cache_qrcodes = CacheQRCodes(app.config['QRCODE_FOLDER'], app.config['QRCODE_CACHE_MAX'])
+CACHE_QRCODE_MAX_AGE = 24 * 3600  # o QR Code de um código não muda
 
 
 # -----------------------------------------------------------
 # BANCO DE DADOS
 # -----------------------------------------------------------
 
+pool_conexoes = PoolConexoes('banco.db')
+registrar_pool(app, pool_conexoes)
+app.config['ADMINS'] = ler_admins()  # e-mails; vazio: ninguém (ver administradores.py)
+
+# Latência, erros e consultas SQL por rota, somados entre workers (rota /metrics, só token ou admin)
+metricas = Metricas('main', app.config['METRICAS_FOLDER'])
+registrar_metricas(app, metricas, pool_conexoes, 'user')
+
+# Consultas acima do limite vão para o log com o EXPLAIN QUERY PLAN; estatísticas em /api/admin/consultas
+app.config['CONSULTAS_LENTAS_MS'] = 50
+app.config['LOG_CONSULTAS_LENTAS'] = 'consultas_lentas.jsonl'
+registro_consultas = RegistroConsultas(app.config['CONSULTAS_LENTAS_MS'], app.config['LOG_CONSULTAS_LENTAS'])
+registro_consultas.instalar(pool_conexoes)
+
+alocador_codigos = AlocadorCodigos(pool_conexoes.caminho)
+
+# Produtos mais consultados em memória (por id e código); cada gravação invalida o seu
+app.config['CACHE_PRODUTOS_TTL'] = 10  # segundos (gravações de outros processos)
+cache_produtos = CacheProdutos(ttl=app.config['CACHE_PRODUTOS_TTL'])
+
+# Imagens recodificadas (EXIF, metadados, resolução, WebP) e miniaturas, em segundo plano
+app.config['MANTER_ORIGINAL_IMAGEM'] = False  # True: originais vão para <pasta>/originais
+fila_imagens = FilaNormalizacao(pool_conexoes.caminho, app.config['MANTER_ORIGINAL_IMAGEM'],
+                                ao_atualizar=lambda ids: cache_produtos.invalidar(*ids))
+
+# Movimentos de estoque gravados em grupo por uma thread (ver escrita_agrupada.py)
+app.config['ESCRITA_AGRUPADA'] = os.environ.get('ESCRITA_AGRUPADA') == '1'  # /movimento responde 202 sem esperar o commit
+escrita_agrupada = EscritaAgrupada(pool_conexoes.caminho)
+atexit.register(escrita_agrupada.fechar)  # grava o que estiver na fila ao desligar
+ESPERA_LEITURA = 5.0  # segundos que uma leitura (ou ?aguardar=1) espera os movimentos pendentes
+
+
 def get_db():
-    conn = sqlite3.connect('banco.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Conexão da requisição atual (do pool, devolvida no teardown)"""
+    return conexao_da_requisicao(pool_conexoes)
 
 
 def ensure_columns(cursor):
@@ -47,6 +121,11 @@ def ensure_columns(cursor):
         "codigo": "TEXT",
         "categoria": "TEXT",
         "imagem_path": "TEXT",
+        "imagem_dhash": "TEXT",
+        "imagem_arquivo": "TEXT",
+        "miniatura_arquivo": "TEXT",
+        "miniatura_path": "TEXT",
+        "nome_normalizado": "TEXT",
         "criado_em": "TIMESTAMP",
         "atualizado_em": "TIMESTAMP"
     }
@@ -57,14 +136,23 @@ def ensure_columns(cursor):
     
     # Criar índices se não existirem
     try:
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_produto_codigo ON produtos(codigo)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_produto_nome ON produtos(nome)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_produto_coluna ON produtos(coluna_armazenada)")
+        cursor.execute(INDICE_NOME_NORMALIZADO)
+        criar_indices(cursor)
     except:
         pass
+    
+    # Código único (o índice simples antigo sai quando o único é criado)
+    try:
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_produto_codigo_unico ON produtos(codigo)")
+        cursor.execute("DROP INDEX IF EXISTS idx_produto_codigo")
+    except sqlite3.IntegrityError:
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_produto_codigo ON produtos(codigo)")
+        print("⚠️ Há produtos com código repetido: corrija-os para ativar o índice único de código")
 
 
-def init_db():
-    conn = get_db()
+def migracao_esquema_inicial(conn):
+    """Versão 1: o esquema completo (bancos antigos ganham só o que faltar)"""
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -86,11 +174,97 @@ def init_db():
     """)
 
     ensure_columns(cursor)
-    conn.commit()
-    conn.close()
+    criar_tabela_codigos(cursor)
+    criar_tabela_movimentos(cursor)
+    criar_indice_busca(cursor)
+
+
+def migracao_nomes_normalizados(conn):
+    """Versão 2: nome_normalizado dos produtos cadastrados antes da coluna"""
+    preenchidos = preencher_nomes_normalizados(conn)
+    if preenchidos:
+        print(f"✅ Nome normalizado preenchido em {preenchidos} produtos")
+
 
+def migracao_imagens_base64(conn):
+    """Versão 3: imagens antigas em base64 dentro da tabela vão para o armazém de arquivos"""
+    migrados = migrar_imagens_base64(conn, app.config['IMAGENS_FOLDER'])
+    if migrados:
+        print(f"✅ {migrados} imagens migradas para {app.config['IMAGENS_FOLDER']}")
 
-init_db()
+
+def migracao_importacoes(conn):
+    """Versão 4: progresso das importações no banco (visto por todos os workers)"""
+    criar_tabela_importacoes(conn.cursor())
+
+
+def migracao_versao_imagens(conn):
+    """Versão 5: imagem_versao (sincroniza o índice de imagens entre workers) e hashes que faltavam"""
+    criar_versao_imagens(conn.cursor())
+    calculados = calcular_hashes_faltantes(conn, app.config['SCANNER_FOLDER'])
+    if calculados:
+        print(f"✅ Hash perceptual calculado para {calculados} imagens")
+
+
+def migracao_etiquetas(conn):
+    """Versão 6: progresso das gerações de etiquetas no banco"""
+    etiquetas.criar_tabela(conn.cursor())
+
+
+def migracao_indice_quantidade(conn):
+    """Versão 7: índice (categoria, quantidade) da listagem com categoria e faixa de quantidade"""
+    criar_indices(conn.cursor())
+
+
+# Versão do esquema = posição na lista (PRAGMA user_version). Mudança nova
+# entra no fim; as que já rodaram não mudam (ver migracoes.py).
+MIGRACOES = [
+    migracao_esquema_inicial,
+    migracao_nomes_normalizados,
+    migracao_imagens_base64,
+    migracao_importacoes,
+    migracao_versao_imagens,
+    migracao_etiquetas,
+    migracao_indice_quantidade,
+]
+
+
+def init_db():
+    """Aplica as migrações pendentes e descobre se a busca FTS está disponível"""
+    conn = pool_conexoes.obter()
+    try:
+        aplicadas = migrar(conn, MIGRACOES)
+        if aplicadas:
+            print(f"✅ Banco migrado para a versão {aplicadas[-1]}")
+
+        app.config['BUSCA_FTS'] = indice_busca_existe(conn)
+        if not app.config['BUSCA_FTS']:
+            # Migrado num SQLite sem FTS5: tenta de novo (o SQLite pode ter sido atualizado)
+            app.config['BUSCA_FTS'] = criar_indice_busca(conn.cursor())
+            conn.commit()
+        if not app.config['BUSCA_FTS']:
+            print("⚠️ SQLite sem FTS5: /api/produtos/search desativada")
+    finally:
+        pool_conexoes.devolver(conn)
+
+
+# Nada de banco ao importar: o worker sobe sem esperar o SQLite e o banco é
+# preparado (uma leitura de PRAGMA user_version, se já estiver em dia) na
+# primeira requisição. Scripts e testes que usam o banco fora de uma
+# requisição chamam preparar_banco() antes.
+_banco_pronto = False
+_lock_banco = threading.Lock()
+
+
+@app.before_request
+def preparar_banco():
+    global _banco_pronto
+    if _banco_pronto:
+        return
+    with _lock_banco:
+        if not _banco_pronto:
+            init_db()
+            _banco_pronto = True
 
 
 # -----------------------------------------------------------
@@ -98,96 +272,36 @@ init_db()
 # -----------------------------------------------------------
 
 def gerar_codigo_produto():
-    """Gera código único de 6 dígitos"""
-    conn = get_db()
-    while True:
-        codigo = ''.join(random.choices(string.digits, k=6))
-        existe = conn.execute("SELECT id FROM produtos WHERE codigo = ?", (codigo,)).fetchone()
-        if not existe:
-            break
-    conn.close()
-    return codigo
+    """Próximo código livre de 6 dígitos (ver codigos.py)"""
+    return alocador_codigos.proximo()
 
 
-def gerar_qrcode(codigo, nome_produto):
-    """Gera QR Code para o produto"""
-    try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(codigo)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        qr_filename = f"{codigo}.png"
-        qr_path = os.path.join(app.config['QRCODE_FOLDER'], qr_filename)
-        img.save(qr_path)
-        
-        print(f"✅ QR Code gerado: {qr_path}")
-        return qr_filename
-        
-    except Exception as e:
-        print(f"❌ Erro ao gerar QR Code: {e}")
-        return None
+def url_qrcode(codigo, formato='png'):
+    """URL do QR Code do produto (renderizado sob demanda pela rota /qrcode)"""
+    return url_for('qrcode_produto', nome=f"{codigo}.{formato}")
 
 
 def validar_base64_imagem(base64_string):
-    """Valida se é uma imagem base64 válida"""
+    """
+    Decodifica e valida a imagem base64 uma única vez.
+    Retorna (ImagemRecebida, "valid") ou (None, mensagem de erro).
+    """
     try:
-        if not base64_string:
-            return False, "Imagem vazia"
-        
-        if ',' in base64_string:
-            header, data = base64_string.split(',', 1)
-            if not any(mime in header for mime in ['image/jpeg', 'image/png', 'image/jpg', 'image/gif']):
-                return False, "Tipo de imagem não permitido"
-        else:
-            data = base64_string
-        
-        img_bytes = base64.b64decode(data)
-        
-        if len(img_bytes) > MAX_IMAGE_SIZE:
-            return False, f"Imagem muito grande. Máximo: 5MB"
-        
-        if img_bytes[:2] == b'\xff\xd8':  # JPEG
-            return True, "valid"
-        elif img_bytes[:8] == b'\x89PNG\r\n\x1a\n':  # PNG
-            return True, "valid"
-        elif img_bytes[:6] in (b'GIF87a', b'GIF89a'):  # GIF
-            return True, "valid"
-        else:
-            return False, "Formato de imagem inválido"
-            
+        return ImagemRecebida.de_base64(base64_string, MAX_IMAGE_SIZE), "valid"
+    except ImagemInvalida as e:
+        return None, str(e)
     except Exception as e:
-        return False, f"Erro ao validar imagem: {str(e)}"
+        return None, f"Erro ao validar imagem: {str(e)}"
 
 
-def salvar_imagem_scanner(base64_string, codigo):
-    """Salva imagem em arquivo para o scanner"""
+def salvar_imagem_scanner(imagem, codigo):
+    """Salva a imagem (já decodificada) em arquivo para o scanner"""
     try:
-        if ',' in base64_string:
-            base64_string = base64_string.split(',', 1)[1]
-        
-        img_bytes = base64.b64decode(base64_string)
-        
-        if img_bytes[:2] == b'\xff\xd8':
-            ext = 'jpg'
-        elif img_bytes[:8] == b'\x89PNG\r\n\x1a\n':
-            ext = 'png'
-        elif img_bytes[:6] in (b'GIF87a', b'GIF89a'):
-            ext = 'gif'
-        else:
-            ext = 'jpg'
-        
-        filename = f"{codigo}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{ext}"
+        filename = f"{codigo}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{imagem.extensao}"
         filepath = os.path.join(app.config['SCANNER_FOLDER'], filename)
         
-        with open(filepath, 'wb') as f:
-            f.write(img_bytes)
+        with etapa('disco'), open(filepath, 'wb') as f:
+            f.write(imagem.dados)
         
         return filename
         
@@ -196,68 +310,88 @@ def salvar_imagem_scanner(base64_string, codigo):
         return None
 
 
-def comparar_imagens(imagem1_base64, imagem2_path):
+def buscar_produto_por_imagem(conn, imagem):
     """
-    Compara duas imagens para verificar se são do mesmo produto.
-    
-    IMPORTANTE: Este é um sistema de demonstração que compara características básicas.
-    Para produção real, use:
-    - OpenCV com feature matching (ORB, SIFT)
-    - Deep Learning (TensorFlow, YOLO)
-    - QR Code / Código de Barras
+    Procura o produto cuja imagem cadastrada é a mais parecida com a capturada.
+
+    Compara hashes perceptuais (dHash) pelo índice em memória, então não relê
+    as imagens do disco a cada escaneamento. A tolerância é definida em
+    app.config['IMAGEM_DISTANCIA_MAX'].
     """
+    indice_imagens.sincronizar(conn)
+
     try:
-        if ',' in imagem1_base64:
-            imagem1_base64 = imagem1_base64.split(',', 1)[1]
-        img1_bytes = base64.b64decode(imagem1_base64)
-        
-        with open(os.path.join(app.config['SCANNER_FOLDER'], imagem2_path), 'rb') as f:
-            img2_bytes = f.read()
-        
-        # Método 1: Hash exato (funciona se for a mesma imagem)
-        hash1 = hashlib.md5(img1_bytes).hexdigest()
-        hash2 = hashlib.md5(img2_bytes).hexdigest()
-        
-        if hash1 == hash2:
-            print(f"✅ Match exato por hash: {hash1}")
-            return True
-        
-        # Método 2: Comparação por tamanho similar (tolerância 15%)
-        size1 = len(img1_bytes)
-        size2 = len(img2_bytes)
-        diferenca_tamanho = abs(size1 - size2) / max(size1, size2)
-        
-        print(f"📊 Tamanho img1: {size1} bytes, img2: {size2} bytes, diferença: {diferenca_tamanho:.2%}")
-        
-        if diferenca_tamanho < 0.15:  # 15% de tolerância
-            # Compara assinatura (primeiros e últimos bytes)
-            inicio_match = img1_bytes[:200] == img2_bytes[:200]
-            fim_match = img1_bytes[-200:] == img2_bytes[-200:]
-            
-            if inicio_match and fim_match:
-                print(f"✅ Match por assinatura (início e fim)")
-                return True
-            
-            # Verifica se pelo menos um dos dois bate
-            if inicio_match or fim_match:
-                print(f"⚠️ Match parcial (início: {inicio_match}, fim: {fim_match})")
-                # Aceita match parcial se tamanho for muito similar
-                if diferenca_tamanho < 0.05:  # 5% de tolerância
-                    print(f"✅ Match aceito por similaridade de tamanho")
-                    return True
-        
-        print(f"❌ Sem match - diferença de tamanho: {diferenca_tamanho:.2%}")
-        return False
-        
+        dhash = imagem.dhash
     except Exception as e:
-        print(f"❌ Erro ao comparar imagens: {e}")
-        return False
+        print(f"❌ Erro ao calcular hash da imagem: {e}")
+        metricas.incrementar('comparacoes_imagem_total', resultado='erro')
+        return None
+
+    for distancia, produto_id in indice_imagens.buscar(dhash, app.config['IMAGEM_DISTANCIA_MAX']):
+        produto = conn.execute("SELECT * FROM produtos WHERE id = ?", (produto_id,)).fetchone()
+        if produto and produto['imagem_path']:
+            print(f"✅ Match por hash perceptual (distância {distancia})")
+            metricas.incrementar('comparacoes_imagem_total', resultado='encontrado')
+            return produto
+        # Produto removido (possivelmente por outro processo)
+        indice_imagens.remover(produto_id)
+
+    print("❌ Sem match por hash perceptual")
+    metricas.incrementar('comparacoes_imagem_total', resultado='nao_encontrado')
+    return None
+
+
+def normalizar_imagem(coluna, nome):
+    """Agenda a normalização da imagem recém-gravada (depois do commit do produto)"""
+    if nome:
+        pasta = app.config['IMAGENS_FOLDER'] if coluna == 'imagem_arquivo' else app.config['SCANNER_FOLDER']
+        fila_imagens.agendar(pasta, coluna, nome)
+
+
+def url_imagem(imagem_arquivo):
+    """URL da imagem no armazém (ou None se o produto não tem imagem)"""
+    if not imagem_arquivo:
+        return None
+    return url_for('imagem_produto', nome=imagem_arquivo)
 
 
 # -----------------------------------------------------------
 # ROTAS DO SISTEMA
 # -----------------------------------------------------------
 
+@app.route('/qrcode/<nome>')
+def qrcode_produto(nome):
+    """
+    QR Code do produto em PNG ou SVG (/qrcode/<codigo>.png|svg), servido do
+    cache em disco ou renderizado na hora. O ETag depende só do código, então
+    o 304 é respondido sem abrir arquivo nem consultar o banco.
+    """
+    codigo, _, formato = nome.rpartition('.')
+    if not codigo or formato not in FORMATOS_QRCODE:
+        return jsonify({"erro": "Use /qrcode/<codigo>.png ou /qrcode/<codigo>.svg"}), 404
+    
+    etag = etag_qrcode(codigo, formato)
+    if request.if_none_match.contains(etag):
+        resposta = app.response_class(status=304)
+    else:
+        existe = get_db().execute("SELECT 1 FROM produtos WHERE codigo = ?", (codigo,)).fetchone()
+        if not existe:
+            return jsonify({"erro": "Produto não encontrado"}), 404
+        resposta = send_file(cache_qrcodes.obter(codigo, formato), mimetype=FORMATOS_QRCODE[formato],
+                             max_age=CACHE_QRCODE_MAX_AGE)
+    
+    resposta.set_etag(etag)
+    resposta.cache_control.public = True
+    resposta.cache_control.max_age = CACHE_QRCODE_MAX_AGE
+    return resposta
+
+
+@app.route('/imagens/<nome>')
+def imagem_produto(nome):
+    """Serve imagens do armazém com ETag e cache imutável"""
+    return servir_blob(app.config['IMAGENS_FOLDER'], nome)
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -274,7 +408,6 @@ def login():
             "SELECT * FROM users WHERE email = ? AND password = ?",
             (email, password)
         ).fetchone()
-        conn.close()
 
         if user:
             session['user'] = email
@@ -300,10 +433,8 @@ def register():
         conn.commit()
     except sqlite3.IntegrityError:
         flash("Email já cadastrado")
-        conn.close()
         return redirect(url_for('login'))
 
-    conn.close()
     flash("Cadastro realizado com sucesso!")
     return redirect(url_for('login'))
 
@@ -319,7 +450,104 @@ def inicio():
 # API DE ESCANEAMENTO POR CÂMERA
 # -----------------------------------------------------------
 
+def identificar_codigo(conn, codigo=None, imagem=None):
+    """
+    Descobre o código do produto escaneado: lido no frontend, lido do QR Code
+    no frame ou, sem QR Code, pela imagem cadastrada mais parecida.
+    Retorna o código ou None.
+    """
+    codigo_detectado = None
+    
+    # Método 1: QR Code já foi lido no frontend (JavaScript)
+    if codigo:
+        codigo_detectado = codigo.strip()
+        print(f"📱 Código QR detectado: {codigo_detectado}")
+    
+    # Método 2: leitura do QR Code no servidor, a partir do frame
+    elif imagem is not None:
+        with etapa('qrcode'):
+            codigo_detectado, resultado = ler_qrcode_limitado(imagem.dados)
+        metricas.incrementar('leituras_qrcode_total', resultado=resultado)
+        if codigo_detectado:
+            codigo_detectado = codigo_detectado.strip()
+            print(f"📷 Código QR lido no servidor: {codigo_detectado}")
+    
+    # Método 3: Fallback - comparação de imagem (só quando não há QR Code)
+    if not codigo_detectado and imagem is not None:
+        # Busca o produto mais parecido no índice de hashes
+        produto = buscar_produto_por_imagem(conn, imagem)
+        
+        if produto:
+            codigo_detectado = produto['codigo']
+            print(f"🖼️ Produto encontrado por comparação de imagem: {codigo_detectado}")
+    
+    return codigo_detectado or None
+
+
+def resposta_escaneamento(codigo_detectado, produto):
+    """Corpo da resposta do escaneamento para o código detectado e o produto achado (ou None)"""
+    # Se não detectou código de nenhuma forma
+    if not codigo_detectado:
+        return {
+            "status": "nao_encontrado",
+            "alerta": "⚠️ PRODUTO NÃO CADASTRADO!",
+            "mensagem": "Nenhum QR Code detectado ou produto não encontrado. Cadastre-o agora.",
+            "dica": "Aponte a câmera para o QR Code do produto"
+        }
+    
+    if produto:
+        # PRODUTO ENCONTRADO!
+        return {
+            "status": "encontrado",
+            "mensagem": f"✅ Produto '{produto['nome']}' identificado via QR Code!",
+            "produto": {
+                "id": produto['id'],
+                "codigo": produto['codigo'],
+                "nome": produto['nome'],
+                "localizacao": produto['localizacao'],
+                "quantidade": produto['quantidade'],
+                "preco": float(produto['preco']),
+                "categoria": produto['categoria'] or 'Geral',
+                "qrcode_url": url_qrcode(produto['codigo'])
+            }
+        }
+    
+    # Código detectado mas produto não existe
+    return {
+        "status": "nao_encontrado",
+        "alerta": "⚠️ PRODUTO NÃO CADASTRADO!",
+        "mensagem": f"QR Code '{codigo_detectado}' detectado mas produto não existe no sistema.",
+        "codigo_detectado": codigo_detectado
+    }
+
+
+def escanear_produto(codigo=None, imagem=None):
+    """
+    Núcleo do escaneamento, comum às rotas JSON e binária.
+    Recebe o código lido no frontend e/ou a ImagemRecebida do frame.
+    Retorna (corpo da resposta, status HTTP).
+    """
+    conn = get_db()
+    codigo_detectado = identificar_codigo(conn, codigo, imagem)
+    
+    produto = None
+    if codigo_detectado:
+        # Busca produto pelo código (do cache, se foi consultado há pouco)
+        produto, _ = cache_produtos.buscar_por_codigo(conn, codigo_detectado)
+    
+    return resposta_escaneamento(codigo_detectado, produto), 200
+
+
+def buscar_por_codigos(conn, codigos):
+    """
+    Busca vários códigos numa consulta só (os que não estão no cache).
+    Retorna {codigo: produto} dos que existem
+    """
+    return cache_produtos.buscar_por_codigos(conn, codigos)
+
+
 @app.route('/api/scan', methods=['POST'])
+@medir_etapas
 def api_scan_produto():
     """
     Escaneia produto via CÂMERA usando QR Code
@@ -329,7 +557,8 @@ def api_scan_produto():
         return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
     
     try:
-        data = request.get_json()
+        with etapa('corpo'):
+            data = request.get_json()
         
         if not data:
             return jsonify({
@@ -337,93 +566,215 @@ def api_scan_produto():
                 "mensagem": "Dados não fornecidos"
             }), 400
         
-        codigo_detectado = None
-        
-        # Método 1: QR Code já foi lido no frontend (JavaScript)
-        if 'codigo' in data and data['codigo']:
-            codigo_detectado = data['codigo'].strip()
-            print(f"📱 Código QR detectado: {codigo_detectado}")
-        
-        # Método 2: Fallback - comparação de imagem (baixa taxa de sucesso)
-        elif 'imagem' in data:
-            imagem_capturada = data['imagem']
-            
-            # Valida imagem
-            valido, msg = validar_base64_imagem(imagem_capturada)
-            if not valido:
+        imagem = None
+        if not data.get('codigo') and 'imagem' in data:
+            # Valida imagem (decodificada uma única vez)
+            imagem, msg = validar_base64_imagem(data['imagem'])
+            if not imagem:
                 return jsonify({
                     "status": "erro",
                     "mensagem": f"Imagem inválida: {msg}"
                 }), 400
-            
-            # Busca produtos com imagem
-            conn = get_db()
-            produtos = conn.execute(
-                "SELECT * FROM produtos WHERE imagem_path IS NOT NULL"
-            ).fetchall()
-            conn.close()
-            
-            # Compara imagens
-            for produto in produtos:
-                if comparar_imagens(imagem_capturada, produto['imagem_path']):
-                    codigo_detectado = produto['codigo']
-                    print(f"🖼️ Produto encontrado por comparação de imagem: {codigo_detectado}")
-                    break
         
-        # Se não detectou código de nenhuma forma
-        if not codigo_detectado:
+        corpo, status = escanear_produto(data.get('codigo'), imagem)
+        with etapa('serializacao'):
+            resposta = jsonify(corpo)
+        return resposta, status
+        
+    except Exception as e:
+        return jsonify({"status": "erro", "mensagem": f"Erro ao escanear: {str(e)}"}), 500
+
+
+@app.route('/api/scan/binario', methods=['POST'])
+@medir_etapas
+def api_scan_produto_binario():
+    """
+    Mesma resposta do /api/scan, com o frame enviado em binário (sem base64):
+    multipart/form-data (arquivo "imagem", campo opcional "codigo") ou
+    application/octet-stream / image/jpeg (corpo = imagem, ?codigo= opcional)
+    """
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    
+    try:
+        imagem, campos = ler_imagem_binaria(request, MAX_IMAGE_SIZE)
+        
+        if imagem is None and not campos.get('codigo'):
             return jsonify({
-                "status": "nao_encontrado",
-                "alerta": "⚠️ PRODUTO NÃO CADASTRADO!",
-                "mensagem": "Nenhum QR Code detectado ou produto não encontrado. Cadastre-o agora.",
-                "dica": "Aponte a câmera para o QR Code do produto"
-            }), 200
+                "status": "erro",
+                "mensagem": "Dados não fornecidos"
+            }), 400
         
-        # Busca produto pelo código
+        corpo, status = escanear_produto(campos.get('codigo'), imagem)
+        with etapa('serializacao'):
+            resposta = jsonify(corpo)
+        return resposta, status
+        
+    except ImagemInvalida as e:
+        return jsonify({"status": "erro", "mensagem": f"Imagem inválida: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"status": "erro", "mensagem": f"Erro ao escanear: {str(e)}"}), 500
+
+
+@app.route('/api/scan/batch', methods=['POST'])
+def api_scan_lote():
+    """
+    Escaneia vários itens numa requisição só (contagem de estoque com coletor).
+    Aceita: {"itens": ["123456", {"codigo": "..."}, {"imagem": "base64..."}]}
+    Todos os códigos são resolvidos com uma única consulta. "resultados" vem
+    na ordem dos itens, cada um igual à resposta do /api/scan; um item com
+    problema recebe status "erro" sem derrubar os demais.
+    """
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    
+    data = request.get_json(silent=True)
+    itens = data.get('itens') if isinstance(data, dict) else data
+    
+    if not isinstance(itens, list) or not itens:
+        return jsonify({
+            "status": "erro",
+            "mensagem": "Envie {\"itens\": [...]} com códigos e/ou imagens"
+        }), 400
+    
+    if len(itens) > MAX_ITENS_LOTE:
+        return jsonify({
+            "status": "erro",
+            "mensagem": f"Máximo de {MAX_ITENS_LOTE} itens por lote"
+        }), 400
+    
+    try:
         conn = get_db()
-        produto = conn.execute(
-            "SELECT * FROM produtos WHERE codigo = ?",
-            (codigo_detectado,)
-        ).fetchone()
-        conn.close()
         
-        if produto:
-            # PRODUTO ENCONTRADO!
-            return jsonify({
-                "status": "encontrado",
-                "mensagem": f"✅ Produto '{produto['nome']}' identificado via QR Code!",
-                "produto": {
-                    "id": produto['id'],
-                    "codigo": produto['codigo'],
-                    "nome": produto['nome'],
-                    "localizacao": produto['localizacao'],
-                    "quantidade": produto['quantidade'],
-                    "preco": float(produto['preco']),
-                    "categoria": produto['categoria'] or 'Geral',
-                    "qrcode_url": f"/static/qrcodes/{produto['codigo']}.png"
-                }
-            }), 200
+        # 1ª passada: código de cada item (ou o erro daquele item)
+        detectados = []
+        for item in itens:
+            if isinstance(item, (str, int)):
+                item = {"codigo": item}
+            if not isinstance(item, dict) or not (item.get('codigo') or item.get('imagem')):
+                detectados.append({"status": "erro", "mensagem": "Item sem código nem imagem"})
+                continue
+            
+            try:
+                imagem = None
+                if not item.get('codigo'):
+                    imagem, msg = validar_base64_imagem(item['imagem'])
+                    if not imagem:
+                        detectados.append({"status": "erro", "mensagem": f"Imagem inválida: {msg}"})
+                        continue
+                
+                codigo = str(item['codigo']) if item.get('codigo') else None
+                detectados.append(identificar_codigo(conn, codigo, imagem))
+            except Exception as e:
+                detectados.append({"status": "erro", "mensagem": f"Erro ao escanear: {str(e)}"})
+        
+        # 2ª passada: uma consulta para todos os códigos, respostas na ordem
+        produtos = buscar_por_codigos(conn, {c for c in detectados if isinstance(c, str)})
+        resultados = [
+            detectado if isinstance(detectado, dict)
+            else resposta_escaneamento(detectado, produtos.get(detectado))
+            for detectado in detectados
+        ]
         
-        # Código detectado mas produto não existe
         return jsonify({
-            "status": "nao_encontrado",
-            "alerta": "⚠️ PRODUTO NÃO CADASTRADO!",
-            "mensagem": f"QR Code '{codigo_detectado}' detectado mas produto não existe no sistema.",
-            "codigo_detectado": codigo_detectado
+            "status": "sucesso",
+            "total": len(resultados),
+            "encontrados": sum(1 for r in resultados if r['status'] == 'encontrado'),
+            "nao_encontrados": sum(1 for r in resultados if r['status'] == 'nao_encontrado'),
+            "erros": sum(1 for r in resultados if r['status'] == 'erro'),
+            "resultados": resultados
         }), 200
         
     except Exception as e:
-        return jsonify({"status": "erro", "mensagem": f"Erro ao escanear: {str(e)}"}), 500
+        return jsonify({"status": "erro", "mensagem": f"Erro ao escanear lote: {str(e)}"}), 500
+
+
+def cadastrar_via_scanner(data, imagem):
+    """
+    Núcleo do cadastro via scanner, comum às rotas JSON e binária.
+    `data` traz os campos do produto e `imagem` a ImagemRecebida já validada.
+    Retorna (corpo da resposta, status HTTP).
+    """
+    nome = data['nome'].strip()
+    localizacao = data['localizacao'].strip()
+    quantidade = int(data['quantidade'])
+    preco = float(data.get('preco', 0.0))
+    categoria = data.get('categoria', 'Geral').strip()
+    
+    # Validações
+    if not nome or not localizacao:
+        return {"status": "erro", "mensagem": "Nome e localização não podem estar vazios"}, 400
+    
+    if quantidade < 0:
+        return {"status": "erro", "mensagem": "Quantidade não pode ser negativa"}, 400
+    
+    if preco < 0:
+        return {"status": "erro", "mensagem": "Preço não pode ser negativo"}, 400
+    
+    # Hash perceptual para o escaneamento por imagem
+    try:
+        dhash = imagem.dhash
+    except Exception as e:
+        return {"status": "erro", "mensagem": f"Imagem inválida: {str(e)}"}, 400
+    
+    # Só agora: um cadastro recusado não gasta código
+    codigo = gerar_codigo_produto()
+    imagem_path = salvar_imagem_scanner(imagem, codigo)
+    if not imagem_path:
+        return {"status": "erro", "mensagem": "Erro ao salvar imagem da câmera"}, 500
+    
+    # QR Code renderizado em segundo plano (a resposta não espera a imagem)
+    with etapa('fila'):
+        cache_qrcodes.agendar(codigo)
+    
+    # Inserir no banco
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    alvo = cursor.execute("SELECT MAX(id) FROM produtos WHERE codigo IS NULL").fetchone()[0]
+    
+    if alvo is not None:
+        cursor.execute("""
+            UPDATE produtos SET 
+            codigo = ?, categoria = ?, imagem_path = ?, imagem_dhash = ?, criado_em = ?, atualizado_em = ?
+            WHERE id = ?
+        """, (codigo, categoria, imagem_path, hash_para_texto(dhash), datetime.now(), datetime.now(), alvo))
+        produto_id = alvo
+    else:
+        # Se não há produto sem código, insere novo
+        cursor.execute("""
+            INSERT INTO produtos (nome, nome_normalizado, quantidade, preco, localizacao, codigo, categoria, imagem_path, imagem_dhash, criado_em, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (nome, normalizar_nome(nome), quantidade, preco, localizacao, codigo, categoria, imagem_path, hash_para_texto(dhash), datetime.now(), datetime.now()))
+        produto_id = cursor.lastrowid
+    
+    conn.commit()
+    cache_produtos.invalidar(produto_id)
+    
+    indice_imagens.adicionar(produto_id, dhash)
+    with etapa('fila'):
+        normalizar_imagem('imagem_path', imagem_path)
+    
+    return {
+        "status": "sucesso",
+        "mensagem": f"✅ Produto '{nome}' cadastrado com QR Code!",
+        "produto_id": produto_id,
+        "codigo": codigo,
+        "qrcode_url": url_qrcode(codigo),
+        "instrucao": "Baixe o QR Code, imprima e cole no produto. Depois aponte a câmera para o QR Code!"
+    }, 201
 
 
 @app.route('/api/cadastrar_scanner', methods=['POST'])
+@medir_etapas
 def api_cadastrar_scanner():
     """Cadastra novo produto via scanner com imagem obrigatória"""
     if 'user' not in session:
         return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
     
     try:
-        data = request.get_json()
+        with etapa('corpo'):
+            data = request.get_json()
         
         # Validação de campos obrigatórios (INCLUINDO IMAGEM)
         campos_obrigatorios = ['nome', 'localizacao', 'quantidade', 'imagem_base64']
@@ -433,101 +784,243 @@ def api_cadastrar_scanner():
                 "mensagem": "Campos obrigatórios: nome, localizacao, quantidade e imagem_base64"
             }), 400
         
-        nome = data['nome'].strip()
-        localizacao = data['localizacao'].strip()
-        quantidade = int(data['quantidade'])
-        preco = float(data.get('preco', 0.0))
-        categoria = data.get('categoria', 'Geral').strip()
-        codigo = gerar_codigo_produto()
-        
-        # Validações
-        if not nome or not localizacao:
-            return jsonify({"status": "erro", "mensagem": "Nome e localização não podem estar vazios"}), 400
-        
-        if quantidade < 0:
-            return jsonify({"status": "erro", "mensagem": "Quantidade não pode ser negativa"}), 400
-        
-        if preco < 0:
-            return jsonify({"status": "erro", "mensagem": "Preço não pode ser negativo"}), 400
-        
-        # Validar e salvar imagem (OBRIGATÓRIA)
-        valido, msg = validar_base64_imagem(data['imagem_base64'])
-        if not valido:
+        # Validar imagem (OBRIGATÓRIA)
+        imagem, msg = validar_base64_imagem(data['imagem_base64'])
+        if not imagem:
             return jsonify({"status": "erro", "mensagem": f"Imagem inválida: {msg}"}), 400
         
-        imagem_path = salvar_imagem_scanner(data['imagem_base64'], codigo)
-        if not imagem_path:
-            return jsonify({"status": "erro", "mensagem": "Erro ao salvar imagem da câmera"}), 500
+        corpo, status = cadastrar_via_scanner(data, imagem)
+        with etapa('serializacao'):
+            resposta = jsonify(corpo)
+        return resposta, status
         
-        # Gerar QR Code
-        qr_filename = gerar_qrcode(codigo, nome)
-        
-        # Inserir no banco
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE produtos SET 
-            codigo = ?, categoria = ?, imagem_path = ?, criado_em = ?, atualizado_em = ?
-            WHERE id = (SELECT MAX(id) FROM produtos WHERE codigo IS NULL LIMIT 1)
-        """, (codigo, categoria, imagem_path, datetime.now(), datetime.now()))
-        
-        if cursor.rowcount == 0:
-            # Se não atualizou, insere novo
-            cursor.execute("""
-                INSERT INTO produtos (nome, quantidade, preco, localizacao, codigo, categoria, imagem_path, criado_em, atualizado_em)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (nome, quantidade, preco, localizacao, codigo, categoria, imagem_path, datetime.now(), datetime.now()))
+    except ValueError as e:
+        return jsonify({"status": "erro", "mensagem": "Quantidade e preço devem ser números válidos"}), 400
+    except Exception as e:
+        return jsonify({"status": "erro", "mensagem": f"Erro ao cadastrar: {str(e)}"}), 500
+
+
+@app.route('/api/cadastrar_scanner/binario', methods=['POST'])
+@medir_etapas
+def api_cadastrar_scanner_binario():
+    """
+    Mesma resposta do /api/cadastrar_scanner, com a foto em binário:
+    multipart/form-data (arquivo "imagem" + campos do produto no formulário)
+    ou application/octet-stream (corpo = imagem, campos na query string)
+    """
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    
+    try:
+        imagem, data = ler_imagem_binaria(request, MAX_IMAGE_SIZE)
         
-        produto_id = cursor.lastrowid if cursor.lastrowid > 0 else cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
-        conn.commit()
-        conn.close()
+        campos_obrigatorios = ['nome', 'localizacao', 'quantidade']
+        if imagem is None or not all(k in data for k in campos_obrigatorios):
+            return jsonify({
+                "status": "erro",
+                "mensagem": "Campos obrigatórios: nome, localizacao, quantidade e imagem"
+            }), 400
         
-        return jsonify({
-            "status": "sucesso",
-            "mensagem": f"✅ Produto '{nome}' cadastrado com QR Code!",
-            "produto_id": produto_id,
-            "codigo": codigo,
-            "qrcode_url": f"/static/qrcodes/{qr_filename}",
-            "instrucao": "Baixe o QR Code, imprima e cole no produto. Depois aponte a câmera para o QR Code!"
-        }), 201
+        corpo, status = cadastrar_via_scanner(data, imagem)
+        with etapa('serializacao'):
+            resposta = jsonify(corpo)
+        return resposta, status
         
+    except ImagemInvalida as e:
+        return jsonify({"status": "erro", "mensagem": f"Imagem inválida: {str(e)}"}), 400
     except ValueError as e:
         return jsonify({"status": "erro", "mensagem": "Quantidade e preço devem ser números válidos"}), 400
     except Exception as e:
         return jsonify({"status": "erro", "mensagem": f"Erro ao cadastrar: {str(e)}"}), 500
 
 
+# Progresso guardado na tabela importacoes (das mais recentes)
+MAX_IMPORTACOES_GUARDADAS = 50
+
+
+@app.route('/api/importar', methods=['POST'])
+def api_importar():
+    """
+    Importação em lote: multipart/form-data com "arquivo" (.csv ou .jsonl) e,
+    opcionalmente, "imagens" (.zip com os arquivos citados na coluna imagem).
+    Responde 202 na hora; o progresso fica em GET /api/importar/<id>.
+    """
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    
+    arquivo = request.files.get('arquivo')
+    if not arquivo or not arquivo.filename:
+        return jsonify({"status": "erro", "mensagem": "Envie o arquivo no campo 'arquivo'"}), 400
+    
+    formato = detectar_formato_importacao(arquivo.filename)
+    if not formato:
+        return jsonify({"status": "erro", "mensagem": "Formato não suportado. Use .csv ou .jsonl"}), 400
+    
+    # Os arquivos precisam sobreviver ao fim da requisição: a importação roda em segundo plano
+    pasta_temporaria = tempfile.mkdtemp(prefix='importacao_')
+    caminho = os.path.join(pasta_temporaria, f"produtos.{formato}")
+    arquivo.save(caminho)
+    
+    zip_caminho = None
+    imagens = request.files.get('imagens')
+    if imagens and imagens.filename:
+        zip_caminho = os.path.join(pasta_temporaria, 'imagens.zip')
+        imagens.save(zip_caminho)
+        if not zipfile.is_zipfile(zip_caminho):
+            shutil.rmtree(pasta_temporaria, ignore_errors=True)
+            return jsonify({"status": "erro", "mensagem": "O campo 'imagens' deve ser um arquivo .zip"}), 400
+    
+    # Gravada antes do 202: o primeiro GET do progresso pode cair em outro worker
+    importacao = Importacao()
+    conn = get_db()
+    importacao.gravar(conn)
+    apagar_importacoes_antigas(conn, MAX_IMPORTACOES_GUARDADAS)
+    
+    importar_em_segundo_plano(
+        pool_conexoes.caminho, pasta_temporaria, caminho, formato, zip_caminho,
+        app.config['SCANNER_FOLDER'], cache_qrcodes, importacao
+    )
+    
+    return jsonify({
+        "status": "aceito",
+        "mensagem": "⏳ Importação iniciada",
+        "importacao_id": importacao.id,
+        "progresso_url": url_for('api_progresso_importacao', importacao_id=importacao.id)
+    }), 202
+
+
+@app.route('/api/importar/<importacao_id>', methods=['GET'])
+def api_progresso_importacao(importacao_id):
+    """Progresso e erros por linha de uma importação"""
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    
+    resumo = resumo_gravado(get_db(), importacao_id)
+    if not resumo:
+        return jsonify({"status": "erro", "mensagem": "Importação não encontrada"}), 404
+    
+    return jsonify({"status": "sucesso", **resumo}), 200
+
+
+# Trabalhos de etiquetas guardados (progresso na tabela, arquivos em ETIQUETAS_FOLDER)
+MAX_TRABALHOS_ETIQUETAS = 20
+
+
+@app.route('/api/etiquetas', methods=['POST'])
+def api_etiquetas():
+    """
+    Folhas A4 de etiquetas (QR Code + nome + localização) para imprimir.
+    Filtros: categoria, coluna (coluna_armazenada), ids=1,2,3; formato=pdf|png
+    (na query string ou no formulário).
+    Responde 202 na hora; as páginas são desenhadas em segundo plano no pool
+    de processos e o progresso fica em GET /api/etiquetas/<id>.
+    """
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    
+    formato = request.values.get('formato', 'pdf')
+    try:
+        if formato not in etiquetas.FORMATOS:
+            raise etiquetas.FiltroInvalido("Formato deve ser 'pdf' ou 'png'")
+        produtos = etiquetas.selecionar_produtos(get_db(), **etiquetas.ler_filtro(request.values))
+    except etiquetas.FiltroInvalido as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 400
+    
+    if not produtos:
+        return jsonify({"status": "erro", "mensagem": "Nenhum produto com código para o filtro informado"}), 404
+    
+    # Gravado antes do 202: o primeiro GET do progresso pode cair em outro worker
+    trabalho = etiquetas.TrabalhoEtiquetas(formato, len(produtos))
+    conn = get_db()
+    trabalho.gravar(conn)
+    etiquetas.apagar_antigos(conn, MAX_TRABALHOS_ETIQUETAS)
+    
+    etiquetas.gerar_em_segundo_plano(
+        pool_conexoes.caminho, produtos, formato, cache_qrcodes, app.config['ETIQUETAS_FOLDER'], trabalho
+    )
+    
+    return jsonify({
+        "status": "aceito",
+        "mensagem": "⏳ Gerando etiquetas",
+        "trabalho_id": trabalho.id,
+        "progresso_url": url_for('api_progresso_etiquetas', trabalho_id=trabalho.id)
+    }), 202
+
+
+@app.route('/api/etiquetas/<trabalho_id>', methods=['GET'])
+def api_progresso_etiquetas(trabalho_id):
+    """Progresso de uma geração de etiquetas; pronta, traz o arquivo_url"""
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    
+    trabalho = etiquetas.trabalho_gravado(get_db(), trabalho_id)
+    if not trabalho:
+        return jsonify({"status": "erro", "mensagem": "Trabalho de etiquetas não encontrado"}), 404
+    
+    trabalho.pop('arquivo')
+    if trabalho['estado'] == 'concluido':
+        trabalho['arquivo_url'] = url_for('api_arquivo_etiquetas', trabalho_id=trabalho_id)
+    return jsonify({"status": "sucesso", **trabalho}), 200
+
+
+@app.route('/api/etiquetas/<trabalho_id>/arquivo', methods=['GET'])
+def api_arquivo_etiquetas(trabalho_id):
+    """PDF, PNG ou zip de uma geração de etiquetas concluída"""
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    
+    trabalho = etiquetas.trabalho_gravado(get_db(), trabalho_id)
+    if not trabalho:
+        return jsonify({"status": "erro", "mensagem": "Trabalho de etiquetas não encontrado"}), 404
+    if trabalho['estado'] != 'concluido':
+        return jsonify({"status": "erro", "mensagem": "As etiquetas ainda não estão prontas"}), 409
+    
+    extensao = etiquetas.EXTENSOES[trabalho['mimetype']]
+    return send_file(os.path.abspath(trabalho['arquivo']), mimetype=trabalho['mimetype'], as_attachment=True,
+                     download_name=f"etiquetas.{extensao}")
+
+
+# Campos que /api/produtos_scanner aceita em fields=: nome no JSON -> (coluna, conversor)
+CAMPOS_PRODUTO_SCANNER = {
+    "id": ("id", sem_conversao),
+    "codigo": ("codigo", sem_conversao),
+    "nome": ("nome", sem_conversao),
+    "localizacao": ("localizacao", sem_conversao),
+    "quantidade": ("quantidade", sem_conversao),
+    "preco": ("preco", float),
+    "categoria": ("categoria", lambda categoria: categoria or 'Geral'),
+    "imagem_url": ("imagem_path", lambda path: f"/static/produtos_imagens/{path}" if path else None),
+    "miniatura_url": ("miniatura_path", lambda path: f"/static/produtos_imagens/{path}" if path else None),
+}
+
+
 @app.route('/api/produtos_scanner', methods=['GET'])
 def api_listar_produtos_scanner():
-    """Lista todos produtos do scanner"""
+    """Lista produtos do scanner, paginados por cursor ou em NDJSON (ver listagem.py)"""
     if 'user' not in session:
         return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
     
     try:
-        conn = get_db()
-        produtos = conn.execute(
-            "SELECT * FROM produtos WHERE codigo IS NOT NULL ORDER BY nome"
-        ).fetchall()
-        conn.close()
-        
-        lista = [{
-            "id": p['id'],
-            "codigo": p['codigo'],
-            "nome": p['nome'],
-            "localizacao": p['localizacao'],
-            "quantidade": p['quantidade'],
-            "preco": float(p['preco']),
-            "categoria": p['categoria'] or 'Geral',
-            "imagem_url": f"/static/produtos_imagens/{p['imagem_path']}" if p['imagem_path'] else None
-        } for p in produtos]
+        stream = pediu_stream(request)
+        parametros = ler_parametros(request.args, CAMPOS_PRODUTO_SCANNER, CAMPOS_PRODUTO_SCANNER, stream)
+        if stream:
+            return resposta_ndjson(gerar_ndjson(
+                pool_conexoes, CAMPOS_PRODUTO_SCANNER, parametros, condicoes=("codigo IS NOT NULL",)
+            ))
+
+        lista, proximo_cursor = buscar_pagina(
+            get_db(), CAMPOS_PRODUTO_SCANNER, parametros, condicoes=("codigo IS NOT NULL",)
+        )
         
         return jsonify({
             "status": "sucesso",
             "total": len(lista),
-            "produtos": lista
+            "produtos": lista,
+            "proximo_cursor": proximo_cursor
         }), 200
         
+    except ParametrosInvalidos as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "erro", "mensagem": f"Erro: {str(e)}"}), 500
 
@@ -554,11 +1047,7 @@ def camera():
         nome = os.path.splitext(filename)[0].lower().strip()
 
         conn = get_db()
-        produto = conn.execute(
-            "SELECT * FROM produtos WHERE TRIM(LOWER(nome)) = ?",
-            (nome,)
-        ).fetchone()
-        conn.close()
+        produto = buscar_por_nome(conn, nome)
 
         if produto:
             return render_template('scan_result.html', produto=produto)
@@ -594,36 +1083,39 @@ def cadastrar_produto_escaneado():
         linha = int(data["linha"])
         posicao = data["posicao"]
         
-        imagem_base64 = data.get("imagem", "")
-        if imagem_base64 and "," in imagem_base64:
-            imagem_base64 = imagem_base64.split(",", 1)[1]
+        imagem = None
+        if data.get("imagem"):
+            imagem, msg = validar_base64_imagem(data["imagem"])
+            if not imagem:
+                return jsonify({"erro": f"Imagem inválida: {msg}"}), 400
 
         localizacao = f"Coluna {coluna}, Linha {linha}, {posicao}"
 
         conn = get_db()
         cursor = conn.cursor()
         
-        produto_existente = cursor.execute(
-            "SELECT * FROM produtos WHERE TRIM(LOWER(nome)) = ?",
-            (nome,)
-        ).fetchone()
+        produto_existente = buscar_por_nome(conn, nome)
         
         if produto_existente:
-            conn.close()
             return jsonify({"erro": "Produto já cadastrado com este nome"}), 400
 
+        # Gravada só quando o produto vai entrar: um nome repetido não deixa arquivo órfão
+        imagem_arquivo = None
+        if imagem:
+            imagem_arquivo = salvar_blob(app.config['IMAGENS_FOLDER'], imagem.dados, imagem.extensao)
+
         cursor.execute("""
             INSERT INTO produtos
-            (nome, quantidade, preco, localizacao,
+            (nome, nome_normalizado, quantidade, preco, localizacao,
              coluna_armazenada, nivel_armazenado,
-             imagem_base64, posicao_bloqueada)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (nome, quantidade, preco, localizacao,
-              coluna, linha, imagem_base64, posicao))
+             imagem_arquivo, posicao_bloqueada)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (nome, normalizar_nome(nome), quantidade, preco, localizacao,
+              coluna, linha, imagem_arquivo, posicao))
         
         produto_id = cursor.lastrowid
         conn.commit()
-        conn.close()
+        normalizar_imagem('imagem_arquivo', imagem_arquivo)
 
         return jsonify({
             "sucesso": True,
@@ -635,81 +1127,208 @@ def cadastrar_produto_escaneado():
         return jsonify({"erro": f"Erro ao cadastrar produto: {str(e)}"}), 500
 
 
+# Campos que /api/produtos aceita em fields=: nome no JSON -> (coluna, conversor)
+CAMPOS_PRODUTO = {
+    "id": ("id", sem_conversao),
+    "nome": ("nome", sem_conversao),
+    "quantidade": ("quantidade", sem_conversao),
+    "preco": ("preco", float),
+    "localizacao": ("localizacao", sem_conversao),
+    "coluna": ("coluna_armazenada", sem_conversao),
+    "nivel": ("nivel_armazenado", sem_conversao),
+    "posicao": ("posicao_bloqueada", sem_conversao),
+    "imagem_url": ("imagem_arquivo", url_imagem),
+    "miniatura_url": ("miniatura_arquivo", url_imagem),
+    "codigo": ("codigo", sem_conversao),
+    "categoria": ("categoria", sem_conversao),
+}
+
+# Resposta sem fields=: os mesmos campos de antes da paginação
+CAMPOS_PRODUTO_PADRAO = ("id", "nome", "quantidade", "preco", "localizacao",
+                         "coluna", "nivel", "posicao", "imagem_url")
+
+
 @app.route('/api/produtos', methods=['GET'])
 def listar_produtos():
     """
-    API para listar todos os produtos cadastrados.
+    API para listar os produtos cadastrados, paginados por cursor.
+    Aceita limit, cursor, fields, categoria, quantidade_min e quantidade_max
+    (ver listagem.py); "proximo_cursor" é None na última página.
+    Com ?stream=1 ou Accept: application/x-ndjson devolve tudo em NDJSON.
     """
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, nome, quantidade, preco, localizacao,
-                   coluna_armazenada, nivel_armazenado,
-                   imagem_base64, posicao_bloqueada
-            FROM produtos
-            ORDER BY nome
-        """)
-        
-        produtos = [{
-            "id": row["id"],
-            "nome": row["nome"],
-            "quantidade": row["quantidade"],
-            "preco": float(row["preco"]),
-            "localizacao": row["localizacao"],
-            "coluna": row["coluna_armazenada"],
-            "nivel": row["nivel_armazenado"],
-            "posicao": row["posicao_bloqueada"],
-            "imagem": row["imagem_base64"]
-        } for row in cursor.fetchall()]
-        
-        conn.close()
+        stream = pediu_stream(request)
+        parametros = ler_parametros(request.args, CAMPOS_PRODUTO, CAMPOS_PRODUTO_PADRAO, stream)
+        if stream:
+            return resposta_ndjson(gerar_ndjson(pool_conexoes, CAMPOS_PRODUTO, parametros))
+
+        produtos, proximo_cursor = buscar_pagina(get_db(), CAMPOS_PRODUTO, parametros)
         
         return jsonify({
             "sucesso": True,
             "total": len(produtos),
-            "produtos": produtos
+            "produtos": produtos,
+            "proximo_cursor": proximo_cursor
         }), 200
 
+    except ParametrosInvalidos as e:
+        return jsonify({"erro": str(e)}), 400
     except Exception as e:
         return jsonify({"erro": f"Erro ao listar produtos: {str(e)}"}), 500
 
 
+@app.route('/api/produtos/search', methods=['GET'])
+def buscar_produtos_texto():
+    """
+    Busca enquanto digita: ?q=cha ing&limit=10. Cada palavra é um prefixo
+    procurado em nome, categoria, código e localização (sem diferenciar
+    maiúsculas nem acentos); resultados por relevância (ver busca.py).
+    """
+    if not app.config['BUSCA_FTS']:
+        return jsonify({"erro": "Busca por texto indisponível (SQLite sem FTS5)"}), 503
+    
+    try:
+        limite = ler_limite_busca(request.args.get('limit'))
+        linhas = buscar_produtos(get_db(), request.args.get('q', ''), limite)
+    except BuscaInvalida as e:
+        return jsonify({"erro": str(e)}), 400
+    except Exception as e:
+        return jsonify({"erro": f"Erro na busca: {str(e)}"}), 500
+    
+    produtos = [{
+        "id": linha["id"],
+        "nome": linha["nome"],
+        "codigo": linha["codigo"],
+        "categoria": linha["categoria"],
+        "localizacao": linha["localizacao"],
+        "quantidade": linha["quantidade"],
+        "miniatura_url": url_imagem(linha["miniatura_arquivo"])
+    } for linha in linhas]
+    
+    return jsonify({"sucesso": True, "total": len(produtos), "produtos": produtos}), 200
+
+
 @app.route('/api/produto/<int:produto_id>', methods=['GET'])
 def obter_produto(produto_id):
     """
     API para obter informações de um produto específico por ID.
+    Com If-None-Match igual à ETag atual responde 304, sem montar o JSON.
     """
     try:
-        conn = get_db()
-        produto = conn.execute(
-            "SELECT * FROM produtos WHERE id = ?",
-            (produto_id,)
-        ).fetchone()
-        conn.close()
+        produto, etag = cache_produtos.buscar_por_id(get_db(), produto_id)
 
         if not produto:
             return jsonify({"erro": "Produto não encontrado"}), 404
 
-        return jsonify({
-            "sucesso": True,
-            "produto": {
-                "id": produto["id"],
-                "nome": produto["nome"],
-                "quantidade": produto["quantidade"],
-                "preco": float(produto["preco"]),
-                "localizacao": produto["localizacao"],
-                "coluna": produto["coluna_armazenada"],
-                "nivel": produto["nivel_armazenado"],
-                "posicao": produto["posicao_bloqueada"],
-                "imagem": produto["imagem_base64"]
-            }
-        }), 200
+        if request.if_none_match.contains(etag):
+            resposta = app.response_class(status=304)
+        else:
+            resposta = jsonify({
+                "sucesso": True,
+                "produto": {
+                    "id": produto["id"],
+                    "nome": produto["nome"],
+                    "quantidade": produto["quantidade"],
+                    "preco": float(produto["preco"]),
+                    "localizacao": produto["localizacao"],
+                    "coluna": produto["coluna_armazenada"],
+                    "nivel": produto["nivel_armazenado"],
+                    "posicao": produto["posicao_bloqueada"],
+                    "imagem_url": url_imagem(produto["imagem_arquivo"]),
+                    "miniatura_url": url_imagem(produto["miniatura_arquivo"])
+                }
+            })
+
+        # no-cache: o cliente pode guardar, mas confirma a ETag a cada uso
+        resposta.set_etag(etag)
+        resposta.cache_control.no_cache = True
+        return resposta
 
     except Exception as e:
         return jsonify({"erro": f"Erro ao buscar produto: {str(e)}"}), 500
 
 
+def invalidar_movimentados(aplicados):
+    cache_produtos.invalidar(*{movimento['produto_id'] for movimento in aplicados})
+
+
+def avisar_movimento_recusado(futuro):
+    if futuro.exception() is not None:
+        print(f"❌ Movimento recusado na escrita agrupada: {futuro.exception()}")
+
+
+def registrar_movimentos(produto_id=None):
+    """
+    Aplica os movimentos do corpo JSON e monta a resposta das rotas de movimento.
+    Na escrita agrupada os movimentos vão para a fila: a resposta é 202, ou o
+    resultado normal depois do commit do grupo com ?aguardar=1.
+    """
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    
+    usuario = session['user']
+    try:
+        movimentos = ler_movimentos(request.get_json(silent=True), produto_id)
+        if app.config['ESCRITA_AGRUPADA']:
+            futuro = escrita_agrupada.enviar(
+                lambda conn: executar_movimentos(conn, movimentos, usuario), sessao=usuario,
+                ao_confirmar=invalidar_movimentados
+            )
+            if request.args.get('aguardar') != '1':
+                futuro.add_done_callback(avisar_movimento_recusado)
+                return jsonify({"status": "aceito", "total": len(movimentos)}), 202
+            aplicados = futuro.result(timeout=ESPERA_LEITURA)
+        else:
+            aplicados = aplicar_movimentos(get_db(), movimentos, usuario)
+            invalidar_movimentados(aplicados)
+    except FilaCheia as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 503, {"Retry-After": "1"}
+    except TimeoutError:
+        # Continua na fila: repetir o movimento poderia aplicá-lo duas vezes
+        return jsonify({"status": "erro", "mensagem": "Movimento ainda não confirmado pela escrita agrupada; "
+                                                      "confira o estoque antes de repetir"}), 503
+    except EscritaInterrompida as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 503, {"Retry-After": "1"}
+    except MovimentoInvalido as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 400
+    except ProdutoNaoEncontrado as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 404
+    except EstoqueInsuficiente as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 409
+    except Exception as e:
+        return jsonify({"status": "erro", "mensagem": f"Erro ao registrar movimento: {str(e)}"}), 500
+    
+    return jsonify({"status": "sucesso", "total": len(aplicados), "movimentos": aplicados}), 200
+
+
+@app.route('/api/produto/<int:produto_id>/movimento', methods=['POST'])
+def api_movimento_produto(produto_id):
+    """
+    Entrada ou saída de estoque por diferença: {"delta": -3, "motivo": "..."}
+    ou {"movimentos": [...]} (vários do mesmo produto). A quantidade é somada
+    no banco, sem sobrescrever movimentos simultâneos (ver movimentos.py).
+    """
+    return registrar_movimentos(produto_id)
+
+
+@app.route('/api/movimentos', methods=['POST'])
+def api_movimentos_lote():
+    """
+    Lote de movimentos de produtos diferentes numa transação só (recebimento):
+    {"movimentos": [{"produto_id": 1, "delta": 10}, {"codigo": "123456", "delta": -2}]}
+    Se um movimento for recusado, nenhum é aplicado.
+    """
+    return registrar_movimentos()
+
+
+@app.before_request
+def aguardar_escritas_da_sessao():
+    """Escrita agrupada: cada requisição vê os movimentos que a própria sessão ainda tem na fila"""
+    if (app.config['ESCRITA_AGRUPADA'] and 'user' in session
+            and request.endpoint not in ('api_movimento_produto', 'api_movimentos_lote')):
+        escrita_agrupada.aguardar_sessao(session['user'], timeout=ESPERA_LEITURA)
+
+
 # -----------------------------------------------------------
 # CONSULTAS DE ESTOQUE
 # -----------------------------------------------------------
@@ -726,11 +1345,7 @@ def buscar_produto():
         nome = request.form['busca'].strip().lower()
 
         conn = get_db()
-        produto = conn.execute(
-            "SELECT * FROM produtos WHERE TRIM(LOWER(nome)) = ?",
-            (nome,)
-        ).fetchone()
-        conn.close()
+        produto = buscar_por_nome(conn, nome)
 
         busca_realizada = True
 
@@ -749,7 +1364,7 @@ def estoque():
     cursor.execute("""
         SELECT id, nome, quantidade, preco, localizacao,
                coluna_armazenada, nivel_armazenado,
-               imagem_base64, posicao_bloqueada
+               imagem_arquivo, miniatura_arquivo, posicao_bloqueada
         FROM produtos
     """)
 
@@ -761,11 +1376,10 @@ def estoque():
         "localizacao": row["localizacao"],
         "coluna_armazenada": row["coluna_armazenada"],
         "nivel_armazenado": row["nivel_armazenado"],
-        "imagem": row["imagem_base64"],
+        "imagem_url": url_imagem(row["miniatura_arquivo"] or row["imagem_arquivo"]),
         "posicao_bloqueada": row["posicao_bloqueada"]
     } for row in cursor.fetchall()]
 
-    conn.close()
     return render_template('estoque.html', produtos=produtos)
 
 
@@ -779,7 +1393,7 @@ def estoque_baixo():
     cursor.execute("""
         SELECT id, nome, quantidade, preco, localizacao,
                coluna_armazenada, nivel_armazenado,
-               imagem_base64, posicao_bloqueada
+               imagem_arquivo, miniatura_arquivo, posicao_bloqueada
         FROM produtos
         WHERE quantidade <= 10
         ORDER BY quantidade ASC
@@ -793,11 +1407,10 @@ def estoque_baixo():
         "localizacao": row["localizacao"],
         "coluna_armazenada": row["coluna_armazenada"],
         "nivel_armazenado": row["nivel_armazenado"],
-        "imagem": row["imagem_base64"],
+        "imagem_url": url_imagem(row["miniatura_arquivo"] or row["imagem_arquivo"]),
         "posicao_bloqueada": row["posicao_bloqueada"]
     } for row in cursor.fetchall()]
 
-    conn.close()
     return render_template('estoque_baixo.html', produtos=produtos)
 
 
@@ -811,13 +1424,19 @@ def adicionar_produto():
     posicao = request.form['posicao']
 
     imagem = request.files.get('imagem')
-    imagem_base64 = ""
+    imagem_arquivo = None
 
     if imagem:
-        img = Image.open(imagem)
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        imagem_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        # Bytes como vieram; a normalização recodifica depois do cadastro
+        dados = imagem.read()
+        if not detectar_formato(dados):
+            # Formatos que o armazém não reconhece viram PNG
+            from PIL import Image
+
+            buffer = BytesIO()
+            Image.open(BytesIO(dados)).save(buffer, format="PNG")
+            dados = buffer.getvalue()
+        imagem_arquivo = salvar_blob(app.config['IMAGENS_FOLDER'], dados, extensao_de(dados))
 
     localizacao = f"Coluna {coluna}, Linha {linha}, {posicao}"
 
@@ -825,14 +1444,14 @@ def adicionar_produto():
     cursor = conn.cursor()
     cursor.execute("""
         INSERT INTO produtos
-        (nome, quantidade, preco, localizacao,
+        (nome, nome_normalizado, quantidade, preco, localizacao,
          coluna_armazenada, nivel_armazenado,
-         imagem_base64, posicao_bloqueada)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (nome, quantidade, preco, localizacao,
-          coluna, linha, imagem_base64, posicao))
+         imagem_arquivo, posicao_bloqueada)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (nome, normalizar_nome(nome), quantidade, preco, localizacao,
+          coluna, linha, imagem_arquivo, posicao))
     conn.commit()
-    conn.close()
+    normalizar_imagem('imagem_arquivo', imagem_arquivo)
 
     return redirect(url_for('estoque'))
 
@@ -843,12 +1462,49 @@ def deletar_produto(produto_id):
     cursor = conn.cursor()
     cursor.execute("DELETE FROM produtos WHERE id = ?", (produto_id,))
     conn.commit()
-    conn.close()
+
+    cache_produtos.invalidar(produto_id)
+    indice_imagens.remover(produto_id)
 
     flash("Produto deletado.")
     return redirect(url_for('estoque'))
 
 
+@app.route('/api/admin/consultas', methods=['GET', 'DELETE'])
+def api_admin_consultas():
+    """
+    Estatísticas das consultas SQL deste processo, por SQL normalizado, com o
+    plano de cada uma. ?ordem=total|media|max|execucoes|lentas&limite=50.
+    DELETE zera as estatísticas.
+    """
+    if 'user' not in session:
+        return jsonify({"status": "erro", "mensagem": "Não autenticado"}), 401
+    if not eh_admin(session['user'], app.config['ADMINS']):
+        return jsonify({"status": "erro", "mensagem": "Acesso restrito a administradores"}), 403
+    
+    if request.method == 'DELETE':
+        registro_consultas.limpar()
+        return jsonify({"status": "sucesso", "mensagem": "Estatísticas zeradas"}), 200
+    
+    ordem = request.args.get('ordem', 'total')
+    if ordem not in ORDENS_CONSULTAS:
+        return jsonify({"status": "erro", "mensagem": f"ordem deve ser uma de: {', '.join(ORDENS_CONSULTAS)}"}), 400
+    try:
+        limite = int(request.args.get('limite', 50))
+    except ValueError:
+        return jsonify({"status": "erro", "mensagem": "limite deve ser um número"}), 400
+    
+    consultas = registro_consultas.estatisticas(ordem, max(limite, 1))
+    return jsonify({
+        "status": "sucesso",
+        "pid": os.getpid(),
+        "limite_lenta_ms": registro_consultas.limite_ms,
+        "descartadas": registro_consultas.descartadas,
+        "varreduras_completas": sum(1 for c in consultas if c['varredura_completa']),
+        "consultas": consultas
+    }), 200
+
+
 @app.route('/logout')
 def logout():
     session.pop('user', None)
@@ -860,4 +1516,5 @@ def logout():
 # EXECUTAR
 # -----------------------------------------------------------
 if __name__ == '__main__':
+    preparar_banco()
     app.run(debug=True)
@@ -0,0 +1,330 @@
+"""
+Métricas no formato de texto do Prometheus (rota /metrics)
+
+Cada processo acumula contadores e histogramas em memória (um lock e
+algumas somas por requisição, sem E/S no caminho da requisição) e uma
+thread grava o estado a cada INTERVALO_GRAVACAO segundos em
+<pasta>/<app>-<pid>.json. A rota /metrics, atendida por qualquer worker,
+soma os arquivos de todos os processos do mesmo app, então o resultado é o
+do servidor inteiro e não só do worker que respondeu. Os números de
+processos que terminaram (workers reciclados, reinícios) são consolidados
+num arquivo só e continuam somando: os contadores nunca diminuem.
+
+Métricas:
+    http_requisicoes_total                 requisições por rota, método e status
+    http_erros_total                       respostas 5xx por rota
+    http_requisicao_duracao_segundos       histograma de latência por rota e método
+    http_requisicao_consultas_sql          histograma de consultas SQL por requisição, por rota
+    sql_consultas_total                    execute/executemany em qualquer conexão do pool
+    sql_duracao_segundos                   histograma da duração de cada execute
+    comparacoes_imagem_total               buscas por imagem, por resultado
+    leituras_qrcode_total                  leituras de QR Code no servidor, por resultado
+                                           (lido, sem_qrcode, lotado, tempo_esgotado, erro)
+
+O tempo de SQL é o do execute (a primeira linha de um SELECT); as linhas
+buscadas depois com fetch não entram. Só contam as conexões do banco do app
+(o pool passado a registrar_metricas).
+
+/metrics responde a quem manda `Authorization: Bearer <METRICAS_TOKEN>` (o
+Prometheus) ou a um usuário logado que seja administrador (ver
+administradores.py); os demais recebem 403. Sem METRICAS_TOKEN no ambiente,
+só os administradores.
+"""
+
+import contextlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:  # Windows: um processo só, nada a travar
+    fcntl = None
+
+from flask import Response, g, has_request_context, jsonify, request, session
+
+from administradores import eh_admin
+
+INTERVALO_GRAVACAO = 1.0  # segundos
+MIME_PROMETHEUS = 'text/plain; version=0.0.4; charset=utf-8'
+
+FAIXAS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAIXAS_SQL = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+FAIXAS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+# nome -> (tipo, ajuda, faixas do histograma)
+DEFINICOES = {
+    'http_requisicoes_total': ('counter', "Requisições atendidas", None),
+    'http_erros_total': ('counter', "Respostas com status 5xx", None),
+    'http_requisicao_duracao_segundos': ('histogram', "Duração das requisições", FAIXAS_LATENCIA),
+    'http_requisicao_consultas_sql': ('histogram', "Consultas SQL por requisição", FAIXAS_CONSULTAS),
+    'sql_consultas_total': ('counter', "Comandos SQL executados", None),
+    'sql_duracao_segundos': ('histogram', "Duração de cada comando SQL", FAIXAS_SQL),
+    'comparacoes_imagem_total': ('counter', "Buscas de produto por imagem", None),
+    'leituras_qrcode_total': ('counter', "Leituras de QR Code no servidor", None),
+}
+
+ROTA_DESCONHECIDA = '<desconhecida>'  # 404 de caminhos sem rota (não vira um rótulo por URL)
+
+
+def _formatar_valor(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+def _formatar_rotulos(rotulos):
+    if not rotulos:
+        return ''
+    partes = []
+    for nome, valor in rotulos:
+        valor = str(valor).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        partes.append(f'{nome}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+
+class Metricas:
+    """
+    Contadores e histogramas de um app, gravados por processo e somados na
+    leitura. Depois de um fork o filho começa zerado (o pai continua com os
+    seus números no arquivo dele).
+    """
+
+    def __init__(self, nome_app, pasta):
+        self.nome_app = nome_app
+        self.pasta = pasta
+        self._lock = threading.Lock()
+        self._pid = None
+        self._valores = {}  # (nome, rótulos) -> número (contador) ou [contagens, soma, total] (histograma)
+        self._alterado = False
+
+    def _estado(self):
+        # Chamado com o lock
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._valores = {}
+            threading.Thread(target=self._gravar_periodicamente, name='metricas', daemon=True).start()
+        return self._valores
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            valores = self._estado()
+            valores[chave] = valores.get(chave, 0) + valor
+            self._alterado = True
+
+    def observar(self, nome, valor, **rotulos):
+        faixas = DEFINICOES[nome][2]
+        chave = (nome, tuple(sorted(rotulos.items())))
+        posicao = bisect_left(faixas, valor)  # faixas são limites "menor ou igual"
+        with self._lock:
+            valores = self._estado()
+            histograma = valores.get(chave)
+            if histograma is None:
+                histograma = valores[chave] = [[0] * (len(faixas) + 1), 0.0, 0]
+            histograma[0][posicao] += 1
+            histograma[1] += valor
+            histograma[2] += 1
+            self._alterado = True
+
+    # -------------------------------------------------------
+    # Arquivos por processo
+    # -------------------------------------------------------
+
+    def _arquivo(self, pid):
+        return os.path.join(self.pasta, f"{self.nome_app}-{pid}.json")
+
+    def gravar(self):
+        """Grava o estado deste processo (temporário + rename: leitor nunca vê arquivo pela metade)"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            copia = [[nome, list(rotulos), valor if not isinstance(valor, list) else [list(valor[0]), valor[1], valor[2]]]
+                     for (nome, rotulos), valor in self._valores.items()]
+            self._alterado = False
+        os.makedirs(self.pasta, exist_ok=True)
+        _gravar_json(self._arquivo(os.getpid()), copia)
+
+    def _gravar_periodicamente(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(INTERVALO_GRAVACAO)
+            if self._alterado:
+                try:
+                    self.gravar()
+                except Exception as e:
+                    print(f"❌ Erro ao gravar métricas: {e}")
+
+    @contextlib.contextmanager
+    def _trava(self):
+        """Exclusão entre processos ao consolidar e somar os arquivos"""
+        os.makedirs(self.pasta, exist_ok=True)
+        with open(os.path.join(self.pasta, f"{self.nome_app}.lock"), 'a') as arquivo:
+            if fcntl is not None:
+                fcntl.flock(arquivo, fcntl.LOCK_EX)
+            yield
+
+    def _consolidar(self, caminho, encerrados):
+        """Soma o arquivo de um processo que terminou em `encerrados` e o apaga"""
+        itens = _ler_itens(caminho)
+        if itens is not None:
+            _somar_itens(encerrados, itens)
+            caminho_encerrados = self._arquivo('encerrados')
+            _gravar_json(caminho_encerrados, [[nome, list(rotulos), valor] for (nome, rotulos), valor in encerrados.items()])
+        os.remove(caminho)
+
+    def _somar_processos(self):
+        """
+        Soma os arquivos deste app. Os de processos que terminaram são
+        consolidados em <app>-encerrados.json: os contadores nunca diminuem
+        (o Prometheus leria a queda como reinício e calcularia um salto).
+        """
+        total = {}
+        prefixo = f"{self.nome_app}-"
+        with self._trava():
+            encerrados = {}
+            _somar_itens(encerrados, _ler_itens(self._arquivo('encerrados')) or [])
+            for nome_arquivo in os.listdir(self.pasta):
+                pid = nome_arquivo[len(prefixo):-len('.json')]
+                if not (nome_arquivo.startswith(prefixo) and nome_arquivo.endswith('.json') and pid.isdigit()):
+                    continue
+                caminho = os.path.join(self.pasta, nome_arquivo)
+                if _processo_vivo(int(pid)):
+                    _somar_itens(total, _ler_itens(caminho) or [])
+                else:
+                    self._consolidar(caminho, encerrados)
+        for chave, valor in encerrados.items():
+            _somar_itens(total, [[chave[0], chave[1], valor]])
+        return total
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus, somando todos os processos"""
+        self.gravar()
+        total = self._somar_processos()
+
+        linhas = []
+        for nome, (tipo, ajuda, faixas) in DEFINICOES.items():
+            series = sorted((rotulos, valor) for (n, rotulos), valor in total.items() if n == nome)
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for rotulos, valor in series:
+                if tipo == 'counter':
+                    linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {_formatar_valor(valor)}")
+                    continue
+                contagens, soma, quantidade = valor
+                acumulado = 0
+                for limite, contagem in zip(faixas + (float('inf'),), contagens):
+                    acumulado += contagem
+                    rotulos_faixa = rotulos + (('le', _formatar_valor(limite)),)
+                    linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos_faixa)} {acumulado}")
+                linhas.append(f"{nome}_sum{_formatar_rotulos(rotulos)} {_formatar_valor(soma)}")
+                linhas.append(f"{nome}_count{_formatar_rotulos(rotulos)} {quantidade}")
+        return '\n'.join(linhas) + '\n'
+
+
+def _gravar_json(caminho, dados):
+    # Temporário + rename: quem lê nunca vê arquivo pela metade
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(dados, f)
+        os.replace(temporario, caminho)
+    except Exception:
+        os.unlink(temporario)
+        raise
+
+
+def _ler_itens(caminho):
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _somar_itens(total, itens):
+    """Soma itens [nome, rótulos, valor] (como gravados no arquivo) em total"""
+    for nome, rotulos, valor in itens:
+        if nome not in DEFINICOES:
+            continue
+        chave = (nome, tuple(tuple(par) for par in rotulos))
+        if isinstance(valor, list):
+            atual = total.setdefault(chave, [[0] * len(valor[0]), 0.0, 0])
+            atual[0] = [a + b for a, b in zip(atual[0], valor[0])]
+            atual[1] += valor[1]
+            atual[2] += valor[2]
+        else:
+            total[chave] = total.get(chave, 0) + valor
+
+
+def _processo_vivo(pid):
+    if pid == os.getpid():
+        return True
+    if os.name != 'posix':
+        # Sem fork não há outros workers (e os.kill(pid, 0) no Windows manda CTRL_C)
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _token_valido(token_esperado):
+    if not token_esperado:
+        return False
+    recebido = request.headers.get('Authorization', '')
+    return hmac.compare_digest(recebido.encode('utf-8'), f"Bearer {token_esperado}".encode('utf-8'))
+
+
+def registrar_metricas(app, metricas, pool, chave_usuario):
+    """
+    Mede cada requisição do app (latência, status, consultas SQL das
+    conexões do pool) e cria a rota /metrics, restrita ao token de
+    METRICAS_TOKEN e aos administradores (session[chave_usuario] em
+    app.config['ADMINS']).
+    """
+    app.config.setdefault('METRICAS_TOKEN', os.environ.get('METRICAS_TOKEN'))
+
+    def ao_executar_sql(conn, sql, parametros, duracao):
+        metricas.incrementar('sql_consultas_total')
+        metricas.observar('sql_duracao_segundos', duracao)
+        if has_request_context():
+            g.consultas_sql = g.get('consultas_sql', 0) + 1
+
+    pool.adicionar_ouvinte(ao_executar_sql)
+
+    @app.before_request
+    def iniciar_medicao():
+        g.inicio_requisicao = time.perf_counter()
+        g.consultas_sql = 0
+
+    @app.after_request
+    def registrar_requisicao(resposta):
+        inicio = g.get('inicio_requisicao')
+        if inicio is None:
+            return resposta
+        rota = request.url_rule.rule if request.url_rule is not None else ROTA_DESCONHECIDA
+        metricas.observar('http_requisicao_duracao_segundos', time.perf_counter() - inicio,
+                          rota=rota, metodo=request.method)
+        metricas.observar('http_requisicao_consultas_sql', g.get('consultas_sql', 0), rota=rota)
+        metricas.incrementar('http_requisicoes_total', rota=rota, metodo=request.method,
+                             status=resposta.status_code)
+        if resposta.status_code >= 500:
+            metricas.incrementar('http_erros_total', rota=rota)
+        return resposta
+
+    @app.route('/metrics')
+    def exportar_metricas():
+        if not (_token_valido(app.config['METRICAS_TOKEN'])
+                or eh_admin(session.get(chave_usuario), app.config.get('ADMINS', ()))):
+            return jsonify({"status": "erro", "mensagem": "Acesso restrito (METRICAS_TOKEN ou administrador)"}), 403
+        return Response(metricas.exportar(), content_type=MIME_PROMETHEUS)
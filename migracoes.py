@@ -0,0 +1,57 @@
+"""
+Migrações de esquema versionadas (PRAGMA user_version)
+
+A versão do esquema fica gravada no próprio arquivo do banco, em
+`PRAGMA user_version` (um inteiro no cabeçalho, lido sem tocar em nenhuma
+tabela). Cada app tem uma lista de migrações; a migração N leva o banco da
+versão N-1 para a N. Na subida só se compara a versão gravada com o tamanho
+da lista: banco em dia não roda nenhum PRAGMA table_info, ALTER ou CREATE.
+
+Bancos de antes do controle de versão estão na versão 0 e passam pela
+migração 1, que é idempotente (CREATE ... IF NOT EXISTS, colunas só se
+faltarem) e leva qualquer esquema anterior ao atual. Mudança nova de
+esquema entra como uma função nova no fim da lista, nunca editando uma que
+já rodou.
+
+Cada migração roda em BEGIN IMMEDIATE, com a versão lida de novo depois de
+pegar a trava: com vários workers subindo juntos só o primeiro migra, os
+outros esperam (busy timeout) e encontram o banco em dia. A versão é
+gravada no mesmo commit da migração. Migrações de dados que fazem commit
+por lote (para não segurar a trava) soltam a trava no meio; por isso
+precisam ser idempotentes, e se forem interrompidas rodam de novo na
+próxima subida.
+"""
+
+import sqlite3
+
+
+def versao_banco(conn):
+    """Versão gravada em PRAGMA user_version (0 em banco novo ou antigo)"""
+    # execute do sqlite3 direto: não conta nas métricas/estatísticas de SQL
+    return sqlite3.Connection.execute(conn, "PRAGMA user_version").fetchone()[0]
+
+
+def migrar(conn, migracoes):
+    """
+    Aplica as migrações que faltam, em ordem; cada uma recebe a conexão.
+    Retorna as versões aplicadas (vazio se o banco já estava em dia).
+    """
+    atual = versao_banco(conn)
+    if atual >= len(migracoes):
+        return []
+
+    if conn.in_transaction:
+        conn.commit()
+    aplicadas = []
+    for versao in range(atual + 1, len(migracoes) + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if versao_banco(conn) < versao:  # outro processo pode ter migrado enquanto esperávamos
+                migracoes[versao - 1](conn)
+                conn.execute(f"PRAGMA user_version = {versao}")
+                aplicadas.append(versao)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return aplicadas
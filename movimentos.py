@@ -0,0 +1,181 @@
+"""
+Movimentos de estoque (entradas e saídas por diferença)
+
+PUT /api/produto/<id> grava a quantidade absoluta: dois separadores mexendo
+no mesmo produto sobrescrevem um ao outro, e a rota lê o produto antes de
+gravar. Um movimento informa só a diferença (delta positivo entra, negativo
+sai) e é aplicado com quantidade = quantidade + ? num único UPDATE ...
+RETURNING, sem leitura antes; movimentos simultâneos se somam, nenhum se
+perde. Cada movimento vira uma linha da tabela movimentos, que só recebe
+INSERT: é o histórico do produto, com a quantidade que ficou depois dele.
+
+Um lote inteiro é uma transação BEGIN IMMEDIATE: o lock de escrita é pego
+logo no início (uma transação que começa lendo e depois tenta escrever pode
+falhar com "database is locked" sem esperar o busy timeout) e o lote custa
+um único commit. Se um movimento for recusado (produto inexistente, estoque
+ficaria negativo), nenhum movimento do lote é aplicado.
+
+Formato de cada movimento:
+    {"delta": -3, "motivo": "separação", "referencia": "pedido 123"}
+com "produto_id" ou "codigo" quando o lote tem produtos diferentes.
+"""
+
+from datetime import datetime
+
+MAX_MOVIMENTOS_LOTE = 1000
+DELTA_MAX = 1_000_000
+TAMANHO_TEXTO = 200  # motivo e referencia
+
+# Produto do movimento. Por código, um produto só, mesmo em bancos antigos
+# sem o índice único de código
+ALVO = {
+    'id': "id = ?",
+    'codigo': "id = (SELECT id FROM produtos WHERE codigo = ? LIMIT 1)",
+}
+
+
+class MovimentoInvalido(ValueError):
+    """Corpo da requisição ou movimento mal formado"""
+
+
+class ProdutoNaoEncontrado(LookupError):
+    """Movimento para um produto que não existe"""
+
+
+class EstoqueInsuficiente(Exception):
+    """A saída deixaria a quantidade negativa"""
+
+
+def criar_tabela(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS movimentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            produto_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            quantidade_resultante INTEGER NOT NULL,
+            motivo TEXT,
+            referencia TEXT,
+            usuario TEXT,
+            criado_em TIMESTAMP NOT NULL
+        )
+    """)
+    # Histórico de um produto em ordem
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimento_produto ON movimentos(produto_id, id)")
+
+
+def _texto(valor):
+    if valor is None:
+        return None
+    return str(valor).strip()[:TAMANHO_TEXTO] or None
+
+
+def _ler_movimento(item, posicao, produto_id=None):
+    if not isinstance(item, dict):
+        raise MovimentoInvalido(f"movimentos[{posicao}]: esperado um objeto")
+
+    delta = item.get('delta')
+    if isinstance(delta, str) and delta.strip().lstrip('+-').isdigit():
+        delta = int(delta)
+    # bool é int em Python, mas true/false não é uma quantidade
+    if not isinstance(delta, int) or isinstance(delta, bool):
+        raise MovimentoInvalido(f"movimentos[{posicao}]: 'delta' deve ser um número inteiro")
+    if delta == 0 or abs(delta) > DELTA_MAX:
+        raise MovimentoInvalido(f"movimentos[{posicao}]: 'delta' deve ser diferente de 0 e no máximo {DELTA_MAX} em módulo")
+
+    if produto_id is not None:
+        chave = ('id', produto_id)
+    elif item.get('produto_id') is not None:
+        try:
+            chave = ('id', int(item['produto_id']))
+        except (TypeError, ValueError):
+            raise MovimentoInvalido(f"movimentos[{posicao}]: 'produto_id' inválido")
+    elif item.get('codigo'):
+        chave = ('codigo', str(item['codigo']).strip())
+    else:
+        raise MovimentoInvalido(f"movimentos[{posicao}]: informe 'produto_id' ou 'codigo'")
+
+    return {
+        "chave": chave,
+        "delta": delta,
+        "motivo": _texto(item.get('motivo')),
+        "referencia": _texto(item.get('referencia')),
+    }
+
+
+def ler_movimentos(data, produto_id=None):
+    """
+    Movimentos do corpo JSON: um movimento só ou {"movimentos": [...]}.
+    Com produto_id (rota de um produto), todos são desse produto.
+    """
+    if isinstance(data, dict) and 'movimentos' in data:
+        itens = data['movimentos']
+    elif isinstance(data, dict):
+        itens = [data]
+    else:
+        itens = data
+
+    if not isinstance(itens, list) or not itens:
+        raise MovimentoInvalido("Envie {\"delta\": n} ou {\"movimentos\": [...]}")
+    if len(itens) > MAX_MOVIMENTOS_LOTE:
+        raise MovimentoInvalido(f"Máximo de {MAX_MOVIMENTOS_LOTE} movimentos por lote")
+
+    return [_ler_movimento(item, posicao, produto_id) for posicao, item in enumerate(itens)]
+
+
+def executar_movimentos(conn, movimentos, usuario=None):
+    """
+    Aplica os movimentos (de ler_movimentos) na transação já aberta em conn,
+    na ordem. Retorna um dict por movimento: id, produto_id, delta e
+    quantidade (a que ficou depois dele). Quem chamou confirma ou desfaz.
+    """
+    agora = datetime.now()
+    aplicados = []
+    for posicao, movimento in enumerate(movimentos):
+        coluna, valor = movimento['chave']
+        delta = movimento['delta']
+        linhas = conn.execute(f"""
+            UPDATE produtos SET quantidade = quantidade + ?, atualizado_em = ?
+            WHERE {ALVO[coluna]} AND quantidade + ? >= 0
+            RETURNING id, quantidade
+        """, (delta, agora, valor, delta)).fetchall()
+
+        if not linhas:
+            atual = conn.execute(
+                f"SELECT quantidade FROM produtos WHERE {ALVO[coluna]}", (valor,)
+            ).fetchone()
+            if atual is None:
+                raise ProdutoNaoEncontrado(f"movimentos[{posicao}]: produto {valor} não encontrado")
+            raise EstoqueInsuficiente(
+                f"movimentos[{posicao}]: estoque de {valor} é {atual[0]}, saída de {-delta}"
+            )
+
+        produto_id, quantidade = linhas[0]
+        cursor = conn.execute("""
+            INSERT INTO movimentos (produto_id, delta, quantidade_resultante, motivo, referencia, usuario, criado_em)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (produto_id, delta, quantidade, movimento['motivo'], movimento['referencia'], usuario, agora))
+        aplicados.append({
+            "id": cursor.lastrowid,
+            "produto_id": produto_id,
+            "delta": delta,
+            "quantidade": quantidade,
+        })
+    return aplicados
+
+
+def aplicar_movimentos(conn, movimentos, usuario=None):
+    """
+    Aplica os movimentos numa transação própria (ver executar_movimentos).
+    conn não pode ter transação aberta (o lote é confirmado aqui).
+    """
+    if conn.in_transaction:
+        raise RuntimeError("aplicar_movimentos precisa de uma conexão sem transação aberta")
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        aplicados = executar_movimentos(conn, movimentos, usuario)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return aplicados
@@ -0,0 +1,52 @@
+"""
+Nome normalizado dos produtos, para buscas exatas pelo nome
+
+Buscas com WHERE TRIM(LOWER(nome)) = ? não usam índice e percorrem a tabela
+toda. A coluna nome_normalizado guarda o nome já em minúsculas, sem espaços
+nas pontas e sem acentos ("  Chave Inglesa Média" -> "chave inglesa media"),
+é preenchida em todo cadastro e tem índice próprio, então a busca é uma
+consulta no índice. A comparação ignora acentos, o que LOWER do SQLite nem
+fazia (só converte ASCII).
+"""
+
+import unicodedata
+
+INDICE = "CREATE INDEX IF NOT EXISTS idx_produto_nome_normalizado ON produtos(nome_normalizado)"
+
+
+def normalizar_nome(nome):
+    """Minúsculas, sem espaços nas pontas e sem acentos"""
+    if nome.isascii():
+        return nome.strip().lower()
+    decomposto = unicodedata.normalize('NFKD', nome.strip().casefold())
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def buscar_por_nome(conn, nome):
+    """Produto cujo nome normalizado é igual ao de `nome` (ou None)"""
+    return conn.execute(
+        "SELECT * FROM produtos WHERE nome_normalizado = ?", (normalizar_nome(nome),)
+    ).fetchone()
+
+
+def preencher_nomes_normalizados(conn, lote=500):
+    """
+    Migração: calcula nome_normalizado dos produtos que ainda não têm
+    (cadastrados antes da coluna). Retorna quantos foram preenchidos.
+    """
+    preenchidos = 0
+    ultimo_id = 0
+    while True:
+        linhas = conn.execute(
+            "SELECT id, nome FROM produtos WHERE id > ? AND nome_normalizado IS NULL ORDER BY id LIMIT ?",
+            (ultimo_id, lote)
+        ).fetchall()
+        if not linhas:
+            return preenchidos
+        ultimo_id = linhas[-1][0]
+        conn.executemany(
+            "UPDATE produtos SET nome_normalizado = ? WHERE id = ?",
+            [(normalizar_nome(nome or ''), produto_id) for produto_id, nome in linhas]
+        )
+        conn.commit()
+        preenchidos += len(linhas)
@@ -0,0 +1,260 @@
+"""
+Normalização das imagens dos produtos (em segundo plano, num pool de processos)
+
+As fotos chegam como a câmera do celular produziu: rotação só no EXIF, GPS e
+outros metadados, resolução muito maior do que a tela mostra. O cadastro grava
+os bytes recebidos e responde na hora; depois, num processo do pool:
+
+  1. aplica a orientação do EXIF e descarta os metadados
+  2. limita o maior lado a LADO_MAX
+  3. recodifica em WebP (ou JPEG progressivo, se o Pillow não tiver WebP)
+  4. gera a miniatura (LADO_MINIATURA) usada nas listagens
+
+Os arquivos novos são endereçados por conteúdo (armazem_imagens.salvar_blob)
+na mesma pasta da imagem original, e o banco passa a apontar para eles. O
+original é apagado, ou movido para <pasta>/originais quando manter_original
+está ligado.
+
+O hash perceptual (imagem_dhash) continua o calculado no cadastro.
+
+Imagens já cadastradas, pela linha de comando:
+    python normalizacao_imagens.py --banco banco.db
+"""
+
+import argparse
+import functools
+import os
+import sys
+import threading
+from io import BytesIO
+
+from armazem_imagens import salvar_blob
+from banco_dados import abrir_conexao
+from processos import novo_pool
+
+LADO_MAX = 1600
+LADO_MINIATURA = 320
+QUALIDADE = 80
+QUALIDADE_MINIATURA = 70
+TRABALHADORES = max(1, (os.cpu_count() or 2) - 1)  # linha de comando (um processo só)
+TRABALHADORES_FILA = 2  # por worker web: N workers sobem N pools
+PASTA_ORIGINAIS = 'originais'
+
+# Coluna da imagem -> coluna da miniatura (a miniatura fica na pasta da imagem)
+COLUNAS_MINIATURA = {
+    'imagem_arquivo': 'miniatura_arquivo',
+    'imagem_path': 'miniatura_path',
+}
+
+
+@functools.lru_cache(maxsize=None)
+def formato():
+    """'webp', ou 'jpeg' se o Pillow não tiver WebP (consultado na primeira imagem, não ao importar)"""
+    from PIL import features
+
+    return 'webp' if features.check('webp') else 'jpeg'
+
+
+def extensao():
+    """Extensão dos arquivos gerados no formato()"""
+    return {'webp': 'webp', 'jpeg': 'jpg'}[formato()]
+
+
+def _codificar(img, qualidade):
+    buffer = BytesIO()
+    if formato() == 'webp':
+        img.save(buffer, format='WEBP', quality=qualidade, method=4)
+    else:
+        img.save(buffer, format='JPEG', quality=qualidade, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def normalizar(dados, lado_max=LADO_MAX, lado_miniatura=LADO_MINIATURA):
+    """Bytes da imagem normalizada e da miniatura, no formato()"""
+    from PIL import Image, ImageOps  # só nos processos que normalizam
+
+    with Image.open(BytesIO(dados)) as original:
+        img = ImageOps.exif_transpose(original)
+
+    transparente = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+    if transparente and formato() == 'webp':
+        img = img.convert('RGBA')
+    elif transparente:
+        fundo = Image.new('RGB', img.size, 'white')
+        fundo.paste(img.convert('RGBA'), mask=img.convert('RGBA').getchannel('A'))
+        img = fundo
+    else:
+        img = img.convert('RGB')
+
+    # thumbnail só reduz (nunca amplia) e mantém a proporção
+    img.thumbnail((lado_max, lado_max), Image.LANCZOS)
+    normalizada = _codificar(img, QUALIDADE)
+
+    img.thumbnail((lado_miniatura, lado_miniatura), Image.LANCZOS)
+    miniatura = _codificar(img, QUALIDADE_MINIATURA)
+
+    return normalizada, miniatura
+
+
+def normalizar_arquivo(tarefa):
+    """
+    Executado no pool: normaliza pasta/nome e grava os resultados na mesma
+    pasta. Retorna (nome normalizado, nome da miniatura, bytes antes, bytes depois).
+    """
+    pasta, nome = tarefa
+    with open(os.path.join(pasta, nome), 'rb') as f:
+        dados = f.read()
+    normalizada, miniatura = normalizar(dados)
+    return (
+        salvar_blob(pasta, normalizada, extensao()),
+        salvar_blob(pasta, miniatura, extensao()),
+        len(dados),
+        len(normalizada),
+    )
+
+
+class FilaNormalizacao:
+    """
+    Agenda a normalização das imagens recém-cadastradas e, quando cada uma
+    termina, atualiza os produtos que apontam para o arquivo original.
+    Usa conexão própria (os resultados chegam numa thread do executor).
+    ao_atualizar(ids) é chamado com os ids dos produtos alterados.
+    """
+
+    def __init__(self, caminho_banco, manter_original=False, trabalhadores=TRABALHADORES_FILA, ao_atualizar=None):
+        self.caminho_banco = caminho_banco
+        self.manter_original = manter_original
+        self.trabalhadores = trabalhadores
+        self.ao_atualizar = ao_atualizar
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._conn = None
+
+    def _preparar(self):
+        if self._pid != os.getpid():
+            # Depois de um fork, pool e conexão do processo pai não servem
+            self._pid = os.getpid()
+            self._executor = None
+            self._conn = abrir_conexao(self.caminho_banco)
+        if self._executor is None:
+            # spawn: agendar() roda nas threads das requisições (ver processos.py)
+            self._executor = novo_pool(self.trabalhadores)
+
+    def agendar(self, pasta, coluna, nome):
+        """Normaliza pasta/nome em segundo plano; `coluna` é a que guarda o nome no banco"""
+        with self._lock:
+            self._preparar()
+            futuro = self._executor.submit(normalizar_arquivo, (pasta, nome))
+        futuro.add_done_callback(lambda f: self._concluir(f, pasta, coluna, nome))
+        return futuro
+
+    def _concluir(self, futuro, pasta, coluna, nome):
+        try:
+            novo, miniatura, antes, depois = futuro.result()
+        except Exception as e:
+            print(f"❌ Erro ao normalizar imagem {nome}: {e}")
+            return
+        with self._lock:
+            try:
+                ids = atualizar_produtos(self._conn, pasta, coluna, nome, novo, miniatura, self.manter_original)
+            except Exception as e:
+                print(f"❌ Erro ao gravar imagem normalizada {nome}: {e}")
+                return
+        if ids and self.ao_atualizar is not None:
+            self.ao_atualizar(ids)
+        print(f"🖼️ {nome}: {antes // 1024}KB → {depois // 1024}KB")
+
+    def aguardar(self):
+        """Espera as normalizações pendentes (testes e desligamento)"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def atualizar_produtos(conn, pasta, coluna, nome, novo, miniatura, manter_original=False):
+    """
+    Aponta os produtos para a imagem normalizada e tira o original da pasta.
+    Retorna os ids dos produtos alterados.
+    """
+    with conn:
+        ids = [linha[0] for linha in conn.execute(
+            f"UPDATE produtos SET {coluna} = ?, {COLUNAS_MINIATURA[coluna]} = ? WHERE {coluna} = ? RETURNING id",
+            (novo, miniatura, nome)
+        ).fetchall()]
+    if nome in (novo, miniatura):
+        return ids
+
+    # Arquivos do armazém são compartilhados: só sai da pasta se ninguém mais usa
+    em_uso = conn.execute(
+        "SELECT 1 FROM produtos WHERE imagem_arquivo = ? OR imagem_path = ? LIMIT 1", (nome, nome)
+    ).fetchone()
+    if em_uso:
+        return ids
+
+    caminho = os.path.join(pasta, nome)
+    try:
+        if manter_original:
+            os.makedirs(os.path.join(pasta, PASTA_ORIGINAIS), exist_ok=True)
+            os.replace(caminho, os.path.join(pasta, PASTA_ORIGINAIS, nome))
+        else:
+            os.remove(caminho)
+    except FileNotFoundError:
+        pass
+    return ids
+
+
+def pendentes(conn, coluna):
+    """Imagens da coluna ainda sem miniatura (cadastradas antes da normalização)"""
+    return [linha[0] for linha in conn.execute(
+        f"SELECT DISTINCT {coluna} FROM produtos "
+        f"WHERE {coluna} IS NOT NULL AND {coluna} != '' AND {COLUNAS_MINIATURA[coluna]} IS NULL"
+    )]
+
+
+# -----------------------------------------------------------
+# LINHA DE COMANDO
+# -----------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Normaliza as imagens de produtos já cadastradas")
+    parser.add_argument('--banco', default='banco.db')
+    parser.add_argument('--pasta-imagens', default='static/imagens', help="imagens do estoque (imagem_arquivo)")
+    parser.add_argument('--pasta-scanner', default='static/produtos_imagens', help="fotos do scanner (imagem_path)")
+    parser.add_argument('--manter-original', action='store_true', help=f"move os originais para <pasta>/{PASTA_ORIGINAIS}")
+    args = parser.parse_args(argv)
+
+    conn = abrir_conexao(args.banco)
+    colunas = [linha[1] for linha in conn.execute("PRAGMA table_info(produtos)")]
+    if 'miniatura_arquivo' not in colunas:
+        print(f"❌ {args.banco} ainda não tem as colunas de miniatura. Inicie o sistema uma vez antes.")
+        return 1
+
+    pastas = {'imagem_arquivo': args.pasta_imagens, 'imagem_path': args.pasta_scanner}
+    total = erros = antes_total = depois_total = 0
+    with novo_pool(TRABALHADORES) as pool:
+        for coluna, pasta in pastas.items():
+            nomes = pendentes(conn, coluna)
+            tarefas = [(pasta, nome) for nome in nomes]
+            futuros = [pool.submit(normalizar_arquivo, tarefa) for tarefa in tarefas]
+            for nome, futuro in zip(nomes, futuros):
+                try:
+                    novo, miniatura, antes, depois = futuro.result()
+                    atualizar_produtos(conn, pasta, coluna, nome, novo, miniatura, args.manter_original)
+                except Exception as e:
+                    print(f"❌ {nome}: {e}")
+                    erros += 1
+                    continue
+                total += 1
+                antes_total += antes
+                depois_total += depois
+    conn.close()
+
+    print(f"✅ {total} imagens normalizadas ({erros} com erro): "
+          f"{antes_total / 1024 / 1024:.1f}MB → {depois_total / 1024 / 1024:.1f}MB")
+    return 0 if not erros else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""
+Pools de processos para o trabalho de CPU (fora do GIL dos workers web)
+
+Os workers web têm várias threads (pool de conexões, métricas, filas em
+segundo plano), e um fork feito enquanto outra thread segura um lock copia o
+lock travado para o filho, que trava na primeira vez que o usar. Por isso os
+pools daqui usam o contexto 'spawn': cada processo do pool começa um
+interpretador novo e importa o módulo da função que vai rodar (e o script
+principal, quando o servidor foi iniciado com `python main.py`; o que ele
+faz ao ser importado precisa continuar barato).
+
+O custo de subir um interpretador é pago uma vez por processo: os pools
+são criados uma vez e reaproveitados.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+CONTEXTO = multiprocessing.get_context('spawn')
+
+
+def novo_pool(trabalhadores):
+    """ProcessPoolExecutor com processos iniciados por spawn"""
+    return ProcessPoolExecutor(max_workers=trabalhadores, mp_context=CONTEXTO)
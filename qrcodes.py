@@ -0,0 +1,234 @@
+"""
+QR Codes dos produtos
+
+Renderização em funções puras (sem Flask nem banco), para poderem rodar em
+processos de um pool, e um cache em disco com limite de tamanho (LRU pelo
+mtime dos arquivos, o mesmo para todos os workers) usado pela rota
+/qrcode/<codigo>.<png|svg>:
+
+- o cadastro só agenda a renderização e responde sem esperar a codificação
+  da imagem. A fila é de threads, não de processos: um QR Code de um código
+  curto leva poucos milissegundos (com o GIL), e o que se ganha é tirá-lo do
+  tempo de resposta, não paralelismo;
+- a rota renderiza sob demanda o que não estiver no cache (arquivo perdido,
+  despejado pelo LRU ou ainda na fila);
+- o conteúdo depende só do código, então o ETag é calculado sem abrir o
+  arquivo e o 304 sai sem tocar no disco.
+"""
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FORMATOS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+VERSAO_DESENHO = 1  # aumente ao mudar o desenho (box_size, borda...) para invalidar os ETags
+TAMANHO_CACHE_PADRAO = 200 * 1024 * 1024
+TRABALHADORES_FILA = 2
+
+# Códigos que podem virar nome de arquivo direto; os demais usam o hash
+_CODIGO_SEGURO = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+def _novo_qrcode(codigo):
+    import qrcode  # só no primeiro QR Code: importar o app não carrega a biblioteca (nem o Pillow)
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(codigo)
+    qr.make(fit=True)
+    return qr
+
+
+def desenhar_qrcode(codigo):
+    """Imagem PIL do QR Code do código"""
+    return _novo_qrcode(codigo).make_image(fill_color="black", back_color="white")
+
+
+def renderizar(codigo, formato):
+    """Bytes do QR Code em PNG ou SVG"""
+    buffer = io.BytesIO()
+    if formato == 'svg':
+        import qrcode.image.svg
+
+        _novo_qrcode(codigo).make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        desenhar_qrcode(codigo).save(buffer)
+    return buffer.getvalue()
+
+
+def nome_arquivo(codigo, formato):
+    if _CODIGO_SEGURO.fullmatch(codigo):
+        return f"{codigo}.{formato}"
+    return f"{hashlib.sha1(codigo.encode('utf-8')).hexdigest()}.{formato}"
+
+
+def etag_qrcode(codigo, formato):
+    return hashlib.sha1(f"{VERSAO_DESENHO}:{formato}:{codigo}".encode('utf-8')).hexdigest()
+
+
+class CacheQRCodes:
+    """
+    Pasta de QR Codes renderizados com limite de tamanho (LRU pelo mtime).
+
+    O limite vale para a pasta, não para o processo: cada acesso renova o
+    mtime do arquivo (no máximo uma vez por RENOVAR_USO s) e o despejo lista
+    a pasta e apaga os de mtime mais antigo até TAMANHO_APOS_DESPEJO do
+    limite. Assim os workers que dividem a pasta veem a mesma ordem de uso e
+    os arquivos gravados uns pelos outros.
+
+    Para não listar a pasta a cada gravação, cada processo soma o que gravou
+    desde a última listagem e só lista de novo quando essa estimativa passa
+    do limite, quando já gravou NOVA_LISTAGEM do limite ou quando a última
+    listagem tem mais de INTERVALO_LISTAGEM s. Nada é lido ao criar o cache:
+    a primeira listagem fica para a primeira gravação.
+    """
+
+    RENOVAR_USO = 60
+    NOVA_LISTAGEM = 0.05
+    INTERVALO_LISTAGEM = 60
+    TAMANHO_APOS_DESPEJO = 0.9
+
+    def __init__(self, pasta, tamanho_max=TAMANHO_CACHE_PADRAO, trabalhadores=TRABALHADORES_FILA):
+        # Absoluto: send_file resolveria um caminho relativo a partir da pasta do app
+        self.pasta = os.path.abspath(pasta)
+        self.tamanho_max = tamanho_max
+        self.trabalhadores = trabalhadores
+        self._lock = threading.Lock()
+        self._total = None  # bytes na pasta segundo a última listagem + o que este processo gravou
+        self._gravado = 0  # bytes gravados por este processo desde a última listagem
+        self._listado_em = 0.0
+        self._pendentes = set()
+        self._executor = None
+
+    def _listar(self):
+        """(mtime, nome, tamanho) dos arquivos da pasta, do menos ao mais usado"""
+        entradas = []
+        try:
+            with os.scandir(self.pasta) as pasta:
+                for entrada in pasta:
+                    if entrada.name.endswith('.tmp'):
+                        continue
+                    try:
+                        if entrada.is_file():
+                            info = entrada.stat()
+                            entradas.append((info.st_mtime, entrada.name, info.st_size))
+                    except FileNotFoundError:
+                        pass  # despejado por outro worker durante a listagem
+        except FileNotFoundError:
+            pass
+        entradas.sort()
+        return entradas
+
+    def _renovar(self, caminho, mtime):
+        """Marca o arquivo como usado agora (visível para todos os workers)"""
+        agora = time.time()
+        if agora - mtime > self.RENOVAR_USO:
+            try:
+                os.utime(caminho, (agora, agora))
+            except FileNotFoundError:
+                pass
+
+    def _registrar(self, tamanho):
+        """Soma um arquivo gravado e, se a estimativa pedir, despeja pela listagem da pasta"""
+        with self._lock:
+            agora = time.time()
+            if self._total is not None:
+                self._total += tamanho
+                self._gravado += tamanho
+                if (self._total <= self.tamanho_max
+                        and self._gravado <= self.tamanho_max * self.NOVA_LISTAGEM
+                        and agora - self._listado_em <= self.INTERVALO_LISTAGEM):
+                    return
+
+            entradas = self._listar()
+            total = sum(tamanho for _, _, tamanho in entradas)
+            despejar = []
+            if total > self.tamanho_max:
+                alvo = self.tamanho_max * self.TAMANHO_APOS_DESPEJO
+                # O mais recente fica mesmo se sozinho passar do limite
+                for _, nome, tamanho_antigo in entradas[:-1]:
+                    if total <= alvo:
+                        break
+                    despejar.append(nome)
+                    total -= tamanho_antigo
+            self._total = total
+            self._gravado = 0
+            self._listado_em = agora
+
+        for antigo in despejar:
+            try:
+                os.remove(os.path.join(self.pasta, antigo))
+            except FileNotFoundError:
+                pass
+
+    def _gravar(self, nome, dados):
+        # Temporário + rename: quem lê nunca vê arquivo pela metade
+        os.makedirs(self.pasta, exist_ok=True)
+        fd, temporario = tempfile.mkstemp(dir=self.pasta, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(dados)
+            os.replace(temporario, os.path.join(self.pasta, nome))
+        except Exception:
+            os.unlink(temporario)
+            raise
+
+    def obter(self, codigo, formato='png'):
+        """Caminho do arquivo do QR Code, renderizando agora se não estiver no cache"""
+        nome = nome_arquivo(codigo, formato)
+        caminho = os.path.join(self.pasta, nome)
+        try:
+            info = os.stat(caminho)
+        except OSError:
+            dados = renderizar(codigo, formato)
+            self._gravar(nome, dados)
+            self._registrar(len(dados))
+        else:
+            self._renovar(caminho, info.st_mtime)
+        return caminho
+
+    def guardar(self, codigo, formato, dados):
+        """Grava um QR Code já renderizado (ex.: num pool de processos) contando no limite"""
+        nome = nome_arquivo(codigo, formato)
+        self._gravar(nome, dados)
+        self._registrar(len(dados))
+
+    def agendar(self, codigo, formato='png'):
+        """Renderiza em segundo plano, se ainda não estiver no cache nem na fila"""
+        nome = nome_arquivo(codigo, formato)
+        if os.path.exists(os.path.join(self.pasta, nome)):
+            return
+        with self._lock:
+            if nome in self._pendentes:
+                return
+            self._pendentes.add(nome)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.trabalhadores, thread_name_prefix='qrcode'
+                )
+        self._executor.submit(self._renderizar_agendado, codigo, formato, nome)
+
+    def aguardar(self):
+        """Espera as renderizações agendadas (testes e benchmark)"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _renderizar_agendado(self, codigo, formato, nome):
+        try:
+            self.obter(codigo, formato)
+        except Exception as e:
+            print(f"❌ Erro ao gerar QR Code {codigo}: {e}")
+        finally:
+            with self._lock:
+                self._pendentes.discard(nome)
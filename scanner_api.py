@@ -5,14 +5,28 @@ Sistema funcional com detecção por código digitado manualmente
 
 from flask import Flask, request, jsonify, render_template, session
 from functools import wraps
+import atexit
 import sqlite3
-import base64
-import hashlib
 import os
-import random
-import string
 import re
+import threading
 from datetime import datetime
+from indice_imagens import IndiceImagens, hash_para_texto, criar_versao_imagens, calcular_hashes_faltantes
+from imagem_recebida import ImagemRecebida, ImagemInvalida, ler_imagem_binaria
+from leitor_qrcode import ler_qrcode_limitado
+from banco_dados import PoolConexoes, abrir_conexao, conexao_da_requisicao, registrar_pool
+from codigos import AlocadorCodigos, criar_tabela as criar_tabela_codigos
+from cache_produtos import CacheProdutos
+from metricas import Metricas, registrar_metricas
+from administradores import eh_admin, ler_admins
+from etapas import etapa, medir_etapas
+from consultas_lentas import ORDENS as ORDENS_CONSULTAS, RegistroConsultas
+from migracoes import migrar
+from movimentos import (MovimentoInvalido, ProdutoNaoEncontrado, EstoqueInsuficiente, ler_movimentos,
+                        aplicar_movimentos, executar_movimentos, criar_tabela as criar_tabela_movimentos)
+from escrita_agrupada import EscritaAgrupada, EscritaInterrompida, FilaCheia
+from listagem import (ParametrosInvalidos, ler_parametros, buscar_pagina, criar_indices, sem_conversao,
+                      pediu_stream, gerar_ndjson, resposta_ndjson)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'chave_secreta_desenvolvimento_123')
@@ -22,10 +36,41 @@ DATABASE = 'scanner_produtos.db'
 UPLOAD_FOLDER = 'static/produtos_imagens'
 MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
+DISTANCIA_IMAGEM_MAX = 10  # bits de diferença aceitos no dHash (0-64)
+app.config['REQUISICOES_LENTAS_MS'] = 500  # escaneamentos/cadastros acima disso vão para o log
+app.config['LOG_REQUISICOES_LENTAS'] = 'requisicoes_lentas.jsonl'  # JSON-lines com o tempo por etapa
 
 # Criar pasta de uploads
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Índice de hashes perceptuais das imagens cadastradas
+indice_imagens = IndiceImagens()
+
+# Conexões reaproveitadas entre requisições (WAL, busy timeout)
+pool_conexoes = PoolConexoes(DATABASE)
+registrar_pool(app, pool_conexoes)
+app.config['ADMINS'] = ler_admins()  # nomes de usuário; vazio: ninguém (ver administradores.py)
+
+# Latência, erros e consultas SQL por rota, somados entre workers (rota /metrics, só token ou admin)
+METRICAS_FOLDER = os.environ.get('METRICAS_DIR', 'metricas')
+metricas = Metricas('scanner_api', METRICAS_FOLDER)
+registrar_metricas(app, metricas, pool_conexoes, 'username')
+
+# Consultas acima do limite vão para o log com o EXPLAIN QUERY PLAN; estatísticas em /api/admin/consultas
+CONSULTAS_LENTAS_MS = 50
+registro_consultas = RegistroConsultas(CONSULTAS_LENTAS_MS, 'consultas_lentas.jsonl')
+registro_consultas.instalar(pool_conexoes)
+alocador_codigos = AlocadorCodigos(DATABASE)
+
+# Produtos mais consultados em memória (por id e código); cada gravação invalida o seu
+cache_produtos = CacheProdutos()
+
+# Movimentos do coletor gravados em grupo por uma thread (ver escrita_agrupada.py)
+app.config['ESCRITA_AGRUPADA'] = os.environ.get('ESCRITA_AGRUPADA') == '1'  # movimentos respondem 202
+escrita_agrupada = EscritaAgrupada(DATABASE)
+atexit.register(escrita_agrupada.fechar)  # grava o que estiver na fila ao desligar
+ESPERA_LEITURA = 5.0  # segundos que uma leitura (ou ?aguardar=1) espera os movimentos pendentes
+
 
 # ========================================================================
 # FUNÇÕES AUXILIARES
@@ -41,76 +86,31 @@ def sanitize_input(text, max_length=200):
 
 
 def gerar_codigo_produto():
-    """Gera código único de 6 dígitos"""
-    conn = get_db_connection()
-    while True:
-        codigo = ''.join(random.choices(string.digits, k=6))
-        existe = conn.execute("SELECT id FROM produtos WHERE codigo = ?", (codigo,)).fetchone()
-        if not existe:
-            break
-    conn.close()
-    return codigo
+    """Próximo código livre de 6 dígitos (ver codigos.py)"""
+    return alocador_codigos.proximo()
 
 
 def validar_base64_imagem(base64_string):
-    """Valida se é uma imagem base64 válida"""
+    """
+    Decodifica e valida a imagem base64 (uma única decodificação por requisição)
+    Retorna (ImagemRecebida, "valid") ou (None, mensagem de erro)
+    """
     try:
-        if not base64_string:
-            return False, "Imagem vazia"
-        
-        # Remove prefixo data:image
-        if ',' in base64_string:
-            header, data = base64_string.split(',', 1)
-            # Valida tipo MIME
-            if not any(mime in header for mime in ['image/jpeg', 'image/png', 'image/jpg', 'image/gif']):
-                return False, "Tipo de imagem não permitido. Use JPEG, PNG ou GIF"
-        else:
-            data = base64_string
-        
-        # Decodifica
-        img_bytes = base64.b64decode(data)
-        
-        # Valida tamanho
-        if len(img_bytes) > MAX_IMAGE_SIZE:
-            return False, f"Imagem muito grande. Máximo: {MAX_IMAGE_SIZE / 1024 / 1024}MB"
-        
-        # Valida assinatura (magic bytes)
-        if img_bytes[:2] == b'\xff\xd8':  # JPEG
-            return True, "valid"
-        elif img_bytes[:8] == b'\x89PNG\r\n\x1a\n':  # PNG
-            return True, "valid"
-        elif img_bytes[:6] in (b'GIF87a', b'GIF89a'):  # GIF
-            return True, "valid"
-        else:
-            return False, "Formato de imagem inválido"
-            
+        return ImagemRecebida.de_base64(base64_string, MAX_IMAGE_SIZE), "valid"
+    except ImagemInvalida as e:
+        return None, str(e)
     except Exception as e:
-        return False, f"Erro ao validar imagem: {str(e)}"
+        return None, f"Erro ao validar imagem: {str(e)}"
 
 
-def salvar_imagem(base64_string, codigo):
-    """Salva imagem em arquivo e retorna caminho"""
+def salvar_imagem(imagem, codigo):
+    """Salva imagem já decodificada em arquivo e retorna caminho"""
     try:
-        if ',' in base64_string:
-            base64_string = base64_string.split(',', 1)[1]
-        
-        img_bytes = base64.b64decode(base64_string)
-        
-        # Detecta extensão
-        if img_bytes[:2] == b'\xff\xd8':
-            ext = 'jpg'
-        elif img_bytes[:8] == b'\x89PNG\r\n\x1a\n':
-            ext = 'png'
-        elif img_bytes[:6] in (b'GIF87a', b'GIF89a'):
-            ext = 'gif'
-        else:
-            ext = 'jpg'
-        
-        filename = f"{codigo}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{ext}"
+        filename = f"{codigo}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{imagem.extensao}"
         filepath = os.path.join(UPLOAD_FOLDER, filename)
         
-        with open(filepath, 'wb') as f:
-            f.write(img_bytes)
+        with etapa('disco'), open(filepath, 'wb') as f:
+            f.write(imagem.dados)
         
         return filename
         
@@ -120,15 +120,12 @@ def salvar_imagem(base64_string, codigo):
 
 
 def get_db_connection():
-    """Retorna conexão com o banco de dados"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Retorna a conexão da requisição atual (do pool, devolvida no teardown)"""
+    return conexao_da_requisicao(pool_conexoes)
 
 
-def init_database():
-    """Inicializa banco de dados com índices otimizados"""
-    conn = sqlite3.connect(DATABASE)
+def migracao_esquema_inicial(conn):
+    """Versão 1: tabelas, índices otimizados e usuário padrão (bancos antigos ganham só o que faltar)"""
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -151,24 +148,76 @@ def init_database():
             categoria TEXT DEFAULT 'Geral',
             imagem_path TEXT,
             criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            imagem_dhash TEXT
         )
     """)
     
+    # Bancos criados antes do índice de imagens não têm a coluna do hash
+    colunas = [row[1] for row in cursor.execute("PRAGMA table_info(produtos)").fetchall()]
+    if 'imagem_dhash' not in colunas:
+        cursor.execute("ALTER TABLE produtos ADD COLUMN imagem_dhash TEXT")
+    
     # Criar índices para otimização
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_produto_codigo ON produtos(codigo)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_produto_nome ON produtos(nome)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_produto_categoria ON produtos(categoria)")
+    # idx_produto_categoria_nome (de criar_indices) cobre o antigo índice só de categoria
+    cursor.execute("DROP INDEX IF EXISTS idx_produto_categoria")
+    criar_indices(cursor)
+    criar_tabela_codigos(cursor)
+    criar_tabela_movimentos(cursor)
     
     # Criar usuário padrão se não existir
     cursor.execute("SELECT id FROM usuarios WHERE username = 'admin'")
     if not cursor.fetchone():
         cursor.execute("INSERT INTO usuarios (username, password) VALUES (?, ?)", 
                       ('admin', 'admin123'))
-    
-    conn.commit()
-    conn.close()
-    print("✅ Banco de dados inicializado com índices otimizados!")
+
+
+def migracao_versao_imagens(conn):
+    """Versão 2: imagem_versao (sincroniza o índice de imagens entre workers) e hashes que faltavam"""
+    criar_versao_imagens(conn.cursor())
+    calculados = calcular_hashes_faltantes(conn, UPLOAD_FOLDER)
+    if calculados:
+        print(f"✅ Hash perceptual calculado para {calculados} imagens")
+
+
+def migracao_indice_quantidade(conn):
+    """Versão 3: índice (categoria, quantidade) da listagem com categoria e faixa de quantidade"""
+    criar_indices(conn.cursor())
+
+
+# Versão do esquema = posição na lista (PRAGMA user_version); ver migracoes.py
+MIGRACOES = [
+    migracao_esquema_inicial,
+    migracao_versao_imagens,
+    migracao_indice_quantidade,
+]
+
+
+def init_database():
+    """Aplica as migrações pendentes (banco em dia: só lê PRAGMA user_version)"""
+    conn = abrir_conexao(DATABASE)
+    try:
+        if migrar(conn, MIGRACOES):
+            print("✅ Banco de dados inicializado com índices otimizados!")
+    finally:
+        conn.close()
+
+
+# Nada de banco ao importar: preparado na primeira requisição de cada worker
+_banco_pronto = False
+_lock_banco = threading.Lock()
+
+
+@app.before_request
+def preparar_banco():
+    global _banco_pronto
+    if _banco_pronto:
+        return
+    with _lock_banco:
+        if not _banco_pronto:
+            init_database()
+            _banco_pronto = True
 
 
 # ========================================================================
@@ -201,7 +250,6 @@ def login():
         "SELECT * FROM usuarios WHERE username = ? AND password = ?",
         (username, password)
     ).fetchone()
-    conn.close()
     
     if user:
         session['user_id'] = user['id']
@@ -232,55 +280,90 @@ def index():
     return render_template('scanner_interface.html')
 
 
-def comparar_imagens(imagem1_base64, imagem2_path):
+def buscar_produto_por_imagem(conn, imagem):
     """
-    Compara duas imagens para verificar se são do mesmo produto
-    Retorna True se forem similares
+    Busca o produto com a imagem mais parecida pelo índice de hashes perceptuais
+    Retorna a linha do produto ou None
     """
+    indice_imagens.sincronizar(conn)
+    
     try:
-        # Decodifica imagem capturada
-        if ',' in imagem1_base64:
-            imagem1_base64 = imagem1_base64.split(',', 1)[1]
-        img1_bytes = base64.b64decode(imagem1_base64)
-        
-        # Lê imagem cadastrada
-        with open(os.path.join(UPLOAD_FOLDER, imagem2_path), 'rb') as f:
-            img2_bytes = f.read()
-        
-        # Comparação básica: hash das imagens
-        # Em produção: usar OpenCV, PIL para comparação mais avançada
-        hash1 = hashlib.md5(img1_bytes).hexdigest()
-        hash2 = hashlib.md5(img2_bytes).hexdigest()
-        
-        # Se hashes idênticos (mesma imagem exata)
-        if hash1 == hash2:
-            return True
-        
-        # Comparação por tamanho similar (tolerância de 10%)
-        size1 = len(img1_bytes)
-        size2 = len(img2_bytes)
-        
-        if abs(size1 - size2) / max(size1, size2) < 0.1:
-            # Compara primeiros bytes (cabeçalho similar)
-            if img1_bytes[:100] == img2_bytes[:100]:
-                return True
-        
-        return False
-        
+        dhash = imagem.dhash
     except Exception as e:
-        print(f"Erro ao comparar imagens: {e}")
-        return False
+        print(f"Erro ao calcular hash da imagem: {e}")
+        metricas.incrementar('comparacoes_imagem_total', resultado='erro')
+        return None
+    
+    for distancia, produto_id in indice_imagens.buscar(dhash, DISTANCIA_IMAGEM_MAX):
+        produto = conn.execute("SELECT * FROM produtos WHERE id = ?", (produto_id,)).fetchone()
+        if produto and produto['imagem_path']:
+            metricas.incrementar('comparacoes_imagem_total', resultado='encontrado')
+            return produto
+        # Produto deletado (possivelmente por outro processo)
+        indice_imagens.remover(produto_id)
+    
+    metricas.incrementar('comparacoes_imagem_total', resultado='nao_encontrado')
+    return None
+
+
+def escanear_por_imagem(imagem, imagem_capturada=None):
+    """
+    Núcleo do escaneamento, comum às rotas JSON e binária
+    Tenta primeiro ler um QR Code do frame; só sem QR Code compara imagens
+    Retorna (corpo da resposta, status HTTP)
+    """
+    with etapa('qrcode'):
+        codigo, resultado = ler_qrcode_limitado(imagem.dados)
+    metricas.incrementar('leituras_qrcode_total', resultado=resultado)
+    
+    conn = get_db_connection()
+    if codigo:
+        codigo = codigo.strip()
+        produto, _ = cache_produtos.buscar_por_codigo(conn, codigo)
+    else:
+        # Busca o produto mais parecido no índice de hashes
+        produto = buscar_produto_por_imagem(conn, imagem)
+    
+    if produto:
+        # PRODUTO ENCONTRADO!
+        return {
+            "status": "encontrado",
+            "mensagem": f"✅ Produto '{produto['nome']}' identificado via câmera!",
+            "produto": {
+                "id": produto['id'],
+                "codigo": produto['codigo'],
+                "nome": produto['nome'],
+                "localizacao": produto['localizacao'],
+                "quantidade": produto['quantidade'],
+                "preco": float(produto['preco']),
+                "categoria": produto['categoria'],
+                "imagem_url": f"/static/produtos_imagens/{produto['imagem_path']}"
+            }
+        }, 200
+    
+    # PRODUTO NÃO ENCONTRADO
+    corpo = {
+        "status": "nao_encontrado",
+        "alerta": "⚠️ PRODUTO NÃO CADASTRADO!",
+        "mensagem": "Este produto não foi encontrado no sistema. Cadastre-o agora.",
+        "imagem_capturada": imagem_capturada
+    }
+    if codigo:
+        corpo["codigo_detectado"] = codigo
+    return corpo, 200
 
 
 @app.route('/api/scan', methods=['POST'])
 @login_required
+@medir_etapas
 def scan_produto():
     """
     Escaneia produto via CÂMERA
     Entrada: {"imagem": "data:image/jpeg;base64,..."}
     """
     try:
-        data = request.get_json()
+        with etapa('corpo'):
+            data = request.get_json()
         
         if not data or 'imagem' not in data:
             return jsonify({
@@ -290,60 +373,119 @@ def scan_produto():
         
         imagem_capturada = data['imagem']
         
-        # Valida imagem
-        valido, msg = validar_base64_imagem(imagem_capturada)
-        if not valido:
+        # Valida imagem (decodificada uma única vez)
+        imagem, msg = validar_base64_imagem(imagem_capturada)
+        if not imagem:
             return jsonify({
                 "status": "erro",
                 "mensagem": f"Imagem inválida: {msg}"
             }), 400
         
-        # Busca todos produtos com imagem cadastrada
-        conn = get_db_connection()
-        produtos = conn.execute(
-            "SELECT * FROM produtos WHERE imagem_path IS NOT NULL"
-        ).fetchall()
-        conn.close()
+        corpo, status = escanear_por_imagem(imagem, imagem_capturada)
+        with etapa('serializacao'):
+            resposta = jsonify(corpo)
+        return resposta, status
         
-        # Compara imagem capturada com cada produto cadastrado
-        for produto in produtos:
-            if comparar_imagens(imagem_capturada, produto['imagem_path']):
-                # PRODUTO ENCONTRADO!
-                return jsonify({
-                    "status": "encontrado",
-                    "mensagem": f"✅ Produto '{produto['nome']}' identificado via câmera!",
-                    "produto": {
-                        "id": produto['id'],
-                        "codigo": produto['codigo'],
-                        "nome": produto['nome'],
-                        "localizacao": produto['localizacao'],
-                        "quantidade": produto['quantidade'],
-                        "preco": float(produto['preco']),
-                        "categoria": produto['categoria'],
-                        "imagem_url": f"/static/produtos_imagens/{produto['imagem_path']}"
-                    }
-                }), 200
-        
-        # PRODUTO NÃO ENCONTRADO
-        return jsonify({
-            "status": "nao_encontrado",
-            "alerta": "⚠️ PRODUTO NÃO CADASTRADO!",
-            "mensagem": "Este produto não foi encontrado no sistema. Cadastre-o agora.",
-            "imagem_capturada": imagem_capturada
-        }), 200
+    except Exception as e:
+        return jsonify({"status": "erro", "mensagem": f"Erro ao escanear: {str(e)}"}), 500
+
+
+@app.route('/api/scan/binario', methods=['POST'])
+@login_required
+@medir_etapas
+def scan_produto_binario():
+    """
+    Escaneia produto com o frame em binário (sem base64)
+    Entrada: multipart/form-data (arquivo "imagem") ou application/octet-stream
+    Mesma resposta do /api/scan; "imagem_capturada" não é devolvida (null)
+    """
+    try:
+        imagem, _ = ler_imagem_binaria(request, MAX_IMAGE_SIZE)
+        
+        if imagem is None:
+            return jsonify({
+                "status": "erro",
+                "mensagem": "Imagem da câmera não fornecida"
+            }), 400
+        
+        corpo, status = escanear_por_imagem(imagem)
+        with etapa('serializacao'):
+            resposta = jsonify(corpo)
+        return resposta, status
         
+    except ImagemInvalida as e:
+        return jsonify({"status": "erro", "mensagem": f"Imagem inválida: {str(e)}"}), 400
     except Exception as e:
         return jsonify({"status": "erro", "mensagem": f"Erro ao escanear: {str(e)}"}), 500
 
 
+def cadastrar_com_imagem(data, imagem):
+    """
+    Núcleo do cadastro, comum às rotas JSON e binária
+    Retorna (corpo da resposta, status HTTP)
+    """
+    # Sanitização de inputs
+    nome = sanitize_input(data['nome'], 200)
+    localizacao = sanitize_input(data['localizacao'], 200)
+    quantidade = int(data['quantidade'])
+    preco = float(data.get('preco', 0.0))
+    categoria = sanitize_input(data.get('categoria', 'Geral'), 50)
+    
+    # Validações
+    if not nome or not localizacao:
+        return {"status": "erro", "mensagem": "Nome e localização não podem estar vazios"}, 400
+    
+    if quantidade < 0:
+        return {"status": "erro", "mensagem": "Quantidade não pode ser negativa"}, 400
+    
+    if preco < 0:
+        return {"status": "erro", "mensagem": "Preço não pode ser negativo"}, 400
+    
+    # Hash perceptual para o escaneamento por imagem
+    try:
+        dhash = imagem.dhash
+    except Exception as e:
+        return {"status": "erro", "mensagem": f"Imagem inválida: {str(e)}"}, 400
+    
+    # Só agora: um cadastro recusado não gasta código
+    codigo = gerar_codigo_produto()
+    imagem_path = salvar_imagem(imagem, codigo)
+    if not imagem_path:
+        return {"status": "erro", "mensagem": "Erro ao salvar imagem da câmera"}, 500
+    
+    # Inserir no banco
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        INSERT INTO produtos (codigo, nome, localizacao, quantidade, preco, categoria, imagem_path, imagem_dhash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (codigo, nome, localizacao, quantidade, preco, categoria, imagem_path, hash_para_texto(dhash)))
+    
+    produto_id = cursor.lastrowid
+    conn.commit()
+    
+    indice_imagens.adicionar(produto_id, dhash)
+    
+    return {
+        "status": "sucesso",
+        "mensagem": f"✅ Produto '{nome}' cadastrado com foto!",
+        "produto_id": produto_id,
+        "codigo": codigo,
+        "instrucao": "Aponte a câmera para este produto novamente para testá-lo!"
+    }, 201
+
+
 @app.route('/api/cadastrar', methods=['POST'])
 @login_required
+@medir_etapas
 def cadastrar_produto():
     """
     Cadastra novo produto com imagem obrigatória da câmera
     """
     try:
-        data = request.get_json()
+        with etapa('corpo'):
+            data = request.get_json()
         
         # Validação de campos obrigatórios (INCLUINDO IMAGEM)
         campos_obrigatorios = ['nome', 'localizacao', 'quantidade', 'imagem_base64']
@@ -353,54 +495,48 @@ def cadastrar_produto():
                 "mensagem": "Campos obrigatórios: nome, localizacao, quantidade e imagem_base64 (da câmera)"
             }), 400
         
-        # Sanitização de inputs
-        nome = sanitize_input(data['nome'], 200)
-        localizacao = sanitize_input(data['localizacao'], 200)
-        quantidade = int(data['quantidade'])
-        preco = float(data.get('preco', 0.0))
-        categoria = sanitize_input(data.get('categoria', 'Geral'), 50)
-        codigo = gerar_codigo_produto()
-        
-        # Validações
-        if not nome or not localizacao:
-            return jsonify({"status": "erro", "mensagem": "Nome e localização não podem estar vazios"}), 400
-        
-        if quantidade < 0:
-            return jsonify({"status": "erro", "mensagem": "Quantidade não pode ser negativa"}), 400
-        
-        if preco < 0:
-            return jsonify({"status": "erro", "mensagem": "Preço não pode ser negativo"}), 400
-        
-        # Validar e salvar imagem (OBRIGATÓRIA)
-        valido, msg = validar_base64_imagem(data['imagem_base64'])
-        if not valido:
+        # Validar imagem (OBRIGATÓRIA)
+        imagem, msg = validar_base64_imagem(data['imagem_base64'])
+        if not imagem:
             return jsonify({"status": "erro", "mensagem": f"Imagem inválida: {msg}"}), 400
         
-        imagem_path = salvar_imagem(data['imagem_base64'], codigo)
-        if not imagem_path:
-            return jsonify({"status": "erro", "mensagem": "Erro ao salvar imagem da câmera"}), 500
-        
-        # Inserir no banco
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        corpo, status = cadastrar_com_imagem(data, imagem)
+        with etapa('serializacao'):
+            resposta = jsonify(corpo)
+        return resposta, status
         
-        cursor.execute("""
-            INSERT INTO produtos (codigo, nome, localizacao, quantidade, preco, categoria, imagem_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (codigo, nome, localizacao, quantidade, preco, categoria, imagem_path))
+    except ValueError as e:
+        return jsonify({"status": "erro", "mensagem": "Quantidade e preço devem ser números válidos"}), 400
+    except Exception as e:
+        return jsonify({"status": "erro", "mensagem": f"Erro ao cadastrar: {str(e)}"}), 500
+
+
+@app.route('/api/cadastrar/binario', methods=['POST'])
+@login_required
+@medir_etapas
+def cadastrar_produto_binario():
+    """
+    Cadastra novo produto com a foto em binário (sem base64)
+    Entrada: multipart/form-data (arquivo "imagem" + campos no formulário)
+    ou application/octet-stream (corpo = imagem, campos na query string)
+    """
+    try:
+        imagem, data = ler_imagem_binaria(request, MAX_IMAGE_SIZE)
         
-        produto_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        campos_obrigatorios = ['nome', 'localizacao', 'quantidade']
+        if imagem is None or not all(k in data for k in campos_obrigatorios):
+            return jsonify({
+                "status": "erro",
+                "mensagem": "Campos obrigatórios: nome, localizacao, quantidade e imagem (da câmera)"
+            }), 400
         
-        return jsonify({
-            "status": "sucesso",
-            "mensagem": f"✅ Produto '{nome}' cadastrado com foto!",
-            "produto_id": produto_id,
-            "codigo": codigo,
-            "instrucao": "Aponte a câmera para este produto novamente para testá-lo!"
-        }), 201
+        corpo, status = cadastrar_com_imagem(data, imagem)
+        with etapa('serializacao'):
+            resposta = jsonify(corpo)
+        return resposta, status
         
+    except ImagemInvalida as e:
+        return jsonify({"status": "erro", "mensagem": f"Imagem inválida: {str(e)}"}), 400
     except ValueError as e:
         return jsonify({"status": "erro", "mensagem": "Quantidade e preço devem ser números válidos"}), 400
     except Exception as e:
@@ -422,7 +558,6 @@ def atualizar_produto(produto_id):
         # Verifica se produto existe
         produto = cursor.execute("SELECT * FROM produtos WHERE id = ?", (produto_id,)).fetchone()
         if not produto:
-            conn.close()
             return jsonify({"status": "erro", "mensagem": "Produto não encontrado"}), 404
         
         # Atualiza campos fornecidos
@@ -453,14 +588,13 @@ def atualizar_produto(produto_id):
         params.append(datetime.now())
         
         if not updates:
-            conn.close()
             return jsonify({"status": "erro", "mensagem": "Nenhum campo para atualizar"}), 400
         
         params.append(produto_id)
         
         cursor.execute(f"UPDATE produtos SET {', '.join(updates)} WHERE id = ?", params)
         conn.commit()
-        conn.close()
+        cache_produtos.invalidar(produto_id)
         
         return jsonify({
             "status": "sucesso",
@@ -473,34 +607,114 @@ def atualizar_produto(produto_id):
         return jsonify({"status": "erro", "mensagem": f"Erro ao atualizar: {str(e)}"}), 500
 
 
+def invalidar_movimentados(aplicados):
+    cache_produtos.invalidar(*{movimento['produto_id'] for movimento in aplicados})
+
+
+def avisar_movimento_recusado(futuro):
+    if futuro.exception() is not None:
+        print(f"❌ Movimento recusado na escrita agrupada: {futuro.exception()}")
+
+
+def registrar_movimentos(produto_id=None):
+    """
+    Aplica os movimentos do corpo JSON (ver movimentos.py) e monta a resposta
+    Na escrita agrupada vão para a fila: 202, ou o resultado depois do commit com ?aguardar=1
+    """
+    usuario = session.get('username')
+    try:
+        movimentos = ler_movimentos(request.get_json(silent=True), produto_id)
+        if app.config['ESCRITA_AGRUPADA']:
+            futuro = escrita_agrupada.enviar(
+                lambda conn: executar_movimentos(conn, movimentos, usuario), sessao=usuario,
+                ao_confirmar=invalidar_movimentados
+            )
+            if request.args.get('aguardar') != '1':
+                futuro.add_done_callback(avisar_movimento_recusado)
+                return jsonify({"status": "aceito", "total": len(movimentos)}), 202
+            aplicados = futuro.result(timeout=ESPERA_LEITURA)
+        else:
+            aplicados = aplicar_movimentos(get_db_connection(), movimentos, usuario)
+            invalidar_movimentados(aplicados)
+    except FilaCheia as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 503, {"Retry-After": "1"}
+    except TimeoutError:
+        # Continua na fila: repetir o movimento poderia aplicá-lo duas vezes
+        return jsonify({"status": "erro", "mensagem": "Movimento ainda não confirmado pela escrita agrupada; "
+                                                      "confira o estoque antes de repetir"}), 503
+    except EscritaInterrompida as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 503, {"Retry-After": "1"}
+    except MovimentoInvalido as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 400
+    except ProdutoNaoEncontrado as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 404
+    except EstoqueInsuficiente as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 409
+    except Exception as e:
+        return jsonify({"status": "erro", "mensagem": f"Erro ao registrar movimento: {str(e)}"}), 500
+    
+    return jsonify({"status": "sucesso", "total": len(aplicados), "movimentos": aplicados}), 200
+
+
+@app.route('/api/produto/<int:produto_id>/movimento', methods=['POST'])
+@login_required
+def movimentar_produto(produto_id):
+    """
+    Entrada ou saída por diferença ({"delta": -3}), somada no banco: dois
+    separadores no mesmo produto não sobrescrevem um ao outro como no PUT
+    """
+    return registrar_movimentos(produto_id)
+
+
+@app.route('/api/movimentos', methods=['POST'])
+@login_required
+def movimentar_lote():
+    """Lote de movimentos de vários produtos numa transação (tudo ou nada)"""
+    return registrar_movimentos()
+
+
+@app.before_request
+def aguardar_escritas_da_sessao():
+    """Escrita agrupada: cada requisição vê os movimentos que a própria sessão ainda tem na fila"""
+    if (app.config['ESCRITA_AGRUPADA'] and 'username' in session
+            and request.endpoint not in ('movimentar_produto', 'movimentar_lote')):
+        escrita_agrupada.aguardar_sessao(session['username'], timeout=ESPERA_LEITURA)
+
+
+# Campos aceitos em fields=: nome no JSON -> (coluna, conversor)
+CAMPOS_PRODUTO = {
+    "id": ("id", sem_conversao),
+    "codigo": ("codigo", sem_conversao),
+    "nome": ("nome", sem_conversao),
+    "localizacao": ("localizacao", sem_conversao),
+    "quantidade": ("quantidade", sem_conversao),
+    "preco": ("preco", float),
+    "categoria": ("categoria", sem_conversao),
+    "imagem_url": ("imagem_path", lambda path: f"/static/produtos_imagens/{path}" if path else None),
+}
+
+
 @app.route('/api/produtos', methods=['GET'])
 @login_required
 def listar_produtos():
-    """Lista todos produtos"""
+    """Lista produtos paginados por cursor (limit, cursor, fields, categoria, quantidade_min/max) ou em NDJSON (stream=1)"""
     try:
-        conn = get_db_connection()
-        produtos = conn.execute(
-            "SELECT * FROM produtos ORDER BY nome"
-        ).fetchall()
-        conn.close()
-        
-        lista = [{
-            "id": p['id'],
-            "codigo": p['codigo'],
-            "nome": p['nome'],
-            "localizacao": p['localizacao'],
-            "quantidade": p['quantidade'],
-            "preco": float(p['preco']),
-            "categoria": p['categoria'],
-            "imagem_url": f"/static/produtos_imagens/{p['imagem_path']}" if p['imagem_path'] else None
-        } for p in produtos]
+        stream = pediu_stream(request)
+        parametros = ler_parametros(request.args, CAMPOS_PRODUTO, CAMPOS_PRODUTO, stream)
+        if stream:
+            return resposta_ndjson(gerar_ndjson(pool_conexoes, CAMPOS_PRODUTO, parametros))
+
+        lista, proximo_cursor = buscar_pagina(get_db_connection(), CAMPOS_PRODUTO, parametros)
         
         return jsonify({
             "status": "sucesso",
             "total": len(lista),
-            "produtos": lista
+            "produtos": lista,
+            "proximo_cursor": proximo_cursor
         }), 200
         
+    except ParametrosInvalidos as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "erro", "mensagem": f"Erro: {str(e)}"}), 500
 
@@ -508,28 +722,33 @@ def listar_produtos():
 @app.route('/api/produto/<int:produto_id>', methods=['GET'])
 @login_required
 def obter_produto(produto_id):
-    """Obtém produto específico"""
+    """Obtém produto específico (304 se If-None-Match for a ETag atual)"""
     try:
-        conn = get_db_connection()
-        produto = conn.execute("SELECT * FROM produtos WHERE id = ?", (produto_id,)).fetchone()
-        conn.close()
+        produto, etag = cache_produtos.buscar_por_id(get_db_connection(), produto_id)
         
         if not produto:
             return jsonify({"status": "erro", "mensagem": "Produto não encontrado"}), 404
         
-        return jsonify({
-            "status": "sucesso",
-            "produto": {
-                "id": produto['id'],
-                "codigo": produto['codigo'],
-                "nome": produto['nome'],
-                "localizacao": produto['localizacao'],
-                "quantidade": produto['quantidade'],
-                "preco": float(produto['preco']),
-                "categoria": produto['categoria'],
-                "imagem_url": f"/static/produtos_imagens/{produto['imagem_path']}" if produto['imagem_path'] else None
-            }
-        }), 200
+        if request.if_none_match.contains(etag):
+            resposta = app.response_class(status=304)
+        else:
+            resposta = jsonify({
+                "status": "sucesso",
+                "produto": {
+                    "id": produto['id'],
+                    "codigo": produto['codigo'],
+                    "nome": produto['nome'],
+                    "localizacao": produto['localizacao'],
+                    "quantidade": produto['quantidade'],
+                    "preco": float(produto['preco']),
+                    "categoria": produto['categoria'],
+                    "imagem_url": f"/static/produtos_imagens/{produto['imagem_path']}" if produto['imagem_path'] else None
+                }
+            })
+        
+        resposta.set_etag(etag)
+        resposta.cache_control.no_cache = True
+        return resposta
         
     except Exception as e:
         return jsonify({"status": "erro", "mensagem": f"Erro: {str(e)}"}), 500
@@ -547,13 +766,14 @@ def deletar_produto(produto_id):
         produto = cursor.execute("SELECT imagem_path FROM produtos WHERE id = ?", (produto_id,)).fetchone()
         
         if not produto:
-            conn.close()
             return jsonify({"status": "erro", "mensagem": "Produto não encontrado"}), 404
         
         # Deleta do banco
         cursor.execute("DELETE FROM produtos WHERE id = ?", (produto_id,))
         conn.commit()
-        conn.close()
+        
+        cache_produtos.invalidar(produto_id)
+        indice_imagens.remover(produto_id)
         
         # Deleta arquivo de imagem se existir
         if produto['imagem_path']:
@@ -568,6 +788,40 @@ def deletar_produto(produto_id):
         return jsonify({"status": "erro", "mensagem": f"Erro: {str(e)}"}), 500
 
 
+@app.route('/api/admin/consultas', methods=['GET', 'DELETE'])
+@login_required
+def consultas_sql():
+    """
+    Estatísticas das consultas SQL deste processo, por SQL normalizado
+    Parâmetros: ordem (total, media, max, execucoes, lentas), limite
+    DELETE zera as estatísticas
+    """
+    if not eh_admin(session.get('username'), app.config['ADMINS']):
+        return jsonify({"status": "erro", "mensagem": "Acesso restrito ao administrador"}), 403
+    
+    if request.method == 'DELETE':
+        registro_consultas.limpar()
+        return jsonify({"status": "sucesso", "mensagem": "Estatísticas zeradas"}), 200
+    
+    ordem = request.args.get('ordem', 'total')
+    if ordem not in ORDENS_CONSULTAS:
+        return jsonify({"status": "erro", "mensagem": f"ordem deve ser uma de: {', '.join(ORDENS_CONSULTAS)}"}), 400
+    try:
+        limite = int(request.args.get('limite', 50))
+    except ValueError:
+        return jsonify({"status": "erro", "mensagem": "limite deve ser um número"}), 400
+    
+    consultas = registro_consultas.estatisticas(ordem, max(limite, 1))
+    return jsonify({
+        "status": "sucesso",
+        "pid": os.getpid(),
+        "limite_lenta_ms": registro_consultas.limite_ms,
+        "descartadas": registro_consultas.descartadas,
+        "varreduras_completas": sum(1 for c in consultas if c['varredura_completa']),
+        "consultas": consultas
+    }), 200
+
+
 # ========================================================================
 # DOCUMENTAÇÃO DA API
 # ========================================================================
@@ -593,6 +847,11 @@ def api_docs():
                 "entrada": {"codigo": "123456"},
                 "autenticacao": True
             },
+            "POST /api/scan/binario": {
+                "descricao": "Escaneia produto com a foto em binário (multipart ou octet-stream)",
+                "entrada": "multipart/form-data com o arquivo 'imagem' ou corpo image/jpeg",
+                "autenticacao": True
+            },
             "POST /api/cadastrar": {
                 "descricao": "Cadastra novo produto",
                 "entrada": {
@@ -605,8 +864,14 @@ def api_docs():
                 },
                 "autenticacao": True
             },
+            "POST /api/cadastrar/binario": {
+                "descricao": "Cadastra produto com a foto em binário",
+                "entrada": "multipart/form-data (arquivo 'imagem' + campos) ou octet-stream com campos na query string",
+                "autenticacao": True
+            },
             "GET /api/produtos": {
-                "descricao": "Lista todos produtos",
+                "descricao": "Lista produtos paginados por cursor",
+                "parametros": "limit, cursor, fields, categoria, quantidade_min, quantidade_max, stream=1 (NDJSON)",
                 "autenticacao": True
             },
             "GET /api/produto/<id>": {
@@ -620,6 +885,21 @@ def api_docs():
             "DELETE /api/produto/<id>": {
                 "descricao": "Deleta produto",
                 "autenticacao": True
+            },
+            "POST /api/produto/<id>/movimento": {
+                "descricao": "Entrada (delta > 0) ou saída (delta < 0) de estoque, somada no banco",
+                "entrada": {"delta": -3, "motivo": "separação", "referencia": "pedido 123"},
+                "autenticacao": True
+            },
+            "POST /api/movimentos": {
+                "descricao": "Lote de movimentos numa transação (tudo ou nada, até 1000)",
+                "entrada": {"movimentos": [{"produto_id": 1, "delta": 10}, {"codigo": "123456", "delta": -2}]},
+                "autenticacao": True
+            },
+            "GET /api/admin/consultas": {
+                "descricao": "Estatísticas por SQL normalizado, com EXPLAIN QUERY PLAN (só usuários em ADMINS; DELETE zera)",
+                "parametros": "ordem (total, media, max, execucoes, lentas), limite",
+                "autenticacao": True
             }
         },
         "usuario_padrao": {
@@ -639,15 +919,20 @@ if __name__ == '__main__':
     print("🔍 API DE SCANNER DE PRODUTOS - VERSÃO CORRIGIDA")
     print("="*70)
     
-    init_database()
+    preparar_banco()
     
     print("\n📡 API Endpoints:")
     print("  POST /api/login          - Login (admin/admin123)")
     print("  POST /api/scan           - Escanear por código")
     print("  POST /api/cadastrar      - Cadastrar produto")
+    print("  POST /api/scan/binario   - Escanear (foto multipart/octet-stream)")
+    print("  POST /api/cadastrar/binario - Cadastrar (foto multipart/octet-stream)")
     print("  GET  /api/produtos       - Listar produtos")
     print("  PUT  /api/produto/<id>   - Atualizar produto")
     print("  DELETE /api/produto/<id> - Deletar produto")
+    print("  POST /api/produto/<id>/movimento - Entrada/saída de estoque (delta)")
+    print("  POST /api/movimentos     - Lote de movimentos")
+    print("  GET  /api/admin/consultas - Estatísticas das consultas SQL (usuários em ADMINS)")
     print("  GET  /api/docs           - Documentação completa")
     
     print("\n🔐 Credenciais padrão:")
@@ -0,0 +1,205 @@
+"""
+Invalidação do cache de produtos (cache_produtos.py)
+
+As gravações num produto acontecem em módulos diferentes: rotas de edição
+e de movimento, a thread da escrita agrupada (escrita_agrupada.py) e a fila
+de normalização de imagens (normalizacao_imagens.py). Cada uma precisa
+tirar o produto do cache; se uma esquecer, GET /api/produto/<id> continua
+respondendo a linha antiga (e 304 para a ETag antiga) até o TTL.
+
+    python -m pytest test_cache_produtos.py
+"""
+
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from armazem_imagens import salvar_blob
+from cache_produtos import CacheProdutos
+
+
+def ler_etag(cliente, produto_id):
+    resposta = cliente.get(f'/api/produto/{produto_id}')
+    assert resposta.status_code == 200, resposta.get_json()
+    return resposta.headers['ETag']
+
+
+def confirmar_mudanca(cliente, produto_id, etag):
+    """A ETag antiga não vale mais e a nova é estável"""
+    resposta = cliente.get(f'/api/produto/{produto_id}', headers={'If-None-Match': etag})
+    assert resposta.status_code == 200
+    assert resposta.headers['ETag'] != etag
+    nova = cliente.get(f'/api/produto/{produto_id}', headers={'If-None-Match': resposta.headers['ETag']})
+    assert nova.status_code == 304
+    return resposta.get_json()
+
+
+def cadastrar(app_modulo, sql, valores):
+    conn = app_modulo.pool_conexoes.obter()
+    try:
+        produto_id = conn.execute(sql, valores).lastrowid
+        conn.commit()
+    finally:
+        app_modulo.pool_conexoes.devolver(conn)
+    return produto_id
+
+
+def produto_main(main, nome, **colunas):
+    colunas = {"nome": nome, "quantidade": 20, "preco": 1.5, "localizacao": "Z1", **colunas}
+    marcadores = ", ".join("?" * len(colunas))
+    return cadastrar(main, f"INSERT INTO produtos ({', '.join(colunas)}) VALUES ({marcadores})",
+                     list(colunas.values()))
+
+
+def produto_scanner(scanner_api, codigo):
+    return cadastrar(scanner_api, "INSERT INTO produtos (codigo, nome, localizacao, quantidade, preco, categoria) "
+                                  "VALUES (?, ?, 'Z1', 20, 1.5, 'Cache')", (codigo, codigo))
+
+
+def produto_novo(app_modulo, nome):
+    """Produto com estoque 20 no app, qualquer dos dois"""
+    if app_modulo.__name__ == 'main':
+        return produto_main(app_modulo, nome)
+    return produto_scanner(app_modulo, nome)
+
+
+@pytest.fixture(params=['main', 'scanner_api'])
+def app_e_produto(request):
+    """Cliente autenticado, módulo do app e um produto novo em cada um dos apps"""
+    cliente = request.getfixturevalue('cliente_main' if request.param == 'main' else 'cliente_scanner')
+    app_modulo = request.getfixturevalue(request.param)
+    return cliente, app_modulo, produto_novo(app_modulo, f"CACHE-{request.node.name}")
+
+
+@pytest.fixture
+def escrita_agrupada(app_e_produto):
+    _, app_modulo, _ = app_e_produto
+    app_modulo.app.config['ESCRITA_AGRUPADA'] = True
+    yield
+    app_modulo.escrita_agrupada.esvaziar()
+    app_modulo.app.config['ESCRITA_AGRUPADA'] = False
+
+
+# -----------------------------------------------------------
+# O CACHE EM SI
+# -----------------------------------------------------------
+
+def test_leitura_anterior_a_invalidacao_nao_volta_ao_cache():
+    cache = CacheProdutos()
+    versao = cache.versao()
+    cache.invalidar(1)  # gravação entre a consulta e o guardar()
+    produto, _ = cache.guardar({"id": 1, "codigo": "X1", "quantidade": 3}, versao)
+    assert produto['quantidade'] == 3
+    assert cache.por_id(1) is None and cache.por_codigo("X1") is None
+
+
+def test_invalidar_tira_do_indice_por_codigo():
+    cache = CacheProdutos()
+    _, etag = cache.guardar({"id": 1, "codigo": "X1", "quantidade": 3}, cache.versao())
+    assert cache.por_codigo("X1")[1] == etag
+    cache.invalidar(1)
+    assert cache.por_id(1) is None and cache.por_codigo("X1") is None
+
+    _, nova = cache.guardar({"id": 1, "codigo": "X1", "quantidade": 4}, cache.versao())
+    assert nova != etag
+
+
+# -----------------------------------------------------------
+# GRAVAÇÕES PELAS ROTAS E PELAS THREADS DE FUNDO
+# -----------------------------------------------------------
+
+def test_put_invalida(scanner_api, cliente_scanner):
+    produto_id = produto_scanner(scanner_api, "CACHE-PUT")
+    etag = ler_etag(cliente_scanner, produto_id)
+    assert scanner_api.cache_produtos.por_id(produto_id) is not None
+
+    resposta = cliente_scanner.put(f'/api/produto/{produto_id}', json={"localizacao": "Z9"})
+    assert resposta.status_code == 200
+    assert scanner_api.cache_produtos.por_id(produto_id) is None
+    assert confirmar_mudanca(cliente_scanner, produto_id, etag)['produto']['localizacao'] == "Z9"
+
+
+def test_movimento_invalida(app_e_produto):
+    cliente, app_modulo, produto_id = app_e_produto
+    etag = ler_etag(cliente, produto_id)
+
+    resposta = cliente.post(f'/api/produto/{produto_id}/movimento', json={"delta": -3})
+    assert resposta.status_code == 200
+    assert app_modulo.cache_produtos.por_id(produto_id) is None
+    assert confirmar_mudanca(cliente, produto_id, etag)['produto']['quantidade'] == 17
+
+
+def test_lote_de_movimentos_invalida_todos(app_e_produto):
+    cliente, app_modulo, produto_id = app_e_produto
+    outro_id = produto_novo(app_modulo, f"CACHE-lote-{app_modulo.__name__}")
+    etags = [ler_etag(cliente, produto_id), ler_etag(cliente, outro_id)]
+
+    resposta = cliente.post('/api/movimentos', json={"movimentos": [{"produto_id": produto_id, "delta": 2},
+                                                                     {"produto_id": outro_id, "delta": -1}]})
+    assert resposta.status_code == 200
+    assert confirmar_mudanca(cliente, produto_id, etags[0])['produto']['quantidade'] == 22
+    assert confirmar_mudanca(cliente, outro_id, etags[1])['produto']['quantidade'] == 19
+
+
+def test_movimento_recusado_mantem_etag(app_e_produto):
+    cliente, _, produto_id = app_e_produto
+    etag = ler_etag(cliente, produto_id)
+    assert cliente.post(f'/api/produto/{produto_id}/movimento', json={"delta": -100}).status_code == 409
+    assert cliente.get(f'/api/produto/{produto_id}', headers={'If-None-Match': etag}).status_code == 304
+
+
+@pytest.mark.usefixtures('escrita_agrupada')
+def test_movimento_da_escrita_agrupada_invalida(app_e_produto):
+    """O commit acontece na thread escritora, depois da resposta 202"""
+    cliente, app_modulo, produto_id = app_e_produto
+    etag = ler_etag(cliente, produto_id)
+
+    resposta = cliente.post(f'/api/produto/{produto_id}/movimento', json={"delta": -5})
+    assert resposta.status_code == 202
+    app_modulo.escrita_agrupada.esvaziar(timeout=5)
+    # Sem requisição no meio: quem tirou do cache foi a thread escritora
+    assert app_modulo.cache_produtos.por_id(produto_id) is None
+    assert confirmar_mudanca(cliente, produto_id, etag)['produto']['quantidade'] == 15
+
+
+@pytest.mark.usefixtures('escrita_agrupada')
+def test_movimento_aguardado_da_escrita_agrupada_invalida(app_e_produto):
+    cliente, app_modulo, produto_id = app_e_produto
+    etag = ler_etag(cliente, produto_id)
+
+    resposta = cliente.post(f'/api/produto/{produto_id}/movimento?aguardar=1', json={"delta": 4})
+    assert resposta.status_code == 200
+    # ao_confirmar roda antes de o Future ser resolvido: a resposta já encontra o cache limpo
+    assert app_modulo.cache_produtos.por_id(produto_id) is None
+    assert confirmar_mudanca(cliente, produto_id, etag)['produto']['quantidade'] == 24
+
+
+def test_normalizacao_de_imagem_invalida(main, cliente_main):
+    """A fila de normalização troca a imagem e grava a miniatura numa thread própria"""
+    pasta = main.app.config['IMAGENS_FOLDER']
+    os.makedirs(pasta, exist_ok=True)
+    buffer = io.BytesIO()
+    Image.new('RGB', (1200, 900), (10, 120, 200)).save(buffer, format='PNG')
+    original = salvar_blob(pasta, buffer.getvalue(), 'png')
+    produto_id = produto_main(main, "Cache imagem", imagem_arquivo=original)
+
+    etag = ler_etag(cliente_main, produto_id)
+    assert main.cache_produtos.por_id(produto_id)[0]['miniatura_arquivo'] is None
+
+    main.normalizar_imagem('imagem_arquivo', original)
+    main.fila_imagens.aguardar()
+    assert main.cache_produtos.por_id(produto_id) is None
+
+    produto = confirmar_mudanca(cliente_main, produto_id, etag)['produto']
+    assert produto['miniatura_url'] is not None
+    assert not produto['imagem_url'].endswith(original)
+
+
+def test_deletar_invalida(main, cliente_main):
+    produto_id = produto_main(main, "Cache deletado")
+    ler_etag(cliente_main, produto_id)
+
+    cliente_main.post(f'/deletar_produto/{produto_id}')
+    assert cliente_main.get(f'/api/produto/{produto_id}').status_code == 404
@@ -0,0 +1,151 @@
+"""
+Alocação dos códigos de produto (codigos.py)
+
+A permutação não repete código, blocos reservados (por processos
+diferentes ou em sequência) são disjuntos e fora de ordem, códigos já
+cadastrados são pulados, e um cadastro recusado na validação não gasta
+código: o próximo cadastro aceito recebe o código seguinte da sequência.
+
+    python -m pytest test_codigos.py
+"""
+
+import base64
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from banco_dados import abrir_conexao
+from codigos import (DESLOCAMENTO, MULTIPLICADOR, TOTAL_CODIGOS, AlocadorCodigos, codigo_da_posicao,
+                     criar_tabela, reservar_codigos)
+
+
+@pytest.fixture
+def banco(tmp_path):
+    """Banco só com o que a alocação usa: produtos(codigo) único e a sequência"""
+    caminho = str(tmp_path / 'codigos.db')
+    conn = abrir_conexao(caminho)
+    conn.execute("CREATE TABLE produtos (id INTEGER PRIMARY KEY, codigo TEXT UNIQUE)")
+    criar_tabela(conn)
+    conn.commit()
+    yield caminho, conn
+    conn.close()
+
+
+def posicao_do_codigo(codigo):
+    """Inversa de codigo_da_posicao"""
+    return (int(codigo) - DESLOCAMENTO) * pow(MULTIPLICADOR, -1, TOTAL_CODIGOS) % TOTAL_CODIGOS
+
+
+def sequenciais(codigos):
+    """Pares vizinhos na lista que também são vizinhos em número"""
+    return [(a, b) for a, b in zip(codigos, codigos[1:]) if abs(int(a) - int(b)) == 1]
+
+
+def test_permutacao_nao_repete():
+    codigos = {(posicao * MULTIPLICADOR + DESLOCAMENTO) % TOTAL_CODIGOS for posicao in range(TOTAL_CODIGOS)}
+    assert len(codigos) == TOTAL_CODIGOS
+    assert all(posicao_do_codigo(codigo_da_posicao(p)) == p for p in (0, 1, 12345, TOTAL_CODIGOS - 1))
+
+
+def test_blocos_disjuntos_e_fora_de_ordem(banco):
+    _, conn = banco
+    blocos = [reservar_codigos(conn, 50) for _ in range(4)]
+    todos = [codigo for bloco in blocos for codigo in bloco]
+
+    assert len(todos) == len(set(todos)) == 200
+    assert all(len(codigo) == 6 and codigo.isdigit() for codigo in todos)
+    assert not sequenciais(todos)
+    assert todos != sorted(todos)
+
+
+def test_pula_codigos_ja_cadastrados(banco):
+    _, conn = banco
+    ocupados = [codigo_da_posicao(1), codigo_da_posicao(3)]
+    conn.executemany("INSERT INTO produtos (codigo) VALUES (?)", [(codigo,) for codigo in ocupados])
+    conn.commit()
+
+    reservados = reservar_codigos(conn, 5, reservados={codigo_da_posicao(4)})
+    assert reservados == [codigo_da_posicao(p) for p in (0, 2, 5, 6, 7)]
+
+
+def test_reserva_exige_conexao_sem_transacao(banco):
+    _, conn = banco
+    conn.execute("INSERT INTO produtos (codigo) VALUES ('x')")
+    with pytest.raises(RuntimeError):
+        reservar_codigos(conn, 1)
+    conn.rollback()
+
+
+def test_alocadores_de_processos_diferentes_nao_repetem(banco):
+    """Dois alocadores no mesmo banco (dois workers) recebem blocos disjuntos"""
+    caminho, _ = banco
+    primeiro, segundo = AlocadorCodigos(caminho, bloco=8), AlocadorCodigos(caminho, bloco=8)
+    codigos = []
+    for _ in range(30):
+        codigos.append(primeiro.proximo())
+        codigos.append(segundo.proximo())
+
+    assert len(set(codigos)) == 60
+    assert not sequenciais(codigos)
+    # Os dois juntos usaram as posições 0..63 (4 blocos de 8 cada), nenhuma duas vezes
+    assert {posicao_do_codigo(codigo) for codigo in codigos} <= set(range(64))
+
+
+# -----------------------------------------------------------
+# CADASTRO PELAS ROTAS: CÓDIGO SÓ DEPOIS DA VALIDAÇÃO
+# -----------------------------------------------------------
+
+def foto(semente):
+    rnd = random.Random(semente)
+    img = Image.new('RGB', (64, 48), tuple(rnd.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG')
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def proximo_livre(conn, codigo):
+    """Código que vem depois de `codigo` na sequência, pulando os já cadastrados"""
+    posicao = posicao_do_codigo(codigo) + 1
+    while conn.execute("SELECT 1 FROM produtos WHERE codigo = ?", (codigo_da_posicao(posicao),)).fetchone():
+        posicao += 1
+    return codigo_da_posicao(posicao)
+
+
+RECUSADOS = (
+    {"nome": "", "localizacao": "A1", "quantidade": 1},
+    {"nome": "Recusado", "localizacao": "A1", "quantidade": -1},
+    {"nome": "Recusado", "localizacao": "A1", "quantidade": 1, "preco": -5},
+)
+
+
+def cadastros_sem_gastar_codigo(cliente, rota, pool, prefixo):
+    corpo = {"localizacao": "A1", "quantidade": 1, "preco": 2.5}
+    primeiro = cliente.post(rota, json={**corpo, "nome": f"{prefixo} 1", "imagem_base64": foto(1)})
+    assert primeiro.status_code == 201, primeiro.get_json()
+    conn = pool.obter()
+    try:
+        esperado = proximo_livre(conn, primeiro.get_json()['codigo'])
+    finally:
+        pool.devolver(conn)
+
+    for numero, recusado in enumerate(RECUSADOS):
+        resposta = cliente.post(rota, json={**recusado, "imagem_base64": foto(10 + numero)})
+        assert resposta.status_code == 400, resposta.get_json()
+    sem_imagem = cliente.post(rota, json={**corpo, "nome": f"{prefixo} 3", "imagem_base64": "data:image/jpeg;base64,AAAA"})
+    assert sem_imagem.status_code == 400, sem_imagem.get_json()
+
+    segundo = cliente.post(rota, json={**corpo, "nome": f"{prefixo} 2", "imagem_base64": foto(3)})
+    assert segundo.status_code == 201, segundo.get_json()
+    assert segundo.get_json()['codigo'] == esperado
+
+
+def test_cadastro_recusado_nao_gasta_codigo_main(main, cliente_main):
+    cadastros_sem_gastar_codigo(cliente_main, '/api/cadastrar_scanner', main.pool_conexoes, "Código main")
+    main.fila_imagens.aguardar()
+    main.cache_qrcodes.aguardar()
+
+
+def test_cadastro_recusado_nao_gasta_codigo_scanner_api(scanner_api, cliente_scanner):
+    cadastros_sem_gastar_codigo(cliente_scanner, '/api/cadastrar', scanner_api.pool_conexoes, "Código scanner")
@@ -0,0 +1,142 @@
+"""
+Leitor de QR Code do servidor (leitor_qrcode.py)
+
+Decodifica o QR Code da etiqueta antiga (A32__qr.png), os PNGs que o app
+gera para static/qrcodes (qrcodes.renderizar) e QR Codes gerados em várias
+versões e níveis de correção; depois girados, dentro de uma foto maior e
+com módulos danificados. Fotos sem QR Code precisam devolver None.
+
+    python -m pytest test_leitor_qrcode.py
+"""
+
+import io
+import os
+import random
+import time
+
+import pytest
+import qrcode
+from PIL import Image, ImageDraw
+
+import leitor_qrcode
+from leitor_qrcode import TempoEsgotado, decodificar_matriz, ler_qrcode, ler_qrcode_limitado
+from qrcodes import renderizar
+
+PASTA_PROJETO = os.path.dirname(os.path.abspath(__file__))
+NIVEIS = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+FOTOS_SEM_QRCODE = ('teste1_mouse.jpg', 'teste2a_teclado.jpg', 'teste3a_azul.jpg',
+                    'teste4_alta.jpg', '561504_20251116092310.jpg')
+
+
+def novo_qrcode(texto, versao, nivel, **opcoes):
+    # Máscara fixa (uma por versão): a escolha da melhor máscara é o que mais demora no qrcode
+    qr = qrcode.QRCode(version=versao, error_correction=NIVEIS[nivel], mask_pattern=versao % 8, **opcoes)
+    qr.add_data(texto)
+    qr.make(fit=False)
+    return qr
+
+
+def imagem_qrcode(texto, versao=3, nivel='M', box_size=6):
+    """Imagem PIL (tons de cinza) do QR Code, com a margem branca padrão"""
+    qr = novo_qrcode(texto, versao, nivel, box_size=box_size, border=4)
+    return qr.make_image().get_image().convert('L')
+
+
+def em_bytes(img, formato='PNG'):
+    buffer = io.BytesIO()
+    img.save(buffer, format=formato)
+    return buffer.getvalue()
+
+
+def arquivo(nome):
+    with open(os.path.join(PASTA_PROJETO, nome), 'rb') as f:
+        return f.read()
+
+
+def test_etiqueta_antiga():
+    texto = ler_qrcode(arquivo('A32__qr.png'))
+    assert texto is not None
+    assert 'Nome: A32' in texto
+
+
+@pytest.mark.parametrize('codigo', ['000001', '271828', '999999', 'A32-B/7'])
+def test_qrcode_do_app(codigo):
+    """O PNG servido em /qrcode/<codigo>.png (o mesmo de static/qrcodes)"""
+    assert ler_qrcode(renderizar(codigo, 'png')) == codigo
+
+
+@pytest.mark.parametrize('nivel', NIVEIS)
+@pytest.mark.parametrize('versao', [1, 2, 5, 7, 10, 14, 15, 20, 25, 32, 40])
+def test_versoes_e_niveis(versao, nivel):
+    texto = f"PRODUTO-{versao}{nivel}"
+    assert ler_qrcode(em_bytes(imagem_qrcode(texto, versao, nivel, box_size=4))) == texto
+
+
+@pytest.mark.parametrize('nivel', NIVEIS)
+def test_matriz_ideal_de_todas_as_versoes(nivel):
+    """Sem a imagem: a matriz de módulos, da versão 1 à 40"""
+    for versao in range(1, 41):
+        texto = f"V{versao}{nivel}"
+        modulos = novo_qrcode(texto, versao, nivel, border=0).modules
+        matriz = [[1 if modulo else 0 for modulo in linha] for linha in modulos]
+        assert decodificar_matriz(matriz) == texto, versao
+
+
+@pytest.mark.parametrize('angulo', [90, 180, 270, 15, 30, 45, 135])
+def test_girado(angulo):
+    img = imagem_qrcode('123456').rotate(angulo, expand=True, fillcolor=255)
+    assert ler_qrcode(em_bytes(img)) == '123456'
+
+
+def test_dentro_de_uma_foto():
+    foto = Image.open(io.BytesIO(arquivo('teste1_mouse.jpg'))).convert('RGB')
+    foto.paste(imagem_qrcode('654321', box_size=4).convert('RGB'), (50, 60))
+    assert ler_qrcode(em_bytes(foto, 'JPEG')) == '654321'
+
+
+def test_modulos_danificados():
+    """Nível H recupera ~30% dos bytes: uma mancha no meio não impede a leitura"""
+    img = imagem_qrcode('123456', versao=4, nivel='H', box_size=6)
+    centro = img.size[0] // 2
+    ImageDraw.Draw(img).rectangle((centro - 15, centro - 15, centro + 15, centro + 15), fill=0)
+    assert ler_qrcode(em_bytes(img)) == '123456'
+
+
+@pytest.mark.parametrize('nome', FOTOS_SEM_QRCODE)
+def test_foto_sem_qrcode(nome):
+    assert ler_qrcode(arquivo(nome)) is None
+
+
+def test_imagens_sem_qrcode():
+    ruido = Image.frombytes('L', (400, 300), random.Random(1).randbytes(400 * 300))
+    assert ler_qrcode(em_bytes(ruido)) is None
+    assert ler_qrcode(em_bytes(Image.new('L', (300, 300), 255))) is None
+    assert ler_qrcode(em_bytes(Image.new('L', (300, 300), 0))) is None
+
+
+def test_prazo_vencido():
+    with pytest.raises(TempoEsgotado):
+        ler_qrcode(renderizar('123456', 'png'), prazo=time.time() - 1)
+
+
+def test_leitura_no_pool():
+    assert ler_qrcode_limitado(renderizar('123456', 'png')) == ('123456', leitor_qrcode.LIDO)
+    assert ler_qrcode_limitado(arquivo('teste1_mouse.jpg')) == (None, leitor_qrcode.SEM_QRCODE)
+
+
+def test_tempo_limite_no_pool():
+    """A leitura desiste no prazo e libera os processos para as próximas"""
+    # Ruído grande: mais de um segundo de tentativas até desistir sem o prazo
+    ruido = em_bytes(Image.frombytes('L', (1600, 1600), random.Random(2).randbytes(1600 * 1600)))
+    ler_qrcode_limitado(renderizar('000001', 'png'))  # processos do pool já iniciados
+    for _ in range(leitor_qrcode.MAX_TRABALHADORES):
+        assert ler_qrcode_limitado(ruido, tempo_limite=0.2) == (None, leitor_qrcode.TEMPO_ESGOTADO)
+
+    inicio = time.perf_counter()
+    assert ler_qrcode_limitado(renderizar('123456', 'png'), tempo_limite=0.5) == ('123456', leitor_qrcode.LIDO)
+    assert time.perf_counter() - inicio < 0.5
@@ -0,0 +1,160 @@
+"""
+Movimentos de estoque e o histórico (movimentos.py)
+
+Uma saída maior que o estoque é recusada sem gravar nada (nem no lote
+inteiro), saídas simultâneas de vários workers nunca deixam a quantidade
+negativa nem se perdem, e as linhas da tabela movimentos somam exatamente
+a mudança de quantidade de cada produto.
+
+    python -m pytest test_movimentos.py
+"""
+
+import random
+import threading
+
+import pytest
+
+from banco_dados import abrir_conexao
+from movimentos import (EstoqueInsuficiente, ProdutoNaoEncontrado, aplicar_movimentos, criar_tabela,
+                        ler_movimentos)
+
+
+@pytest.fixture
+def banco(tmp_path):
+    """Banco só com o que os movimentos usam; produtos 1..5 com quantidade 10"""
+    caminho = str(tmp_path / 'movimentos.db')
+    conn = abrir_conexao(caminho)
+    conn.execute("""
+        CREATE TABLE produtos (
+            id INTEGER PRIMARY KEY, codigo TEXT UNIQUE, quantidade INTEGER NOT NULL, atualizado_em TIMESTAMP
+        )
+    """)
+    criar_tabela(conn)
+    conn.executemany("INSERT INTO produtos (id, codigo, quantidade) VALUES (?, ?, 10)",
+                     [(i, f"C{i}") for i in range(1, 6)])
+    conn.commit()
+    yield caminho, conn
+    conn.close()
+
+
+def quantidade(conn, produto_id):
+    return conn.execute("SELECT quantidade FROM produtos WHERE id = ?", (produto_id,)).fetchone()[0]
+
+
+def historico(conn, produto_id=None):
+    sql = "SELECT produto_id, delta, quantidade_resultante FROM movimentos"
+    if produto_id is not None:
+        return [tuple(linha) for linha in conn.execute(sql + " WHERE produto_id = ? ORDER BY id", (produto_id,))]
+    return [tuple(linha) for linha in conn.execute(sql + " ORDER BY id")]
+
+
+def test_saida_maior_que_estoque_nao_grava_nada(banco):
+    _, conn = banco
+    with pytest.raises(EstoqueInsuficiente):
+        aplicar_movimentos(conn, ler_movimentos({"delta": -11}, produto_id=1))
+    assert quantidade(conn, 1) == 10
+    assert historico(conn) == []
+
+    # Lote: o primeiro movimento seria válido, mas o lote inteiro é desfeito
+    lote = ler_movimentos({"movimentos": [{"codigo": "C2", "delta": 5}, {"produto_id": 3, "delta": -20}]})
+    with pytest.raises(EstoqueInsuficiente):
+        aplicar_movimentos(conn, lote)
+    assert (quantidade(conn, 2), quantidade(conn, 3)) == (10, 10)
+    assert historico(conn) == []
+
+
+def test_produto_inexistente_nao_grava_nada(banco):
+    _, conn = banco
+    lote = ler_movimentos({"movimentos": [{"produto_id": 1, "delta": 1}, {"codigo": "NAO-EXISTE", "delta": 1}]})
+    with pytest.raises(ProdutoNaoEncontrado):
+        aplicar_movimentos(conn, lote)
+    assert quantidade(conn, 1) == 10
+    assert historico(conn) == []
+
+
+def test_saida_ate_zerar(banco):
+    _, conn = banco
+    aplicados = aplicar_movimentos(conn, ler_movimentos({"delta": -10}, produto_id=4), usuario='teste')
+    assert [(m['produto_id'], m['delta'], m['quantidade']) for m in aplicados] == [(4, -10, 0)]
+    assert historico(conn, 4) == [(4, -10, 0)]
+
+
+def test_saidas_simultaneas_nunca_negativam(banco):
+    """Várias conexões (como vários workers) tirando do mesmo produto ao mesmo tempo"""
+    caminho, conn = banco
+    conn.execute("UPDATE produtos SET quantidade = 50 WHERE id = 1")
+    conn.commit()
+
+    threads, tentativas = 8, 10
+    aceitos, recusados = [], []
+    largada = threading.Barrier(threads)
+
+    def separar():
+        propria = abrir_conexao(caminho)
+        try:
+            largada.wait()
+            for _ in range(tentativas):
+                try:
+                    aceitos.extend(aplicar_movimentos(propria, ler_movimentos({"delta": -1}, produto_id=1)))
+                except EstoqueInsuficiente:
+                    recusados.append(1)
+        finally:
+            propria.close()
+
+    trabalhadores = [threading.Thread(target=separar) for _ in range(threads)]
+    for thread in trabalhadores:
+        thread.start()
+    for thread in trabalhadores:
+        thread.join()
+
+    assert len(aceitos) == 50
+    assert len(recusados) == threads * tentativas - 50
+    assert quantidade(conn, 1) == 0
+    # Cada saída aceita deixou uma quantidade diferente: nenhuma leu um valor velho
+    assert sorted(m['quantidade'] for m in aceitos) == list(range(50))
+    assert len(historico(conn, 1)) == 50
+
+
+def test_historico_soma_a_mudanca_de_quantidade(banco):
+    _, conn = banco
+    rnd = random.Random(17)
+    for _ in range(200):
+        lote = [{"produto_id": rnd.randint(1, 5), "delta": rnd.choice([-3, -2, -1, 1, 2, 4])}
+                for _ in range(rnd.randint(1, 4))]
+        try:
+            aplicar_movimentos(conn, ler_movimentos({"movimentos": lote}))
+        except EstoqueInsuficiente:
+            pass
+
+    for produto_id in range(1, 6):
+        linhas = historico(conn, produto_id)
+        assert 10 + sum(delta for _, delta, _ in linhas) == quantidade(conn, produto_id)
+        # Cada linha parte da quantidade deixada pela anterior
+        anterior = 10
+        for _, delta, resultante in linhas:
+            assert resultante == anterior + delta >= 0
+            anterior = resultante
+
+
+def test_rota_recusa_saida_sem_estoque(main, cliente_main):
+    conn = main.pool_conexoes.obter()
+    try:
+        produto_id, estoque = conn.execute("SELECT id, quantidade FROM produtos WHERE id = 7").fetchone()
+        antes = conn.execute("SELECT COUNT(*) FROM movimentos WHERE produto_id = ?", (produto_id,)).fetchone()[0]
+    finally:
+        main.pool_conexoes.devolver(conn)
+
+    resposta = cliente_main.post(f'/api/produto/{produto_id}/movimento', json={"delta": -(estoque + 1)})
+    assert resposta.status_code == 409
+
+    resposta = cliente_main.post(f'/api/produto/{produto_id}/movimento', json={"delta": -estoque})
+    assert resposta.status_code == 200
+    assert resposta.get_json()['movimentos'][0]['quantidade'] == 0
+
+    conn = main.pool_conexoes.obter()
+    try:
+        assert quantidade(conn, produto_id) == 0
+        assert conn.execute("SELECT COUNT(*) FROM movimentos WHERE produto_id = ?",
+                            (produto_id,)).fetchone()[0] == antes + 1
+    finally:
+        main.pool_conexoes.devolver(conn)
@@ -0,0 +1,200 @@
+"""
+Regressão dos planos de consulta: as consultas quentes das rotas usam índice
+
+Usa os bancos montados pelas fixtures main e scanner_api (conftest.py)
+numa pasta temporária, chama cada rota pelo test client, captura os comandos que
+ela executa (banco_dados.OUVINTES_SQL) e roda EXPLAIN QUERY PLAN em cada um.
+O teste falha se algum ler a tabela produtos inteira (SCAN produtos): com
+poucas linhas ninguém percebe, num armazém com 500 mil vira timeout.
+
+    python -m pytest test_planos_consulta.py
+"""
+
+import contextlib
+import re
+from urllib.parse import quote
+
+import pytest
+
+from banco_dados import OUVINTES_SQL
+from consultas_lentas import COMANDOS_COM_PLANO, plano_consulta, varredura_completa
+
+_APELIDO = re.compile(r"\bprodutos\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+PALAVRAS_SQL = {'WHERE', 'SET', 'ORDER', 'GROUP', 'LIMIT', 'JOIN', 'INNER', 'LEFT', 'CROSS',
+                'ON', 'USING', 'VALUES', 'DEFAULT', 'WINDOW', 'UNION', 'RETURNING', 'INDEXED', 'NOT'}
+
+
+def nomes_produtos(sql):
+    """'produtos' e os apelidos que a tabela recebe no comando (FROM produtos p)"""
+    nomes = {'produtos'}
+    for apelido in _APELIDO.findall(sql):
+        if apelido.upper() not in PALAVRAS_SQL:
+            nomes.add(apelido)
+    return nomes
+
+
+@contextlib.contextmanager
+def capturar_comandos():
+    """Lista de (conexão, sql, parâmetros) executados dentro do bloco"""
+    comandos = []
+
+    def ouvinte(conn, sql, parametros, duracao):
+        comandos.append((conn, sql, parametros))
+
+    OUVINTES_SQL.append(ouvinte)
+    try:
+        yield comandos
+    finally:
+        OUVINTES_SQL.remove(ouvinte)
+
+
+def planos_de_produtos(comandos):
+    """[(sql, plano)] dos comandos que leem ou gravam na tabela produtos"""
+    planos = []
+    for conn, sql, parametros in comandos:
+        if parametros is None or not sql.lstrip()[:7].upper().startswith(COMANDOS_COM_PLANO):
+            continue
+        if not re.search(r"\bprodutos\b", sql):
+            continue
+        planos.append((' '.join(sql.split()), plano_consulta(conn, sql, parametros)))
+    return planos
+
+
+def verificar_rota(cliente, cache, chamada):
+    """Executa a chamada e falha se algum comando dela varrer produtos"""
+    if hasattr(chamada, 'preparar'):
+        chamada.preparar(cliente)
+    cache.limpar()  # o cache de produtos esconderia a consulta
+    with capturar_comandos() as comandos:
+        resposta = chamada(cliente)
+    assert resposta.status_code < 400, resposta.get_data(as_text=True)
+
+    planos = planos_de_produtos(comandos)
+    assert planos, "a rota não consultou a tabela produtos"
+    varreduras = [
+        f"{sql}\n    -> {plano}"
+        for sql, plano in planos
+        if varredura_completa(plano, nomes_produtos(sql))
+    ]
+    assert not varreduras, "consulta sem índice:\n" + "\n".join(varreduras)
+
+
+class SegundaPagina:
+    """Pede a primeira página (fora da captura) e mede a consulta da segunda"""
+
+    def __init__(self, url):
+        self.url = url
+        self.cursor = None
+
+    def preparar(self, cliente):
+        self.cursor = cliente.get(self.url).get_json()['proximo_cursor']
+        assert self.cursor, "a primeira página não devolveu cursor"
+
+    def __call__(self, cliente):
+        return cliente.get(f"{self.url}&cursor={quote(self.cursor)}")
+
+
+ROTAS_MAIN = {
+    'codigo': lambda c: c.post('/api/scan', json={"codigo": "001234"}),
+    'codigos_em_lote': lambda c: c.post('/api/scan/batch', json={"itens": ["000010", "000020", "000030"]}),
+    'id': lambda c: c.get('/api/produto/42'),
+    'nome_normalizado': lambda c: c.post('/buscar_produto', data={"busca": "produto 77"}),
+    'estoque_baixo': lambda c: c.get('/estoque_baixo'),
+    'listagem': lambda c: c.get('/api/produtos?limit=20'),
+    'listagem_categoria': lambda c: c.get('/api/produtos?limit=20&categoria=Cat3'),
+    'listagem_quantidade': lambda c: c.get('/api/produtos?limit=20&quantidade_min=10&quantidade_max=20'),
+    'listagem_quantidade_segunda_pagina': SegundaPagina('/api/produtos?limit=20&quantidade_min=10'),
+    'listagem_segunda_pagina': SegundaPagina('/api/produtos?limit=20'),
+    'listagem_scanner': lambda c: c.get('/api/produtos_scanner?limit=20'),
+    'listagem_scanner_segunda_pagina': SegundaPagina('/api/produtos_scanner?limit=20'),
+    'busca_texto': lambda c: c.get('/api/produtos/search?q=produto 12'),
+    'movimento': lambda c: c.post('/api/produto/42/movimento', json={"delta": 1}),
+    'movimentos_por_codigo': lambda c: c.post('/api/movimentos', json={"movimentos": [{"codigo": "000042", "delta": 1}]}),
+}
+
+ROTAS_SCANNER = {
+    'id': lambda c: c.get('/api/produto/42'),
+    'listagem': lambda c: c.get('/api/produtos?limit=20'),
+    'listagem_categoria': lambda c: c.get('/api/produtos?limit=20&categoria=Cat3'),
+    'listagem_segunda_pagina': SegundaPagina('/api/produtos?limit=20'),
+    'atualizacao': lambda c: c.put('/api/produto/42', json={"quantidade": 5}),
+    'movimentos_por_codigo': lambda c: c.post('/api/movimentos', json={"movimentos": [{"codigo": "000042", "delta": 1}]}),
+}
+
+
+# Listagens filtradas: além de não varrer a tabela, não podem percorrer um
+# índice inteiro (SCAN ... USING INDEX) testando o filtro linha a linha nem
+# ordenar a faixa filtrada numa B-tree temporária; os dois crescem com a tabela
+LISTAGENS_FILTRADAS = {
+    'categoria': '/api/produtos?limit=20&categoria=Cat3',
+    'quantidade': '/api/produtos?limit=20&quantidade_min=10&quantidade_max=20',
+    'quantidade_minima': '/api/produtos?limit=20&quantidade_min=45',
+    'categoria_quantidade': '/api/produtos?limit=20&categoria=Cat3&quantidade_max=5',
+    'quantidade_segunda_pagina': SegundaPagina('/api/produtos?limit=20&quantidade_max=20'),
+    'categoria_quantidade_segunda_pagina': SegundaPagina('/api/produtos?limit=20&categoria=Cat3&quantidade_min=10'),
+}
+
+
+@pytest.mark.parametrize('nome', LISTAGENS_FILTRADAS)
+def test_listagem_filtrada_busca_no_indice(nome, main, cliente_main):
+    chamada = LISTAGENS_FILTRADAS[nome]
+    if not hasattr(chamada, 'preparar'):
+        url, chamada = chamada, lambda c: c.get(url)
+    else:
+        chamada.preparar(cliente_main)
+    with capturar_comandos() as comandos:
+        resposta = chamada(cliente_main)
+    assert resposta.status_code == 200, resposta.get_data(as_text=True)
+
+    planos = [(sql, plano) for sql, plano in planos_de_produtos(comandos) if 'ORDER BY' in sql]
+    assert planos, "a listagem não consultou a tabela produtos"
+    for sql, plano in planos:
+        assert not any(passo.startswith('SCAN ') or 'TEMP B-TREE' in passo for passo in plano), \
+            f"{sql}\n    -> {plano}"
+
+
+def test_listagem_por_quantidade_pagina_em_ordem(main, cliente_main):
+    """Com faixa de quantidade as páginas seguem (quantidade, id), sem repetir nem pular"""
+    url = '/api/produtos?limit=30&fields=id,quantidade&quantidade_min=10&quantidade_max=12'
+    vistos, cursor = [], None
+    while True:
+        pagina = cliente_main.get(url + (f"&cursor={quote(cursor)}" if cursor else '')).get_json()
+        vistos += [(produto['quantidade'], produto['id']) for produto in pagina['produtos']]
+        cursor = pagina['proximo_cursor']
+        if not cursor:
+            break
+    conn = main.pool_conexoes.obter()
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM produtos WHERE quantidade BETWEEN 10 AND 12").fetchone()[0]
+    finally:
+        main.pool_conexoes.devolver(conn)
+    assert vistos == sorted(vistos)
+    assert len(vistos) == len(set(vistos)) == total
+
+
+def test_cursor_de_outra_ordem_e_recusado(main, cliente_main):
+    cursor = cliente_main.get('/api/produtos?limit=5').get_json()['proximo_cursor']
+    resposta = cliente_main.get(f'/api/produtos?limit=5&quantidade_min=1&cursor={quote(cursor)}')
+    assert resposta.status_code == 400
+
+
+@pytest.mark.parametrize('nome', ROTAS_MAIN)
+def test_main_usa_indices(nome, main, cliente_main):
+    verificar_rota(cliente_main, main.cache_produtos, ROTAS_MAIN[nome])
+
+
+@pytest.mark.parametrize('nome', ROTAS_SCANNER)
+def test_scanner_api_usa_indices(nome, scanner_api, cliente_scanner):
+    verificar_rota(cliente_scanner, scanner_api.cache_produtos, ROTAS_SCANNER[nome])
+
+
+def test_detecta_varredura(main):
+    """O próprio teste precisa enxergar uma consulta sem índice"""
+    conn = main.pool_conexoes.obter()
+    try:
+        sql = "SELECT * FROM produtos WHERE TRIM(LOWER(nome)) = ?"
+        assert varredura_completa(plano_consulta(conn, sql, ("produto 1",)), nomes_produtos(sql))
+        sql = "SELECT p.id FROM produtos AS p WHERE p.preco > ?"
+        assert varredura_completa(plano_consulta(conn, sql, (1,)), nomes_produtos(sql))
+    finally:
+        main.pool_conexoes.devolver(conn)